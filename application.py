@@ -1,10 +1,77 @@
 import dash
 from dash import html, Dash
 import dash_bootstrap_components as dbc
+from flask import Response, jsonify
+
+from bluebikes import (
+    cache,
+    db,
+    executor,
+    figures,
+    jobs,
+    metadata,
+    metrics,
+    refresh,
+    shared,
+    statements,
+    store,
+)
 
 app = Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
 server = app.server
+metrics.instrument_app(app)
+
+
+@server.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@server.route("/stats/db")
+def db_stats():
+    return jsonify(db.pool_stats())
+
+
+@server.route("/stats/cache")
+def cache_stats():
+    return jsonify(dict(cache.results.stats(), shared=shared.store.stats()))
+
+
+@server.route("/stats/queries")
+def query_stats():
+    return jsonify(executor.stats())
+
+
+@server.route("/stats/statements")
+def statement_stats():
+    return jsonify(statements.stats())
+
+
+@server.route("/stats/figures")
+def figure_stats():
+    return jsonify(figures.stats())
+
+
+@server.route("/stats/store")
+def store_stats():
+    return jsonify(store.frames.stats())
+
+
+@server.route("/stats/metadata")
+def metadata_stats():
+    return jsonify(metadata.service.stats())
+
+
+@server.route("/stats/refresh")
+def refresh_stats():
+    return jsonify(refresh.service.stats())
+
+
+@server.route("/stats/jobs")
+def job_stats():
+    return jsonify(dict(jobs.queue.stats(), pool=jobs.pool.stats()))
+
 
 explanation_string = (
     "Bluebikes is Boston's bike share program with more than 400 station and 4,000 bikes in the greater Boston area. "
@@ -45,5 +112,9 @@ app.layout = dbc.Container(
     fluid=True,
 )
 
+# Runs after the pages registered their metadata values.
+refresh.start()
+jobs.start()
+
 if __name__ == "__main__":
     server.run(debug=True)
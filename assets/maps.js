@@ -0,0 +1,110 @@
+// Clientside callbacks drawing the station maps of the Station Map and
+// Station Analysis pages. Station names and coordinates come from the base
+// kept in local storage (see StationDimension.map_base); the server only
+// sends station rows and trip counts.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    maps: {
+        // Every station, sized by the log of its trips, as main_graph sent it.
+        all_stations: function (data, base, layout) {
+            if (!data || !base || data.version !== base.version) {
+                return window.dash_clientside.no_update;
+            }
+            const trips = data.n_trips;
+            let busiest = 0;
+            trips.forEach((n, i) => {
+                if (n > trips[busiest]) {
+                    busiest = i;
+                }
+            });
+            const row = data.rows[busiest];
+            return {
+                data: [
+                    {
+                        type: "scattermapbox",
+                        mode: "markers",
+                        hoverinfo: "text",
+                        text: data.rows.map(
+                            (r, i) => base.name[r] + " (" + trips[i] + " trips)"
+                        ),
+                        lat: data.rows.map((r) => base.lat[r]),
+                        lon: data.rows.map((r) => base.lon[r]),
+                        marker: {
+                            colorscale: layout.colorscale,
+                            size: trips.map(Math.log),
+                            color: trips,
+                            showscale: true,
+                        },
+                    },
+                ],
+                layout: {
+                    template: layout.template,
+                    height: data.height,
+                    title: { text: data.title },
+                    font: { size: 16 },
+                    mapbox: Object.assign({}, layout.mapbox, {
+                        center: { lat: base.lat[row], lon: base.lon[row] },
+                        zoom: data.zoom,
+                    }),
+                },
+            };
+        },
+        // The top destinations of a station, sized between 10 and 20 by
+        // their trips, with a marker on the station itself.
+        top_stations: function (data, base, layout) {
+            if (!data || !base || data.version !== base.version) {
+                return window.dash_clientside.no_update;
+            }
+            const trips = data.n_trips;
+            const least = Math.min(...trips);
+            const most = Math.max(...trips);
+            const station = data.station;
+            const name = base.name[station];
+            const lat = base.lat[station];
+            const lon = base.lon[station];
+            return {
+                data: [
+                    {
+                        type: "scattermapbox",
+                        mode: "markers",
+                        hoverinfo: "text",
+                        text: data.rows.map(
+                            (r, i) => base.name[r] + " (" + trips[i] + " trips)"
+                        ),
+                        lat: data.rows.map((r) => base.lat[r]),
+                        lon: data.rows.map((r) => base.lon[r]),
+                        marker: {
+                            colorscale: layout.colorscale,
+                            size: trips.map(
+                                (n) => (10 * (n - least)) / (most - least) + 10
+                            ),
+                            allowoverlap: false,
+                            color: trips,
+                            showscale: true,
+                        },
+                    },
+                    {
+                        type: "scattermapbox",
+                        name: name,
+                        mode: "markers",
+                        hoverinfo: "text",
+                        text: name,
+                        lat: [lat, lat],
+                        lon: [lon, lon],
+                        marker: { symbol: "marker", size: 20 },
+                    },
+                ],
+                layout: {
+                    template: layout.template,
+                    height: data.height,
+                    title: { text: data.title },
+                    font: { size: 16 },
+                    showlegend: false,
+                    mapbox: Object.assign({}, layout.mapbox, {
+                        center: { lat: lat, lon: lon },
+                        zoom: data.zoom,
+                    }),
+                },
+            };
+        },
+    },
+});
@@ -0,0 +1,82 @@
+// Clientside callbacks of the Station Analysis page.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    stations: {
+        // Line chart of one metric from the series sent by
+        // get_station_graphs_data, drawn like px.line(..., markers=True).
+        plot_metric: function (data, metric, template) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            const title =
+                data.date_type === "Day of Week"
+                    ? metric + " " + data.label + " by Day of Week"
+                    : data.date_type + "ly " + metric + " " + data.label;
+            // Sent while a background job computes the series.
+            if (data.pending) {
+                return {
+                    data: [],
+                    layout: {
+                        template: template,
+                        title: { text: title },
+                        font: { size: 24 },
+                        xaxis: { visible: false },
+                        yaxis: { visible: false },
+                        annotations: [
+                            {
+                                text: data.pending,
+                                showarrow: false,
+                                xref: "paper",
+                                yref: "paper",
+                                x: 0.5,
+                                y: 0.5,
+                            },
+                        ],
+                    },
+                };
+            }
+            const days = [
+                "Monday",
+                "Tuesday",
+                "Wednesday",
+                "Thursday",
+                "Friday",
+                "Saturday",
+                "Sunday",
+            ];
+            const x =
+                data.date_type === "Day of Week"
+                    ? data.x.map((d) => days[d - 1] || d)
+                    : data.x;
+            const trace = {
+                type: "scatter",
+                mode: "lines+markers",
+                x: x,
+                y: data.metrics[metric],
+                line: { color: "#636efa", dash: "solid" },
+                marker: { symbol: "circle" },
+                showlegend: false,
+                hovertemplate:
+                    "Date=%{x}<br>" + metric + "=%{y}<extra></extra>",
+            };
+            if (metric !== "Number of Trips") {
+                trace.customdata = data.metrics["Number of Trips"].map((n) => [n]);
+                trace.hovertemplate =
+                    "Date=%{x}<br>" +
+                    metric +
+                    "=%{y}<br>Number of Trips=%{customdata[0]}<extra></extra>";
+            }
+            return {
+                data: [trace],
+                layout: {
+                    template: template,
+                    title: { text: title },
+                    font: { size: 24 },
+                    xaxis: { title: { text: "Date" } },
+                    yaxis: { title: { text: metric } },
+                    legend: { tracegroupgap: 0 },
+                    margin: { t: 60 },
+                },
+            };
+        },
+    },
+});
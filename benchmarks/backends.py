@@ -0,0 +1,108 @@
+"""
+Time the page queries and a few full-table scans on the configured backend.
+
+    BLUEBIKES_BACKEND=postgres python -m benchmarks.backends
+    BLUEBIKES_BACKEND=columnar python -m benchmarks.backends
+
+Each query runs ``--repeat`` times on a pooled connection, bypassing the
+result cache, and one JSON line per query reports the best and median wall
+time in milliseconds.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import pandas as pd
+
+from bluebikes import db, queries
+from bluebikes.cache import scalar
+
+# Aggregations over every trip that read only a few columns.
+scans = {
+    "trips_by_month": """
+        SELECT date_trunc('month', started_at) AS month, COUNT(*), AVG(duration)
+        FROM trips
+        GROUP BY 1""",
+    "member_share_by_hour": """
+        SELECT extract('hour' from started_at) AS hour,
+        AVG(CASE WHEN member_casual = 'member' THEN 1 ELSE 0 END)
+        FROM trips
+        GROUP BY 1""",
+    "station_starts": """
+        SELECT start_station_id, COUNT(*), SUM(distance)
+        FROM trips
+        GROUP BY 1""",
+}
+
+
+def _page_queries(station_id, start_date, end_date):
+    yield "station_trip_counts", queries.station_trip_counts.uncached, (
+        "start",
+        start_date,
+        end_date,
+    )
+    yield "top_destinations", queries.top_destinations.uncached, (
+        station_id,
+        "start",
+        start_date,
+        end_date,
+    )
+    yield "station_basics", queries.station_basics.uncached, (
+        station_id,
+        start_date,
+        end_date,
+    )
+    for date_type in queries.date_type_conversions:
+        yield f"time_buckets_{date_type}", queries.time_buckets.uncached, (
+            station_id,
+            "start",
+            date_type,
+            start_date,
+            end_date,
+        )
+
+
+def _read(query):
+    with db.connect() as conn:
+        return pd.read_sql(query, con=conn)
+
+
+def _time(func, args, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+    return {
+        "best_ms": round(min(seconds) * 1000, 1),
+        "median_ms": round(statistics.median(seconds) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--station-id", default=None)
+    parser.add_argument("--start", default="2020-01-01")
+    parser.add_argument("--end", default=pd.Timestamp.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    station_id = args.station_id
+    if station_id is None:
+        station_id = _read(
+            "SELECT start_station_id FROM trips GROUP BY 1 ORDER BY COUNT(*) desc LIMIT 1"
+        ).squeeze()
+    station_id = scalar(station_id)
+
+    cases = [(name, _read, (query,)) for name, query in scans.items()]
+    cases += list(_page_queries(station_id, args.start, args.end))
+    for name, func, func_args in cases:
+        result = {"backend": db.backend, "query": name}
+        result.update(_time(func, func_args, args.repeat))
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Time the page callbacks end to end on the configured database.
+
+    python -m benchmarks.callbacks [--repeat N] [--station NAME] [--warm] > before.jsonl
+
+Imports the app, then calls ``plot_station``, ``gather_data``, ``main_graph``,
+``get_station_graphs_data`` and ``flow_graph`` directly for the pages'
+default range and for the last month, the last year and the full history
+ending at the latest trip. The result cache is emptied before every call
+unless ``--warm`` is given, and the host-wide shared cache is only used with
+``--warm``. Prints a first JSON line describing the dataset,
+then one line per callback and range with the p50 and p95 wall time in
+milliseconds, the rows Postgres read for one call (sequential scan rows plus
+index entries, from its statistics views; null on the columnar backend) and
+the bytes of the response Dash would send. Lines sort the same way every
+run, so two runs diff line by line.
+
+Load a synthetic dataset of the wanted size first with ``benchmarks.synthetic``.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+from sqlalchemy import event
+
+from bluebikes import cache, cube, db, dimension, metadata, shared
+
+# Rows returned by sequential scans plus index entries read, which also counts
+# index-only scans that never touch the table.
+rows_read_query = """
+    SELECT (SELECT COALESCE(SUM(seq_tup_read), 0) FROM pg_stat_user_tables)
+    + (SELECT COALESCE(SUM(idx_tup_read), 0) FROM pg_stat_user_indexes)"""
+
+
+def _flush_stats(dbapi_connection, connection_record):
+    # Backends publish table statistics at most once a second; force it when a
+    # connection goes back to the pool so the counters include its queries.
+    if dbapi_connection is None:
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SELECT pg_stat_force_next_flush()")
+    cursor.close()
+    dbapi_connection.rollback()
+
+
+def _rows_read():
+    with db.connect() as conn:
+        return int(conn.exec_driver_sql(rows_read_query).scalar())
+
+
+def _settled_rows_read():
+    previous = _rows_read()
+    for _ in range(40):
+        time.sleep(0.05)
+        current = _rows_read()
+        if current == previous:
+            return current
+        previous = current
+    return previous
+
+
+def _call(func, args, warm):
+    if not warm:
+        cache.results.clear()
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def _pages():
+    # Dash only registers the pages once the app is created.
+    from dash import page_registry
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+
+    from bluebikes import jobs, refresh
+
+    # Time cold callbacks, not ones the background refresh has warmed, and
+    # compute long ranges in the callback rather than in background jobs.
+    refresh.background_refresh = False
+    jobs.queue.path = ""
+    import application  # noqa: F401
+
+    # Callbacks read ctx.triggered_id; make it look like an initial page load.
+    context_value.set(AttributeDict(triggered_inputs=[{"prop_id": ".", "value": None}]))
+    return {p["module"]: sys.modules[p["module"]] for p in page_registry.values()}
+
+
+def _cases(pages, station, ranges):
+    stations_page = pages["pages.stations"]
+    station_map = pages["pages.station map"]
+    for range_name, (start, end) in ranges.items():
+        calls = [
+            (
+                "plot_station",
+                stations_page.plot_station,
+                start,
+                end,
+                None,
+                station,
+                "Start",
+            ),
+            (
+                "gather_data",
+                station_map.gather_data,
+                "Start Station",
+                start,
+                end,
+                None,
+                None,
+            ),
+            ("main_graph", station_map.main_graph, "Start Station", start, end),
+        ]
+        for date_type in ("Month", "Week", "Hour"):
+            calls.append(
+                (
+                    f"get_station_graphs_data[{date_type}]",
+                    stations_page.get_station_graphs_data,
+                    station,
+                    date_type,
+                    start,
+                    end,
+                    "Start",
+                )
+            )
+        calls.append(("flow_graph", stations_page.flow_graph, station, start, end))
+        for callback, func, *args in calls:
+            yield callback, range_name, func, args
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--station", default="MIT at Mass Ave / Amherst St")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--warm", action="store_true", help="keep the result cache between calls"
+    )
+    args = parser.parse_args()
+
+    if not args.warm:
+        shared.store.path = ""
+    pages = _pages()
+    count_rows = db.backend == "postgres"
+    if count_rows:
+        event.listen(db.get_engine(), "checkin", _flush_stats)
+
+    # Load what every worker keeps between requests before counting rows.
+    dimension.stations()
+    cube.current()
+    latest = pd.Timestamp(metadata.max_ride_date())
+    end = latest.strftime("%Y-%m-%d")
+    ranges = {
+        "default": ("2023-01-01", end),
+        "month": ((latest - pd.DateOffset(months=1)).strftime("%Y-%m-%d"), end),
+        "year": ((latest - pd.DateOffset(years=1)).strftime("%Y-%m-%d"), end),
+        "full": ("2020-01-01", end),
+    }
+    with db.connect() as conn:
+        n_trips = conn.exec_driver_sql("SELECT COUNT(*) FROM trips").scalar()
+    print(
+        json.dumps(
+            {
+                "backend": db.backend,
+                "trips": n_trips,
+                "stations": len(metadata.station_names()),
+                "latest_day": end,
+                "repeat": args.repeat,
+                "warm": args.warm,
+            }
+        )
+    )
+
+    for callback, range_name, func, func_args in _cases(pages, args.station, ranges):
+        # The first call warms the database's buffers; its row count is the
+        # one reported.
+        before = _settled_rows_read() if count_rows else None
+        _, result = _call(func, func_args, False)
+        rows_read = _settled_rows_read() - before if count_rows else None
+        seconds = [_call(func, func_args, args.warm)[0] for _ in range(args.repeat)]
+        print(
+            json.dumps(
+                {
+                    "callback": callback,
+                    "range": range_name,
+                    "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 1),
+                    "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 1),
+                    "rows_read": rows_read,
+                    "payload_bytes": len(to_json_plotly(result).encode()),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compare the NumPy hourly flow engine with the SQL calendar query it replaced.
+
+    python -m benchmarks.flow [--station-id ID] [--end DAY] [--repeat N]
+
+For ranges from one week up to the full history ending at ``--end``, times
+``queries.hourly_flow`` (a slice of the station-hour cube when ``CUBE_PATH``
+holds one, otherwise one trip scan plus ``np.bincount``) against the old
+``generate_series`` query with its pandas hour-of-day grouping, checks that
+both give the same cumulative and hour-of-day flow, and prints one JSON line
+per range.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from bluebikes import db, queries
+from bluebikes.cache import scalar
+
+ranges = {
+    "week": pd.DateOffset(weeks=1),
+    "month": pd.DateOffset(months=1),
+    "quarter": pd.DateOffset(months=3),
+    "year": pd.DateOffset(years=1),
+}
+
+
+def sql_flow(station_id, start_date, end_date):
+    query = f"""
+    with starts as (SELECT * FROM
+    (
+       SELECT day
+       FROM   generate_series(timestamp '{start_date}'
+                            , timestamp '{end_date}'
+                            , interval  '1 hour') g(day)
+       ) d
+       LEFT JOIN (SELECT DATE_TRUNC('hour', started_at) as Day, COALESCE(COUNT(trip_id), 0) start_trips
+    FROM trips t
+    WHERE t.start_station_id = '{station_id}' and started_at between '{start_date}' and '{end_date}'
+    GROUP BY 1
+    ORDER BY 1) s USING(day)),
+
+    ends as (SELECT * FROM
+    (
+       SELECT day
+       FROM   generate_series(timestamp '{start_date}'
+                            , timestamp '{end_date}'
+                            , interval  '1 hour') g(day)
+       ) d
+       LEFT JOIN (SELECT DATE_TRUNC('hour', started_at) as Day, COALESCE(COUNT(trip_id), 0) end_trips
+    FROM trips t
+    WHERE t.end_station_id = '{station_id}' and started_at between '{start_date}' and '{end_date}'
+    GROUP BY 1
+    ORDER BY 1) s USING(day))
+
+    SELECT s.*,
+    e.end_trips,
+    COALESCE(e.end_trips, 0) - COALESCE(s.start_trips, 0)  flow,
+    SUM(COALESCE(e.end_trips, 0) -COALESCE(s.start_trips, 0)) over (order by s.Day asc rows between unbounded preceding and current row) cumulative_flow
+    FROM starts s LEFT JOIN ends e USING (Day)
+    """
+    with db.connect() as conn:
+        df_flow = pd.read_sql_query(query, con=conn)
+    df_flow["hour"] = df_flow["day"].dt.hour
+    df_flow2 = df_flow.groupby("hour")["flow"].agg([np.mean, np.sum]).reset_index()
+    return df_flow, df_flow2
+
+
+def _best(func, args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--station-id", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with db.connect() as conn:
+        first, last = conn.exec_driver_sql(
+            "SELECT MIN(started_at), MAX(started_at) FROM trips"
+        ).first()
+        station_id = args.station_id
+        if station_id is None:
+            station_id = pd.read_sql(
+                "SELECT start_station_id FROM trips GROUP BY 1 ORDER BY COUNT(*) desc LIMIT 1",
+                con=conn,
+            ).squeeze()
+    station_id = scalar(station_id)
+    end = pd.Timestamp(args.end or last).normalize()
+    starts = {name: end - offset for name, offset in ranges.items()}
+    starts["full"] = pd.Timestamp(first).normalize()
+
+    for name, start in starts.items():
+        flow_args = (station_id, f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}")
+        (hourly, by_hour), flow_seconds = _best(
+            queries.hourly_flow.uncached, flow_args, args.repeat
+        )
+        (sql_hourly, sql_by_hour), sql_seconds = _best(sql_flow, flow_args, args.repeat)
+        same = np.array_equal(
+            hourly["cumulative_flow"], sql_hourly["cumulative_flow"].fillna(0)
+        ) and np.allclose(by_hour[["mean", "sum"]], sql_by_hour[["mean", "sum"]])
+        print(
+            json.dumps(
+                {
+                    "range": name,
+                    "hours": len(hourly),
+                    "hourly_flow_ms": round(flow_seconds * 1000, 1),
+                    "sql_ms": round(sql_seconds * 1000, 1),
+                    "same_result": bool(same),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
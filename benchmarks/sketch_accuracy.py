@@ -0,0 +1,96 @@
+"""
+Compare sketch-merged medians with exact ``PERCENTILE_CONT`` medians.
+
+    python -m benchmarks.sketch_accuracy [--stations N] [--start DAY] [--end DAY]
+
+For the busiest stations, every bucketing the Station Analysis page offers
+(except hourly, which always runs exactly) is computed both ways over the
+range. Prints one JSON line per case with both latencies and the largest
+relative median error, then a summary line.
+"""
+
+import argparse
+import json
+import time
+
+import pandas as pd
+
+from bluebikes import db, queries, sketches
+
+median_columns = [label for _, label in sketches.metrics.values()]
+
+
+def _timed(*args):
+    start = time.perf_counter()
+    result = queries.time_buckets.uncached(*args)
+    return result, time.perf_counter() - start
+
+
+def _busiest_stations(n):
+    query = f"""
+    SELECT start_station_id
+    FROM trips
+    GROUP BY 1
+    ORDER BY COUNT(*) desc
+    LIMIT {int(n)}"""
+    with db.connect() as conn:
+        return pd.read_sql(query, con=conn)["start_station_id"].tolist()
+
+
+def run(stations, start_date, end_date):
+    cases = []
+    for station_id in stations:
+        for station_role in queries.station_columns:
+            for date_type in queries.date_type_conversions:
+                if date_type == "Hour":
+                    continue
+                args = (station_id, station_role, date_type, start_date, end_date)
+                sketches.exact_medians = False
+                approximate, sketch_seconds = _timed(*args)
+                sketches.exact_medians = True
+                exact, exact_seconds = _timed(*args)
+                error = (
+                    (approximate[median_columns] - exact[median_columns]).abs()
+                    / exact[median_columns]
+                ).max()
+                cases.append(
+                    {
+                        "station_id": station_id,
+                        "role": station_role,
+                        "date_type": date_type,
+                        "buckets": len(exact),
+                        "sketch_ms": round(sketch_seconds * 1000, 1),
+                        "exact_ms": round(exact_seconds * 1000, 1),
+                        "max_relative_error": float(error.max()),
+                    }
+                )
+                print(json.dumps(cases[-1]))
+    sketches.exact_medians = False
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stations", type=int, default=5)
+    parser.add_argument("--start", default="2020-01-01")
+    parser.add_argument("--end", default=pd.Timestamp.now().strftime("%Y-%m-%d"))
+    args = parser.parse_args()
+
+    if not queries.use_sketches():
+        parser.error("the rollups are missing; run python -m bluebikes.rollup first")
+    cases = run(_busiest_stations(args.stations), args.start, args.end)
+    print(
+        json.dumps(
+            {
+                "cases": len(cases),
+                "relative_accuracy": sketches.relative_accuracy,
+                "max_relative_error": max(c["max_relative_error"] for c in cases),
+                "sketch_ms_total": round(sum(c["sketch_ms"] for c in cases), 1),
+                "exact_ms_total": round(sum(c["exact_ms"] for c in cases), 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measure how long a fresh worker takes to import the app and serve pages.
+
+    python -m benchmarks.startup [--runs N]
+
+Each run starts a new interpreter, imports ``application`` the way gunicorn
+does, then requests every page once with Flask's test client. Prints one JSON
+line per run with the import time, the database connections opened during
+import (which should be zero) and each page's first response time, then a
+summary line with medians.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+worker = """
+import json, time
+start = time.perf_counter()
+import application
+from bluebikes import db
+result = {
+    "import_seconds": time.perf_counter() - start,
+    "import_checkouts": db.pool_stats()["checkout_wait"]["count"],
+}
+client = application.server.test_client()
+for path in ("/", "/stations", "/Visualizations", "/_dash-layout"):
+    start = time.perf_counter()
+    status = client.get(path).status_code
+    result[path] = {"status": status, "seconds": time.perf_counter() - start}
+print(json.dumps(result))
+"""
+
+
+def run_once():
+    # Measure a cold worker, without the background refresh warming it or a
+    # job pool starting next to it.
+    output = subprocess.run(
+        [sys.executable, "-c", worker],
+        env=dict(os.environ, BACKGROUND_REFRESH="0", JOB_WORKERS="0"),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        runs.append(run_once())
+        print(json.dumps(runs[-1]))
+    summary = {
+        "runs": len(runs),
+        "import_seconds_median": statistics.median(r["import_seconds"] for r in runs),
+        "import_checkouts_max": max(r["import_checkouts"] for r in runs),
+    }
+    for path in ("/", "/stations", "/Visualizations", "/_dash-layout"):
+        summary[f"{path}_seconds_median"] = statistics.median(
+            r[path]["seconds"] for r in runs
+        )
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Generate a deterministic synthetic Bluebikes dataset for benchmarking.
+
+    python -m benchmarks.synthetic --trips 1000000 --replace
+    BLUEBIKES_BACKEND=columnar PARQUET_PATH=bench python -m benchmarks.synthetic --trips 10000000
+
+Writes ``stations`` and ``trips`` with the columns the pages read, either into
+the Postgres database at ``database_url_bbb`` (with the schema migrations
+applied and the precomputed overview tables the pages expect) or, on the
+columnar backend, as Parquet files laid out like ``python -m bluebikes.columnar``
+writes them. The same ``--seed`` always gives the same rows.
+
+The data has the shapes that decide query cost: a few stations account for
+most trips, destinations are mostly nearby, members ride at commute hours and
+casual riders in summer afternoons, and ridership peaks in late summer and
+grows year on year. Build the rollups and the flow cube afterwards as in
+production (``python -m bluebikes.rollup``, ``python -m bluebikes.cube``).
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+
+from bluebikes import columnar, db, ingest, migrations
+
+logger = logging.getLogger(__name__)
+
+center = (42.355, -71.08)
+districts = {
+    # district: (share of stations, latitude, longitude, spread in degrees)
+    "Boston": (0.55, 42.350, -71.070, 0.025),
+    "Cambridge": (0.2, 42.370, -71.110, 0.012),
+    "Somerville": (0.1, 42.392, -71.100, 0.010),
+    "Brookline": (0.06, 42.337, -71.125, 0.008),
+    "Everett": (0.05, 42.405, -71.055, 0.008),
+    "Salem": (0.04, 42.520, -70.895, 0.006),
+}
+streets = [
+    "Mass Ave",
+    "Beacon St",
+    "Boylston St",
+    "Commonwealth Ave",
+    "Tremont St",
+    "Washington St",
+    "Cambridge St",
+    "Broadway",
+    "Main St",
+    "Hampshire St",
+    "Harvard St",
+    "Summer St",
+    "Columbus Ave",
+    "Huntington Ave",
+    "O'Brien Hwy",
+    "Prospect St",
+    "Dorchester Ave",
+    "Centre St",
+    "Charles St",
+    "Congress St",
+    "Atlantic Ave",
+    "Park Dr",
+    "Elm St",
+    "Highland Ave",
+    "D'Angelo Dr",
+    "Bowdoin St",
+    "Medford St",
+    "Western Ave",
+    "River St",
+    "Newbury St",
+]
+default_station = "MIT at Mass Ave / Amherst St"
+
+# Relative trips by hour of day for (member, weekday) combinations.
+# fmt: off
+hour_profiles = {
+    (True, True): [1, 0.5, 0.3, 0.2, 0.4, 1.5, 4, 9, 12, 7, 5, 5, 6, 6, 6, 7, 10, 14, 10, 7, 5, 4, 3, 2],
+    (True, False): [2, 1.5, 1, 0.5, 0.4, 0.6, 1, 2, 4, 6, 8, 9, 10, 10, 10, 10, 9, 8, 7, 6, 5, 4, 3, 2.5],
+    (False, True): [1, 0.6, 0.4, 0.2, 0.2, 0.4, 1, 2, 3, 3, 4, 5, 6, 7, 8, 9, 10, 10, 9, 8, 6, 4, 3, 2],
+    (False, False): [2, 1.5, 1, 0.5, 0.3, 0.3, 0.6, 1, 2, 4, 7, 9, 11, 12, 12, 12, 11, 10, 8, 6, 5, 4, 3, 2.5],
+}
+# fmt: on
+# Relative trips by month of year, and the share of them taken by members.
+month_weights = [0.35, 0.35, 0.55, 0.8, 1.05, 1.2, 1.3, 1.35, 1.35, 1.15, 0.75, 0.45]
+member_share = [0.86, 0.86, 0.8, 0.74, 0.68, 0.64, 0.6, 0.6, 0.68, 0.72, 0.8, 0.85]
+yearly_growth = 1.12
+round_trip_share = {True: 0.02, False: 0.12}
+
+
+def make_stations(n_stations, rng):
+    """Stations with locations clustered by district; the first is the page's
+    default station and the busiest."""
+    names = [f"{a} at {b}" for a in streets for b in streets if a != b]
+    names = [default_station] + list(rng.choice(names, n_stations - 1, replace=False))
+    shares = np.array([d[0] for d in districts.values()])
+    district = rng.choice(list(districts), n_stations, p=shares / shares.sum())
+    district[0] = "Cambridge"
+    lat = np.array([districts[d][1] for d in district])
+    lon = np.array([districts[d][2] for d in district])
+    spread = np.array([districts[d][3] for d in district])
+    lat = lat + rng.normal(0, 1, n_stations) * spread
+    lon = lon + rng.normal(0, 1.3, n_stations) * spread
+    lat[0], lon[0] = 42.3581, -71.0936
+    # Older, larger stations near the center.
+    distance_from_center = np.hypot(lat - center[0], lon - center[1])
+    deployment_year = np.clip(
+        2011 + (distance_from_center * 60 + rng.normal(0, 2, n_stations)), 2011, 2023
+    ).astype("int64")
+    total_docks = np.clip(
+        rng.normal(19, 5, n_stations) - distance_from_center * 40, 11, 47
+    ).astype("int64")
+    return pd.DataFrame(
+        {
+            "station_id": np.arange(1, n_stations + 1),
+            "name": names,
+            "longitude": lon,
+            "latitude": lat,
+            "district": district,
+            "deployment_year": deployment_year,
+            "total_docks": total_docks,
+        }
+    )
+
+
+def _miles(stations):
+    lat = np.radians(stations["latitude"].to_numpy())
+    lon = np.radians(stations["longitude"].to_numpy())
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    )
+    return 2 * 3958.8 * np.arcsin(np.sqrt(a))
+
+
+def _month_counts(n_trips, months):
+    weights = np.array(
+        [
+            month_weights[m.month - 1] * yearly_growth ** (m.year - months[0].year)
+            for m in months
+        ]
+    )
+    counts = np.floor(n_trips * weights / weights.sum()).astype("int64")
+    counts[-1] += n_trips - counts.sum()
+    return counts
+
+
+class Generator:
+    def __init__(self, n_trips, n_stations=450, seed=0, start="2020-01", end="2023-06"):
+        self.n_trips = n_trips
+        self.seed = seed
+        rng = np.random.default_rng([seed, 0])
+        self.stations = make_stations(n_stations, rng)
+        popularity = 1 / np.arange(1, n_stations + 1) ** 0.5
+        popularity[1:] = rng.permutation(popularity[1:])
+        self.popularity = popularity / popularity.sum()
+        self.miles = _miles(self.stations)
+        # Destinations favor nearby, popular stations; round trips are drawn
+        # separately.
+        attraction = self.popularity[None, :] * np.exp(-self.miles / 1.2)
+        np.fill_diagonal(attraction, 0)
+        self.destinations = attraction / attraction.sum(axis=1, keepdims=True)
+        self.months = pd.period_range(start, end, freq="M")
+        self.month_counts = _month_counts(n_trips, self.months)
+
+    def months_of_trips(self):
+        """Yield ``(month, trips)`` frames in time order."""
+        first_id = 0
+        for i, (month, n) in enumerate(zip(self.months, self.month_counts)):
+            rng = np.random.default_rng([self.seed, i + 1])
+            trips = self._month(month, n, rng)
+            trips.insert(0, "trip_id", np.arange(first_id, first_id + n))
+            first_id += n
+            yield month, trips
+
+    def _month(self, month, n, rng):
+        days = pd.date_range(month.start_time, month.end_time.normalize(), freq="D")
+        weekday = days.dayofweek < 5
+        day_weights = np.where(weekday, 1.0, 0.85) * rng.uniform(0.6, 1.2, len(days))
+        day = rng.choice(len(days), n, p=day_weights / day_weights.sum())
+        is_weekday = weekday[day]
+        member = rng.random(n) < member_share[month.month - 1]
+
+        hour = np.empty(n, dtype="int64")
+        for (profile_member, profile_weekday), weights in hour_profiles.items():
+            rows = (member == profile_member) & (is_weekday == profile_weekday)
+            weights = np.array(weights) / np.sum(weights)
+            hour[rows] = rng.choice(24, rows.sum(), p=weights)
+        seconds = hour * 3600 + rng.integers(0, 3600, n)
+        started_at = days.values[day] + seconds.astype("timedelta64[s]")
+
+        n_stations = len(self.stations)
+        start = rng.choice(n_stations, n, p=self.popularity)
+        end = np.empty(n, dtype="int64")
+        by_start = np.argsort(start, kind="stable")
+        high = np.cumsum(np.bincount(start, minlength=n_stations))
+        low = high - np.bincount(start, minlength=n_stations)
+        for station in np.flatnonzero(high > low):
+            rows = by_start[low[station] : high[station]]
+            end[rows] = rng.choice(n_stations, len(rows), p=self.destinations[station])
+        round_trip = rng.random(n) < np.where(
+            member, round_trip_share[True], round_trip_share[False]
+        )
+        end[round_trip] = start[round_trip]
+
+        distance = np.round(self.miles[start, end], 2)
+        mph = np.clip(rng.normal(np.where(member, 7.5, 5.5), 1.5), 2.5, 14)
+        duration = distance / mph * 60 + rng.uniform(1, 3, n)
+        duration[round_trip] = rng.lognormal(3.2, 0.6, round_trip.sum())
+
+        order = np.argsort(started_at, kind="stable")
+        started_at = started_at[order]
+        duration = duration[order]
+        return pd.DataFrame(
+            {
+                "started_at": started_at,
+                "ended_at": started_at
+                + (duration * 60).astype("int64").astype("timedelta64[s]"),
+                "start_station_id": start[order] + 1,
+                "end_station_id": end[order] + 1,
+                "member_casual": np.where(member[order], "member", "casual"),
+                "duration": duration,
+                "distance": distance[order],
+            }
+        )
+
+
+create_statements = [
+    """
+    CREATE TABLE stations (
+        station_id bigint PRIMARY KEY,
+        name text NOT NULL,
+        longitude double precision,
+        latitude double precision,
+        district text,
+        deployment_year bigint,
+        total_docks bigint
+    )""",
+    """
+    CREATE TABLE trips (
+        trip_id bigint PRIMARY KEY,
+        started_at timestamp NOT NULL,
+        ended_at timestamp,
+        start_station_id bigint,
+        end_station_id bigint,
+        member_casual text,
+        duration double precision,
+        distance double precision
+    )""",
+]
+
+
+def load_postgres(generator, replace=False):
+    engine = create_engine(db.database_url)
+    try:
+        with engine.begin() as conn:
+            existing = [t for t in ("trips", "stations") if inspect(conn).has_table(t)]
+            if existing and not replace:
+                raise SystemExit(
+                    f"{', '.join(existing)} already exist; pass --replace to drop them"
+                )
+            for name in [
+                "trips",
+                "stations",
+                migrations.migrations_table,
+                *columnar.derived_views,
+            ]:
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {name} CASCADE")
+            for statement in create_statements:
+                conn.exec_driver_sql(statement)
+            ingest.copy_frame(conn, "stations", generator.stations)
+            for month, trips in generator.months_of_trips():
+                ingest.copy_frame(conn, "trips", trips)
+                logger.info("loaded %s trips for %s", len(trips), month)
+            migrations.apply(conn)
+            for name, definition in columnar.derived_views.items():
+                conn.exec_driver_sql(f"CREATE TABLE {name} AS {definition}")
+        migrations.vacuum(engine, ["trips", "stations", *columnar.derived_views])
+    finally:
+        engine.dispose()
+
+
+def write_parquet(generator, path, replace=False):
+    trips_path = os.path.join(path, "trips")
+    if os.path.isdir(trips_path) and os.listdir(trips_path) and not replace:
+        raise SystemExit(f"{trips_path} is not empty; pass --replace to overwrite")
+    os.makedirs(trips_path, exist_ok=True)
+    for name in os.listdir(trips_path):
+        os.remove(os.path.join(trips_path, name))
+    generator.stations.to_parquet(os.path.join(path, "stations.parquet"), index=False)
+    for month, trips in generator.months_of_trips():
+        trips.to_parquet(os.path.join(trips_path, f"{month}.parquet"), index=False)
+        logger.info("wrote %s trips for %s", len(trips), month)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trips", type=int, default=1_000_000)
+    parser.add_argument("--stations", type=int, default=450)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", default="2020-01", help="first month")
+    parser.add_argument("--end", default="2023-06", help="last month")
+    parser.add_argument("--path", default=columnar.parquet_path)
+    parser.add_argument(
+        "--replace", action="store_true", help="drop existing trips and stations"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.perf_counter()
+    generator = Generator(args.trips, args.stations, args.seed, args.start, args.end)
+    if db.backend == "columnar":
+        write_parquet(generator, args.path, args.replace)
+    else:
+        load_postgres(generator, args.replace)
+    logger.info("generated %s trips in %.1fs", args.trips, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
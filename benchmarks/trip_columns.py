@@ -0,0 +1,130 @@
+"""
+Compare the station queries over stored trip columns with the per-row
+expressions they replace.
+
+    python -m benchmarks.trip_columns [--stations N] [--repeat N]
+
+Run ``python -m bluebikes.migrations`` first. For the busiest stations and
+ranges from a month to the full history, times the exact ``time_buckets``
+query of every bucketing and the ``top_destinations`` medians with
+``trip_columns.stored_columns`` off and on, checks both give the same result,
+and prints one JSON line per case, then a summary line with the totals and
+the bytes per trip of ``trips``, which the stored columns grow.
+"""
+
+import argparse
+import json
+import time
+
+import pandas as pd
+
+from bluebikes import db, queries, sketches, trip_columns
+
+ranges = {
+    "month": pd.DateOffset(months=1),
+    "year": pd.DateOffset(years=1),
+}
+
+
+def _best(func, args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+def _busiest_stations(n):
+    query = f"""
+    SELECT start_station_id
+    FROM trips
+    GROUP BY 1
+    ORDER BY COUNT(*) desc
+    LIMIT {int(n)}"""
+    with db.connect() as conn:
+        return pd.read_sql(query, con=conn)["start_station_id"].tolist()
+
+
+def _cases(stations, starts, end):
+    for station_id in stations:
+        for name, start in starts.items():
+            dates = (f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}")
+            for station_role in queries.station_columns:
+                for date_type in queries.date_type_conversions:
+                    yield (
+                        {"range": name, "role": station_role, "query": date_type},
+                        queries.time_buckets.uncached,
+                        (station_id, station_role, date_type, *dates),
+                    )
+                yield (
+                    {"range": name, "role": station_role, "query": "top"},
+                    queries.top_destinations.uncached,
+                    (station_id, station_role, *dates),
+                )
+
+
+def run(stations, starts, end, repeat):
+    sketches.exact_medians = True
+    totals = {"stored": 0.0, "computed": 0.0}
+    cases = []
+    for case, func, args in _cases(stations, starts, end):
+        results = {}
+        for label, stored in (("computed", False), ("stored", True)):
+            trip_columns.stored_columns = stored
+            results[label], seconds = _best(func, args, repeat)
+            totals[label] += seconds
+            case[f"{label}_ms"] = round(seconds * 1000, 1)
+        try:
+            pd.testing.assert_frame_equal(
+                results["computed"], results["stored"], check_dtype=False, rtol=1e-5
+            )
+            case["same_result"] = True
+        except AssertionError:
+            case["same_result"] = False
+        cases.append(dict(case, station_id=args[0]))
+        print(json.dumps(cases[-1], default=str))
+    sketches.exact_medians = False
+    trip_columns.stored_columns = True
+    return cases, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stations", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if db.backend != "postgres":
+        parser.error("the derived columns are added in Postgres")
+    if not trip_columns.available():
+        parser.error("trips has no derived columns; run python -m bluebikes.migrations")
+    with db.connect() as conn:
+        first, last, trips = conn.exec_driver_sql(
+            "SELECT MIN(started_at), MAX(started_at), COUNT(*) FROM trips"
+        ).first()
+        # pg_table_size of a partitioned table is 0; its partitions hold the rows.
+        table_bytes = conn.exec_driver_sql(
+            "SELECT SUM(pg_table_size(relid))::bigint FROM pg_partition_tree('trips')"
+        ).scalar()
+    end = pd.Timestamp(last).normalize()
+    starts = {name: end - offset for name, offset in ranges.items()}
+    starts["full"] = pd.Timestamp(first).normalize()
+
+    cases, totals = run(_busiest_stations(args.stations), starts, end, args.repeat)
+    print(
+        json.dumps(
+            {
+                "cases": len(cases),
+                "same_results": sum(c["same_result"] for c in cases),
+                "computed_ms_total": round(totals["computed"] * 1000, 1),
+                "stored_ms_total": round(totals["stored"] * 1000, 1),
+                "trips_bytes_per_row": round(table_bytes / trips, 1) if trips else None,
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
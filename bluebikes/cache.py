@@ -0,0 +1,285 @@
+"""
+In-process memoization for the expensive station queries.
+
+Results are kept in a size-bounded LRU with a TTL and keyed on canonical
+inputs (station id, station role, dates snapped to days), so the same station
+and range asked for from either page, with any date format, shares one entry.
+The whole cache is dropped when the data version changes: the newest trip
+time, or the time ``bluebikes.ingest`` last loaded a month, which replacing a
+past month changes while the newest trip stays the same.
+Misses go to the host-wide ``bluebikes.shared`` tier before the database,
+and concurrent misses on one key in a worker share a single execution (see
+``bluebikes.singleflight``).
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from bluebikes import db, partitions, shared, singleflight
+
+cache_max_bytes = int(float(os.getenv("CACHE_MAX_MB", "128")) * 1024 * 1024)
+cache_ttl_seconds = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+data_version_check_seconds = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "300"))
+
+# The newest trip time, from the ``{trips}`` table. Postgres reads it from the
+# (start_station_id, started_at) index, skipping from one station to the next,
+# since the started_at index is a BRIN index that cannot answer MAX (see
+# ``bluebikes.migrations``). DuckDB reads the Parquet statistics.
+if db.backend == "postgres":
+    data_version_query = """
+    WITH RECURSIVE station_ids AS (
+        SELECT MIN(start_station_id) AS station_id FROM {trips}
+        UNION ALL
+        SELECT (SELECT MIN(start_station_id) FROM {trips} WHERE start_station_id > s.station_id)
+        FROM station_ids s
+        WHERE s.station_id IS NOT NULL
+    )
+    SELECT MAX(latest) FROM (
+        SELECT (SELECT MAX(started_at) FROM {trips} WHERE start_station_id = s.station_id) AS latest
+        FROM station_ids s
+        WHERE s.station_id IS NOT NULL
+        UNION ALL
+        SELECT MAX(started_at) FROM {trips} WHERE start_station_id IS NULL
+    ) latest"""
+else:
+    data_version_query = "SELECT MAX(started_at) FROM {trips}"
+
+# When each month was last loaded by ``bluebikes.ingest``.
+loads_table = "trip_loads"
+
+
+def latest_trip(conn):
+    """The newest trip time. Where ``trips`` is partitioned by month, only the
+    newest partition holding trips is read, since skipping through the
+    stations of every partition multiplies the index probes by the months."""
+    if db.backend == "postgres" and partitions.is_partitioned(conn):
+        for name in reversed(partitions.partitions(conn)):
+            latest = conn.exec_driver_sql(
+                data_version_query.format(trips=name)
+            ).scalar()
+            if latest is not None:
+                return latest
+        return None
+    return conn.exec_driver_sql(data_version_query.format(trips="trips")).scalar()
+
+
+def current_version(conn):
+    """The data version: the newest trip time, followed by the time of the
+    last load where ``bluebikes.ingest`` has recorded one."""
+    latest = latest_trip(conn)
+    if latest is None or db.backend != "postgres":
+        return latest
+    if conn.exec_driver_sql("SELECT to_regclass(%s)", (loads_table,)).scalar() is None:
+        return latest
+    loaded = conn.exec_driver_sql(f"SELECT MAX(loaded_at) FROM {loads_table}").scalar()
+    return latest if loaded is None else f"{latest}, loaded {loaded}"
+
+
+_roles = {
+    "start": "start",
+    "start station": "start",
+    "end": "end",
+    "end station": "end",
+}
+
+
+def day(value):
+    """Snap a date, datetime or date string to a ``YYYY-MM-DD`` day."""
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def role(station_type):
+    """Map the pages' station type labels ("Start", "End Station", ...) to start/end."""
+    return _roles[str(station_type).lower()]
+
+
+def scalar(value):
+    """Unwrap numpy scalars so ids from different queries compare equal as keys."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def _sizeof(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    # Callbacks add columns to the frames they get back, so never hand out the
+    # cached object itself.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    return value
+
+
+class ResultCache:
+    def __init__(self, max_bytes=cache_max_bytes, ttl=cache_ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._version = None
+        self._version_checked = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._new_data_callbacks = []
+        self._flights = singleflight.Group()
+
+    def on_new_data(self, callback):
+        """Call ``callback()`` whenever the data version changes."""
+        self._new_data_callbacks.append(callback)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if (
+            self._version_checked is not None
+            and now - self._version_checked < data_version_check_seconds
+        ):
+            return
+        self._version_checked = now
+        with db.connect() as conn:
+            version = current_version(conn)
+        with self._lock:
+            if version == self._version:
+                return
+            changed = self._version is not None
+            if changed:
+                self.invalidations += 1
+            self._clear_locked()
+            self._version = version
+        if changed:
+            for callback in self._new_data_callbacks:
+                callback()
+
+    def data_version(self):
+        """The data version (see ``current_version``), polled at most every
+        ``DATA_VERSION_CHECK_SECONDS``."""
+        self._check_version()
+        return self._version
+
+    def _clear_locked(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def get(self, key):
+        """Return ``(True, value)`` for a live entry, else ``(False, None)``."""
+        self._check_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[2] > self.ttl:
+                if entry is not None:
+                    self._bytes -= entry[1]
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, _copy(entry[0])
+
+    def set(self, key, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (_copy(value), size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def memoize(self, normalize):
+        """Cache a query function on its canonical arguments.
+
+        ``normalize`` receives the caller's arguments and returns the canonical
+        argument tuple, which is both the cache key and what the wrapped
+        function is actually called with.
+        """
+
+        def decorator(func):
+            def canonical_args(*args):
+                """The canonical argument tuple the cache keys results on."""
+                return tuple(normalize(*args))
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                canonical = canonical_args(*args)
+                key = (f"{func.__module__}.{func.__qualname__}",) + canonical
+                found, value = self.get(key)
+                if found:
+                    return value
+
+                def compute():
+                    value = shared.store.compute(
+                        f"{db.backend}:{key!r}",
+                        self._version,
+                        lambda: func(*canonical),
+                    )
+                    self.set(key, value)
+                    return value
+
+                value, coalesced = self._flights.do(key, compute)
+                return _copy(value) if coalesced else value
+
+            def cached(*args):
+                """``(True, value)`` when this worker or the shared cache
+                holds the result, without computing it; else ``(False, None)``."""
+                canonical = canonical_args(*args)
+                key = (f"{func.__module__}.{func.__qualname__}",) + canonical
+                found, value = self.get(key)
+                if found:
+                    return found, value
+                found, value = shared.store.get(f"{db.backend}:{key!r}", self._version)
+                if found:
+                    self.set(key, value)
+                return found, value
+
+            wrapper.uncached = func
+            wrapper.cached = cached
+            wrapper.canonical_args = canonical_args
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "data_version": str(self._version) if self._version else None,
+                "single_flight": self._flights.stats(),
+            }
+
+
+results = ResultCache()
+memoize = results.memoize
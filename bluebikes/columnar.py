@@ -0,0 +1,176 @@
+"""
+Columnar backend: ``trips`` and ``stations`` as Parquet files queried by DuckDB.
+
+With ``BLUEBIKES_BACKEND=columnar`` the pooled engine in ``bluebikes.db`` is an
+embedded DuckDB database instead of Postgres. Every DuckDB connection gets
+views named like the Postgres tables the pages read, so the page queries run
+unchanged on either backend. Trips are stored one Parquet file per month::
+
+    PARQUET_PATH/stations.parquet
+    PARQUET_PATH/trips/2023-06.parquet
+
+DuckDB skips the files and row groups whose ``started_at`` statistics fall
+outside a query's date range, and reads only the columns a query uses.
+
+Export (or refresh) the files from the Postgres database in
+``database_url_bbb`` with::
+
+    python -m bluebikes.columnar                    # all months
+    python -m bluebikes.columnar --since 2023-06    # rewrite from a month on
+"""
+
+import argparse
+import logging
+import os
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+parquet_path = os.getenv("PARQUET_PATH", "data")
+duckdb_threads = int(os.getenv("DUCKDB_THREADS", "2"))
+
+# Tables the pages read besides trips and stations, which the Postgres
+# database keeps precomputed, defined over the Parquet views. Each reads its trips from ``{trips}``, so ``bluebikes.ingest`` can run it over
+# just the trips it adds or replaces.
+derived_queries = {
+    "monthly_trips": """
+        SELECT date_trunc('month', started_at) AS month, COUNT(*) AS n_trips
+        FROM {trips} t
+        GROUP BY 1""",
+    "subscriber_monthly_trips": """
+        SELECT date_trunc('month', started_at) AS month, member_casual, COUNT(*) AS n_trips
+        FROM {trips} t
+        GROUP BY 1, 2""",
+    "hour_start_view": """
+        SELECT extract('hour' from started_at) AS hour, COUNT(*) AS n_trips
+        FROM {trips} t
+        GROUP BY 1""",
+    "day_of_week_trips": """
+        SELECT extract('isodow' from started_at) AS day, COUNT(*) AS n_trips
+        FROM {trips} t
+        GROUP BY 1""",
+    "hour_day_started_at": """
+        SELECT extract('hour' from started_at) AS hour,
+        extract('isodow' from started_at) AS day, COUNT(*) AS n_trips
+        FROM {trips} t
+        GROUP BY 1, 2""",
+    "district_counts": """
+        SELECT s.district, COUNT(*) AS n_trips,
+        COUNT(*)::float / SUM(COUNT(*)) OVER () AS n_trips_percent
+        FROM {trips} t
+        INNER JOIN stations s on t.start_station_id = s.station_id
+        GROUP BY 1""",
+    "boston_cambridge": """
+        SELECT date_trunc('month', started_at) AS month, s.district, COUNT(*) AS n_trips,
+        AVG(CASE WHEN member_casual = 'member' THEN 1 ELSE 0 END) AS percent_subscriber
+        FROM {trips} t
+        INNER JOIN stations s on t.start_station_id = s.station_id
+        WHERE s.district IN ('Boston', 'Cambridge')
+        GROUP BY 1, 2""",
+}
+derived_views = {
+    name: query.format(trips="trips") for name, query in derived_queries.items()
+}
+
+
+def _trips_path(path):
+    return os.path.join(path, "trips")
+
+
+def view_statements(path=None):
+    path = parquet_path if path is None else path
+    trips_files = os.path.join(_trips_path(path), "*.parquet").replace("'", "''")
+    stations_file = os.path.join(path, "stations.parquet").replace("'", "''")
+    return [
+        f"CREATE OR REPLACE VIEW trips AS SELECT * FROM read_parquet('{trips_files}')",
+        f"CREATE OR REPLACE VIEW stations AS SELECT * FROM read_parquet('{stations_file}')",
+    ] + [
+        f"CREATE OR REPLACE VIEW {name} AS {definition}"
+        for name, definition in derived_views.items()
+    ]
+
+
+def _create_views(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET threads = {duckdb_threads}")
+    for statement in view_statements():
+        cursor.execute(statement)
+    cursor.close()
+
+
+def create_columnar_engine(**pool_options):
+    """An engine whose connections are in-memory DuckDB databases with views
+    over the Parquet files."""
+    engine = create_engine("duckdb:///:memory:", poolclass=QueuePool, **pool_options)
+    event.listen(engine, "connect", _create_views)
+    return engine
+
+
+def _months(first, last):
+    return pd.period_range(pd.Timestamp(first), pd.Timestamp(last), freq="M")
+
+
+def _write(frame, target):
+    # Write next to the target and rename, so a running dashboard never reads
+    # a half-written file.
+    partial = target + ".partial"
+    frame.to_parquet(partial, index=False)
+    os.replace(partial, target)
+
+
+def export(conn, path=None, since=None):
+    """Write ``stations`` and the months of ``trips`` from ``since`` on (all of
+    them by default) from a Postgres connection to Parquet files."""
+    path = parquet_path if path is None else path
+    os.makedirs(_trips_path(path), exist_ok=True)
+    _write(
+        pd.read_sql("SELECT * FROM stations", con=conn),
+        os.path.join(path, "stations.parquet"),
+    )
+
+    first_trip, last_trip = conn.exec_driver_sql(
+        "SELECT MIN(started_at), MAX(started_at) FROM trips"
+    ).first()
+    if first_trip is None:
+        return 0
+    if since is not None:
+        first_trip = max(pd.Timestamp(first_trip), pd.Timestamp(since))
+    months = _months(first_trip, last_trip)
+    for month in months:
+        query = f"""
+        SELECT *
+        FROM trips
+        WHERE started_at >= '{month.start_time:%Y-%m-%d}'
+        AND started_at < '{(month + 1).start_time:%Y-%m-%d}'
+        ORDER BY started_at
+        """
+        trips = pd.read_sql(query, con=conn)
+        _write(trips, os.path.join(_trips_path(path), f"{month}.parquet"))
+        logger.info("exported %s trips for %s", len(trips), month)
+    return len(months)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export trips and stations to Parquet."
+    )
+    parser.add_argument("--path", default=parquet_path, help="output directory")
+    parser.add_argument("--since", help="first month (YYYY-MM) to rewrite")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from bluebikes import db
+
+    engine = create_engine(db.database_url)
+    try:
+        with engine.connect() as conn:
+            export(conn, args.path, args.since)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Station-hour cube of trip starts and ends with prefix sums.
+
+For every station and every hour since the first trip, the cube stores the
+running total of trips that started there (and of trips that ended there)
+before that hour, as one ``int32`` array of shape ``(2, stations, hours + 1)``.
+The counts for any station and hour range are a slice difference and range
+totals are two lookups, so the hourly flow charts need no SQL at all. Hours
+are the start hours of trips, as in ``bluebikes.flow``.
+
+The array is saved with ``np.save`` and memory-mapped read-only, so every
+worker on a machine shares one copy through the page cache. It takes
+``8 * stations * hours`` bytes: about 126 MB for 450 stations over four years
+(35,064 hours), growing by about 32 MB a year. Only the hours of the
+stations being charted are paged in. ``int32`` totals allow about two billion
+trips per station.
+
+Build it, and extend it after loading new trips, with::
+
+    python -m bluebikes.cube                      # full rebuild
+    python -m bluebikes.cube --since 2023-06-01   # recompute from a day on
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from bluebikes import db, flow, metadata
+from bluebikes.cache import scalar
+
+logger = logging.getLogger(__name__)
+
+cube_path = os.getenv("CUBE_PATH", os.path.join("data", "cube"))
+
+roles = ("start", "end")
+
+
+def _files(path):
+    return os.path.join(path, "flow_cube.npy"), os.path.join(path, "flow_cube.json")
+
+
+def _timestamp(hour):
+    return f"{np.datetime64(hour, 'h').astype('datetime64[s]')}".replace("T", " ")
+
+
+class FlowCube:
+    def __init__(self, prefix, first_hour, station_ids):
+        self.prefix = prefix
+        self.first_hour = first_hour
+        self.end_hour = first_hour + prefix.shape[2] - 1
+        self.station_ids = list(station_ids)
+        self._rows = {station_id: row for row, station_id in enumerate(station_ids)}
+
+    def covers(self, start_hour, end_hour):
+        """Whether hours ``[start_hour, end_hour)`` are all in the cube."""
+        return self.first_hour <= start_hour <= end_hour <= self.end_hour
+
+    def counts(self, station_id, start_hour, end_hour):
+        """Hourly ``(starts, ends)`` arrays of a station for ``[start_hour, end_hour)``."""
+        row = self._rows.get(scalar(station_id))
+        if row is None:
+            empty = np.zeros(end_hour - start_hour, dtype="int64")
+            return empty, empty
+        window = self.prefix[
+            :, row, start_hour - self.first_hour : end_hour - self.first_hour + 1
+        ]
+        starts, ends = np.diff(window.astype("int64"), axis=1)
+        return starts, ends
+
+    def totals(self, station_id, start_hour, end_hour):
+        """Trips ``(started, ended)`` at a station in ``[start_hour, end_hour)``."""
+        row = self._rows.get(scalar(station_id))
+        if row is None:
+            return 0, 0
+        low = self.prefix[:, row, start_hour - self.first_hour].astype("int64")
+        high = self.prefix[:, row, end_hour - self.first_hour].astype("int64")
+        started, ended = high - low
+        return int(started), int(ended)
+
+
+def load(path=None):
+    """The cube saved at ``path``, memory-mapped, or None if there is none."""
+    array_file, meta_file = _files(cube_path if path is None else path)
+    if not (os.path.exists(array_file) and os.path.exists(meta_file)):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    prefix = np.load(array_file, mmap_mode="r")
+    if prefix.shape != (len(roles), len(meta["station_ids"]), meta["hours"] + 1):
+        # Caught between the two files of a rebuild; the next load sees both.
+        logger.warning("flow cube files at %s do not match, ignoring them", path)
+        return None
+    return FlowCube(prefix, meta["first_hour"], meta["station_ids"])
+
+
+@metadata.value("flow_cube")
+def current():
+    """The cube at ``CUBE_PATH``, reloaded with the other metadata."""
+    return load()
+
+
+def _new_counts(conn, since_hour, until_hour):
+    parts = [
+        f"""
+        SELECT {i} AS role, {role}_station_id AS station_id,
+        {flow.hour_number_sql} AS hour_number, COUNT(*) AS n
+        FROM trips
+        WHERE started_at >= '{_timestamp(since_hour)}' AND started_at < '{_timestamp(until_hour)}'
+        AND {role}_station_id IS NOT NULL
+        GROUP BY 1, 2, 3"""
+        for i, role in enumerate(roles)
+    ]
+    return pd.read_sql("\nUNION ALL".join(parts), con=conn)
+
+
+def build(conn, path=None, since=None):
+    """Recompute the cube for every hour from the day ``since`` on (all hours
+    if None) and save it.
+
+    Only hours before the hour of the newest trip are included, since that
+    hour may still be receiving trips. Returns the hours covered as
+    ``(first_hour, end_hour)``, or None when there are no trips.
+    """
+    path = cube_path if path is None else path
+    first_trip, last_trip = conn.exec_driver_sql(
+        "SELECT MIN(started_at), MAX(started_at) FROM trips"
+    ).first()
+    if last_trip is None:
+        return None
+    until_hour = flow.hour_number(last_trip)
+
+    old = load(path)
+    if since is None or old is None:
+        first_hour = since_hour = flow.hour_number(first_trip)
+        station_ids = []
+    else:
+        first_hour = old.first_hour
+        # Never leave a gap between the hours already in the cube and new ones.
+        since_hour = max(first_hour, min(flow.hour_number(since), old.end_hour))
+        station_ids = list(old.station_ids)
+
+    new = _new_counts(conn, since_hour, until_hour)
+    known = set(station_ids)
+    for station_id in map(scalar, new["station_id"].unique()):
+        if station_id not in known:
+            station_ids.append(station_id)
+            known.add(station_id)
+    rows = {station_id: row for row, station_id in enumerate(station_ids)}
+
+    counts = np.zeros((len(roles), len(station_ids), until_hour - first_hour), "int32")
+    if old is not None and since is not None:
+        kept = np.diff(old.prefix[:, :, : since_hour - first_hour + 1], axis=2)
+        counts[:, : len(old.station_ids), : since_hour - first_hour] = kept
+    counts[
+        new["role"].to_numpy(),
+        new["station_id"].map(lambda i: rows[scalar(i)]).to_numpy(dtype="int64"),
+        new["hour_number"].to_numpy(dtype="int64") - first_hour,
+    ] = new["n"].to_numpy()
+
+    prefix = np.zeros(counts.shape[:2] + (counts.shape[2] + 1,), dtype="int32")
+    np.cumsum(counts, axis=2, out=prefix[:, :, 1:])
+    _save(path, prefix, first_hour, station_ids)
+    logger.info(
+        "flow cube covers %s stations from %s to %s",
+        len(station_ids),
+        _timestamp(first_hour),
+        _timestamp(until_hour),
+    )
+    return first_hour, until_hour
+
+
+def _save(path, prefix, first_hour, station_ids):
+    os.makedirs(path, exist_ok=True)
+    array_file, meta_file = _files(path)
+    meta = {
+        "first_hour": first_hour,
+        "hours": prefix.shape[2] - 1,
+        "station_ids": station_ids,
+    }
+    # Write beside the targets and rename, so readers never see half a file.
+    with open(array_file + ".partial", "wb") as f:
+        np.save(f, prefix)
+    with open(meta_file + ".partial", "w") as f:
+        json.dump(meta, f)
+    os.replace(array_file + ".partial", array_file)
+    os.replace(meta_file + ".partial", meta_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", default=cube_path, help="output directory")
+    parser.add_argument(
+        "--since",
+        help="only recompute hours on or after this date (YYYY-MM-DD); default is a full rebuild",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with db.connect() as conn:
+        build(conn, args.path, args.since)
+
+
+if __name__ == "__main__":
+    main()
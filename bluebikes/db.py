@@ -0,0 +1,150 @@
+"""
+Process-wide database engine shared by every page.
+
+Each gunicorn worker gets one engine with a bounded connection pool. Callbacks
+borrow a connection with ``connect()`` and return it to the pool by closing it,
+instead of building and disposing an engine (and paying a full connect/auth
+handshake) on every click.
+
+``BLUEBIKES_BACKEND`` picks what the engine talks to: ``postgres`` (the
+default, at ``database_url_bbb``) or ``columnar``, an embedded DuckDB reading
+Parquet files (see ``bluebikes.columnar``).
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from bluebikes import metrics
+
+logger = logging.getLogger(__name__)
+
+database_url = os.getenv("database_url_bbb")
+backend = os.getenv("BLUEBIKES_BACKEND", "postgres").lower()
+
+pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+pool_max_overflow = int(os.getenv("DB_POOL_MAX_OVERFLOW", "5"))
+pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+slow_checkout_seconds = float(os.getenv("DB_POOL_SLOW_CHECKOUT", "0.25"))
+
+checkout_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_checkout_stats = {
+    "count": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+    "buckets": [0] * (len(checkout_buckets) + 1),
+}
+
+
+def _create_engine():
+    pool_options = dict(
+        pool_size=pool_size,
+        max_overflow=pool_max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=True,
+    )
+    if backend == "columnar":
+        from bluebikes import columnar
+
+        engine = columnar.create_columnar_engine(**pool_options)
+    elif backend == "postgres":
+        engine = create_engine(database_url, **pool_options)
+    else:
+        raise ValueError(f"unknown BLUEBIKES_BACKEND {backend!r}")
+    metrics.instrument_engine(engine)
+    return engine
+
+
+def get_engine():
+    """Return this process's engine, creating it on first use.
+
+    The owning pid is remembered so that a process forked after the engine was
+    created (gunicorn ``--preload``) never reuses the parent's sockets.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                if _engine is not None:
+                    _engine.dispose(close=False)
+                _engine = _create_engine()
+                _engine_pid = pid
+    return _engine
+
+
+def _after_fork_in_child():
+    global _engine, _engine_pid
+    if _engine is not None:
+        # Drop the inherited pool without closing connections the parent owns.
+        _engine.dispose(close=False)
+        _engine = None
+        _engine_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _record_checkout(seconds):
+    with _stats_lock:
+        _checkout_stats["count"] += 1
+        _checkout_stats["total_seconds"] += seconds
+        _checkout_stats["max_seconds"] = max(_checkout_stats["max_seconds"], seconds)
+        for i, bound in enumerate(checkout_buckets):
+            if seconds <= bound:
+                _checkout_stats["buckets"][i] += 1
+                break
+        else:
+            _checkout_stats["buckets"][-1] += 1
+    if seconds > slow_checkout_seconds:
+        logger.warning("waited %.3fs for a pooled database connection", seconds)
+
+
+def connect():
+    """Check a connection out of the pool, timing how long the wait took.
+
+    The returned connection goes back to the pool when it is closed, so it can
+    be used either with ``conn.close()`` or as a context manager.
+    """
+    engine = get_engine()
+    start = time.perf_counter()
+    conn = engine.connect()
+    _record_checkout(time.perf_counter() - start)
+    return conn
+
+
+def pool_stats():
+    """Current pool occupancy and the checkout wait distribution."""
+    with _stats_lock:
+        checkout = dict(_checkout_stats, buckets=list(_checkout_stats["buckets"]))
+    count = checkout["count"]
+    checkout["mean_seconds"] = checkout["total_seconds"] / count if count else 0.0
+    checkout["bucket_bounds"] = list(checkout_buckets) + ["+Inf"]
+
+    stats = {
+        "pid": os.getpid(),
+        "backend": backend,
+        "pool_size": pool_size,
+        "max_overflow": pool_max_overflow,
+        "checkout_wait": checkout,
+    }
+    if _engine is not None and _engine_pid == os.getpid():
+        pool = _engine.pool
+        stats.update(
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    return stats
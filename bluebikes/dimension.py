@@ -0,0 +1,144 @@
+"""
+In-process copy of the ``stations`` table.
+
+The pages name stations by their display name, while trip queries want ids.
+``stations()`` holds every station's attributes as arrays with name -> row and
+id -> row indexes, so resolving a name or decorating query results with names
+and coordinates needs neither a round trip nor a join to ``stations``. It is
+loaded through ``bluebikes.metadata`` and so reloaded when the data changes.
+
+``map_base()`` is the part of the maps that does not depend on the trips:
+every station's name and coordinates by row. The map pages keep it in the
+browser and send only row numbers and counts afterwards, so rows are ordered
+by station id to be the same in every worker, and ``version`` changes
+whenever any station does. ``register_base_store`` wires a page's pair of
+stores to it.
+"""
+
+import hashlib
+
+import dash
+import numpy as np
+import pandas as pd
+from dash import Input, Output, State
+
+from bluebikes import db, figures, metadata
+from bluebikes.cache import scalar
+
+attribute_columns = (
+    "name",
+    "longitude",
+    "latitude",
+    "district",
+    "total_docks",
+    "deployment_year",
+)
+
+
+class StationDimension:
+    def __init__(self, frame):
+        self.version = hashlib.sha1(
+            pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()
+        ).hexdigest()[:16]
+        self.ids = frame["station_id"].to_numpy()
+        self.columns = {
+            column: frame[column].to_numpy() for column in attribute_columns
+        }
+        self._row_by_id = {}
+        for row, station_id in enumerate(self.ids):
+            self._row_by_id.setdefault(scalar(station_id), row)
+        self._row_by_name = {}
+        for row, name in enumerate(self.columns["name"]):
+            self._row_by_name.setdefault(name, row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name):
+        return name in self._row_by_name
+
+    def row(self, name):
+        """Row of the station with this display name (KeyError if unknown)."""
+        return self._row_by_name[name]
+
+    def station_id(self, name):
+        """Id of the station with this display name (KeyError if unknown)."""
+        return scalar(self.ids[self.row(name)])
+
+    def name_rows(self, names):
+        """Rows of the given names, -1 where a name is not a known station."""
+        return np.fromiter(
+            (self._row_by_name.get(name, -1) for name in names),
+            dtype="int64",
+            count=len(names),
+        )
+
+    def attribute(self, station_id, column):
+        return scalar(self.columns[column][self._row_by_id[scalar(station_id)]])
+
+    def rows(self, station_ids):
+        """Rows of the given ids, -1 where an id is not a known station."""
+        return np.fromiter(
+            (self._row_by_id.get(scalar(i), -1) for i in station_ids),
+            dtype="int64",
+            count=len(station_ids),
+        )
+
+    def map_base(self):
+        """Names and coordinates of every station, by row."""
+        return {
+            "version": self.version,
+            "name": self.columns["name"].tolist(),
+            "lat": np.round(
+                self.columns["latitude"].astype(float), figures.coordinate_decimals
+            ).tolist(),
+            "lon": np.round(
+                self.columns["longitude"].astype(float), figures.coordinate_decimals
+            ).tolist(),
+        }
+
+    def decorate(self, frame, key="key", columns=("name", "latitude", "longitude")):
+        """Replace the station ids in ``frame[key]`` with station attributes.
+
+        Rows whose id is not a known station are dropped, as an inner join to
+        ``stations`` would.
+        """
+        rows = self.rows(frame[key].to_numpy())
+        known = rows >= 0
+        rows = rows[known]
+        decorated = pd.DataFrame(
+            {column: self.columns[column][rows] for column in columns}
+        )
+        rest = frame.loc[known].drop(columns=key).reset_index(drop=True)
+        return pd.concat([decorated, rest], axis=1)
+
+
+@metadata.value("stations", shared=True)
+def stations():
+    with db.connect() as conn:
+        frame = pd.read_sql(
+            f"SELECT station_id, {', '.join(attribute_columns)} FROM stations"
+            " ORDER BY station_id",
+            con=conn,
+        )
+    return StationDimension(frame)
+
+
+def register_base_store(base_id, version_id):
+    """Fill the local-storage store ``base_id`` with ``map_base()`` unless it
+    already holds the version in the store ``version_id``."""
+
+    @dash.callback(
+        Output(component_id=base_id, component_property="data"),
+        Input(component_id=base_id, component_property="modified_timestamp"),
+        State(component_id=base_id, component_property="data"),
+        State(component_id=version_id, component_property="data"),
+    )
+    def load_station_base(modified, base, version):
+        # Names and coordinates stay in the browser's local storage between
+        # visits; they are only sent again when a station changed.
+        if base is not None and base.get("version") == version:
+            return dash.no_update
+        return stations().map_base()
+
+    return load_station_base
@@ -0,0 +1,117 @@
+"""
+Run a callback's independent queries at the same time.
+
+``gather`` hands each call to a small per-worker thread pool. Every call
+borrows its own pooled connection, so a callback waits for its slowest query
+instead of the sum of all of them. Results come back in call order. If a call
+raises, ``gather`` raises that same exception after the other calls finish, so
+callbacks handle errors exactly as they did when the calls ran in sequence.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+query_threads = int(os.getenv("QUERY_THREADS", "4"))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_in_pool = threading.local()
+
+_stats_lock = threading.Lock()
+_call_stats = {}
+
+
+def _get_pool():
+    # Threads do not survive a fork, so each worker process starts its own.
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(
+                    max_workers=query_threads,
+                    thread_name_prefix="query",
+                    initializer=_mark_pool_thread,
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def _mark_pool_thread():
+    _in_pool.active = True
+
+
+def _record(name, seconds, failed):
+    with _stats_lock:
+        stats = _call_stats.setdefault(
+            name, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        stats["calls"] += 1
+        stats["errors"] += failed
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+def _timed(name, func, args):
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except BaseException:
+        _record(name, time.perf_counter() - start, True)
+        raise
+    _record(name, time.perf_counter() - start, False)
+    return result
+
+
+def gather(*calls):
+    """Run each ``(func, *args)`` call concurrently and return their results
+    as a list in the same order.
+
+    Called from inside one of the pool's own threads, the calls run one after
+    another instead, so nested gathers cannot starve the pool.
+    """
+    start = time.perf_counter()
+    named = [(getattr(c[0], "__qualname__", repr(c[0])), c[0], c[1:]) for c in calls]
+    if len(named) < 2 or getattr(_in_pool, "active", False) or query_threads < 2:
+        results = [_timed(name, func, args) for name, func, args in named]
+    else:
+        pool = _get_pool()
+        # Each call runs in a copy of the caller's context, so what the caller
+        # has set (such as the request's metrics) is seen by its queries.
+        futures = [
+            pool.submit(contextvars.copy_context().run, _timed, name, func, args)
+            for name, func, args in named
+        ]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        results = [future.result() for future in futures]
+    logger.debug(
+        "gathered %s in %.3fs",
+        ", ".join(name for name, _, _ in named),
+        time.perf_counter() - start,
+    )
+    return results
+
+
+def stats():
+    """Per-function call counts, errors and timings of gathered calls."""
+    with _stats_lock:
+        return {
+            "threads": query_threads,
+            "calls": {
+                name: dict(
+                    s,
+                    mean_seconds=s["total_seconds"] / s["calls"] if s["calls"] else 0.0,
+                )
+                for name, s in _call_stats.items()
+            },
+        }
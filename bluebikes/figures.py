@@ -0,0 +1,238 @@
+"""
+Compact Plotly JSON for the figures the pages send.
+
+``compact(fig, name)`` returns the figure as the dict Dash would serialize,
+with smaller arrays:
+
+* longitudes and latitudes are rounded to 5 decimals (about a metre), other
+  floats to 3, and floats holding whole numbers are sent as integers;
+* evenly spaced ``x`` or ``y`` values, such as one point per hour, are sent as
+  a start and a step (``x0``/``dx``) instead of one value per point;
+* a ``text`` or ``hovertext`` array repeating a single string is sent once;
+* with ``FIGURE_TYPED_ARRAYS=1`` numeric arrays are sent as base64 typed
+  arrays. plotly.js decodes these from 2.28 on, later than the one bundled
+  with Dash 2.6, so they are off by default.
+
+Every ``FIGURE_SIZE_SAMPLE``-th figure of a name is also serialized as Plotly
+would send it; the summed sizes of both encodings are at ``/stats/figures``.
+"""
+
+import base64
+import datetime
+import os
+import threading
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+typed_arrays = os.getenv("FIGURE_TYPED_ARRAYS", "").lower() in ("1", "true", "yes")
+size_sample = int(os.getenv("FIGURE_SIZE_SAMPLE", "20"))
+
+coordinate_decimals = 5
+float_decimals = 3
+
+coordinate_keys = {"lat", "lon"}
+text_keys = {"text", "hovertext"}
+# Trace types whose positions may be given as a start and a step.
+stepped_traces = {"scatter", "scattergl", "bar"}
+
+_integer_types = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _dates(values):
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ms]")
+    if (
+        values.dtype == object
+        and len(values)
+        and isinstance(values[0], (datetime.date, np.datetime64))
+    ):
+        try:
+            return values.astype("datetime64[ms]")
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def _date_strings(dates):
+    # The shortest of day, minute or second precision that loses nothing.
+    for unit in ("D", "m"):
+        if (dates == dates.astype(f"datetime64[{unit}]")).all():
+            break
+    else:
+        unit = "s"
+    return np.char.replace(np.datetime_as_string(dates, unit=unit), "T", " ")
+
+
+def _numbers(values, decimals):
+    if values.dtype.kind != "f":
+        return values
+    if np.isfinite(values).all() and np.abs(values).max() < 2**53:
+        rounded = np.round(values)
+        if np.array_equal(values, rounded):
+            return rounded.astype("int64")
+    return np.round(values, decimals)
+
+
+def _typed(values):
+    # plotly.js has no 64-bit integer arrays; larger integers go as floats.
+    encoded = values.astype("<f8")
+    if values.dtype.kind in "iu":
+        low, high = values.min(), values.max()
+        for integer_type in _integer_types:
+            info = np.iinfo(integer_type)
+            if info.min <= low and high <= info.max:
+                encoded = values.astype(np.dtype(integer_type).newbyteorder("<"))
+                break
+    return {
+        "dtype": encoded.dtype.str[1:],
+        "bdata": base64.b64encode(encoded.tobytes()).decode(),
+    }
+
+
+def _step(values):
+    """``(start, step)`` of three or more evenly spaced values, else None."""
+    if len(values) < 3:
+        return None
+    steps = np.diff(values)
+    if not steps[0] or not (steps == steps[0]).all():
+        return None
+    return values[0], steps[0]
+
+
+def _positions(trace):
+    trace = dict(trace)
+    for axis in ("x", "y"):
+        values = trace.get(axis)
+        if not isinstance(values, np.ndarray) or values.ndim != 1:
+            continue
+        if f"{axis}0" in trace or f"d{axis}" in trace:
+            continue
+        dates = _dates(values)
+        if dates is not None:
+            stepped = _step(dates)
+            if stepped is not None:
+                start, step = stepped
+                trace[f"{axis}0"] = str(_date_strings(dates[:1])[0])
+                trace[f"d{axis}"] = int(step.astype("int64"))
+                del trace[axis]
+            else:
+                trace[axis] = _date_strings(dates).astype(object)
+        elif values.dtype.kind in "iuf":
+            stepped = _step(values)
+            if stepped is not None:
+                start, step = stepped
+                trace[f"{axis}0"] = start.item()
+                trace[f"d{axis}"] = step.item()
+                del trace[axis]
+    return trace
+
+
+def _compact(key, value):
+    if isinstance(value, dict):
+        return {k: _compact(k, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if key in text_keys and len(value) and len(set(value)) == 1:
+            return value[0]
+        return value
+    if not isinstance(value, np.ndarray):
+        return value
+    if key in text_keys and len(value) and (value == value[0]).all():
+        return value[0]
+    decimals = coordinate_decimals if key in coordinate_keys else float_decimals
+    values = _numbers(value, decimals)
+    if (
+        typed_arrays
+        and values.ndim == 1
+        and len(values)
+        and values.dtype.kind in "iuf"
+        and np.isfinite(values).all()
+    ):
+        return _typed(values)
+    return values
+
+
+def _trace(trace):
+    if trace.get("type", "scatter") in stepped_traces:
+        trace = _positions(trace)
+    return {key: _compact(key, value) for key, value in trace.items()}
+
+
+def _record(name, fig, figure):
+    with _lock:
+        stats = _stats.setdefault(
+            name, {"figures": 0, "sampled": 0, "plotly_bytes": 0, "compact_bytes": 0}
+        )
+        stats["figures"] += 1
+        sample = size_sample > 0 and (stats["figures"] - 1) % size_sample == 0
+    if not sample:
+        return
+    plotly_bytes = len(to_json_plotly(fig).encode())
+    compact_bytes = len(to_json_plotly(figure).encode())
+    with _lock:
+        stats["sampled"] += 1
+        stats["plotly_bytes"] += plotly_bytes
+        stats["compact_bytes"] += compact_bytes
+
+
+def compact(fig, name):
+    """``fig`` as a figure dict with compact arrays, counted toward ``name``."""
+    plotly_json = fig.to_plotly_json()
+    figure = {
+        "data": [_trace(trace) for trace in plotly_json["data"]],
+        "layout": plotly_json["layout"],
+    }
+    _record(name, fig, figure)
+    return figure
+
+
+def placeholder(title, text):
+    """An empty figure titled ``title`` with ``text`` in its middle, shown
+    until the figure's data is computed."""
+    fig = go.Figure()
+    fig.update_layout(
+        title=title,
+        font={"size": 24},
+        xaxis={"visible": False},
+        yaxis={"visible": False},
+        annotations=[
+            {
+                "text": text,
+                "showarrow": False,
+                "xref": "paper",
+                "yref": "paper",
+                "x": 0.5,
+                "y": 0.5,
+            }
+        ],
+    )
+    return fig.to_plotly_json()
+
+
+def map_style(accesstoken):
+    """Template, marker colors and mapbox settings of the station maps drawn in
+    the browser by ``assets/maps.js``."""
+    return {
+        "template": pio.templates[pio.templates.default].to_plotly_json(),
+        "colorscale": go.scattermapbox.Marker(colorscale="blues").colorscale,
+        "mapbox": {"accesstoken": accesstoken, "style": "dark"},
+    }
+
+
+def stats():
+    """Figures, sampled figures and their sizes in both encodings per name."""
+    with _lock:
+        return {
+            name: dict(
+                s,
+                ratio=s["compact_bytes"] / s["plotly_bytes"]
+                if s["plotly_bytes"]
+                else None,
+            )
+            for name, s in _stats.items()
+        }
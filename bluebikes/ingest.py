@@ -0,0 +1,382 @@
+"""
+Load monthly Bluebikes trip files into Postgres and update what is derived
+from them.
+
+    python -m bluebikes.ingest 202306-bluebikes-tripdata.zip [...]
+    python -m bluebikes.ingest trips.csv --month 2023-06
+
+Each file holds one month of trips, taken from its ``YYYYMM`` name prefix
+unless ``--month`` is given; trips starting outside that month are skipped.
+Files are read ``--chunk-size`` rows at a time, in the current
+(``started_at``, ``start_station_name``, ``member_casual``) or the pre-2023
+(``starttime``, ``start station name``, ``usertype``) layout. Stations are
+matched to ``stations`` by name, ``duration`` (minutes) and the haversine
+``distance`` (miles) between the two stations are computed with NumPy, and
+every chunk is COPYed into a staging table.
+
+The month then replaces what ``trips`` held for it, in one transaction with
+the derived tables, so a corrected file can simply be loaded again. Only what
+the month touches is recomputed: its rows of the monthly tables, the changed
+counts of the hour, weekday and district totals. The daily rollups and the flow cube, where they
+exist, are then refreshed from the first loaded month on. Rows per second are
+logged for every file. Where ``trips`` is partitioned by month, the month's
+partition is created first if it is missing.
+
+Once the rollups and the cube are done, the time of the load is recorded for
+every loaded month in ``trip_loads``. It is part of the data version the
+pages poll every ``DATA_VERSION_CHECK_SECONDS``, so replacing an earlier
+month, which leaves the newest trip as it was, still drops their caches and
+the shared cache and refreshes the derived views.
+"""
+
+import argparse
+import io
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect
+
+from bluebikes import cache, columnar, cube, db, partitions, rollup
+
+logger = logging.getLogger(__name__)
+
+earth_radius_miles = 3958.8
+
+# Column of each value in the current and in the pre-2023 file layout.
+source_columns = {
+    "started_at": ("started_at", "starttime"),
+    "ended_at": ("ended_at", "stoptime"),
+    "start_station": ("start_station_name", "start station name"),
+    "end_station": ("end_station_name", "end station name"),
+    "member_casual": ("member_casual", "usertype"),
+}
+user_types = {"Subscriber": "member", "Customer": "casual"}
+
+trip_columns = [
+    "started_at",
+    "ended_at",
+    "start_station_id",
+    "end_station_id",
+    "member_casual",
+    "duration",
+    "distance",
+]
+
+staging_statement = """
+    CREATE TEMP TABLE trips_incoming (
+        started_at timestamp NOT NULL,
+        ended_at timestamp,
+        start_station_id bigint,
+        end_station_id bigint,
+        member_casual text,
+        duration double precision,
+        distance double precision
+    ) ON COMMIT DROP"""
+
+# How a month of trips changes each derived table of columnar.derived_queries:
+# the monthly tables lose and regain that month's rows, the totals change by
+# the counts added less the counts removed (keyed on these columns, with
+# n_trips_percent recomputed after).
+month_tables = ("monthly_trips", "subscriber_monthly_trips", "boston_cambridge")
+total_tables = {
+    "hour_start_view": ("hour",),
+    "day_of_week_trips": ("day",),
+    "hour_day_started_at": ("hour", "day"),
+    "district_counts": ("district",),
+}
+
+chunk_size = 100_000
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles between arrays of coordinates."""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * earth_radius_miles * np.arcsin(np.sqrt(a))
+
+
+def copy_frame(conn, table, frame):
+    """Bulk-load ``frame`` into ``table`` with COPY; NaN and NA load as NULL."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN CSV", buffer
+    )
+    cursor.close()
+
+
+def file_month(path):
+    match = re.match(r"(\d{4})(\d{2})", os.path.basename(path))
+    if match is None:
+        raise ValueError(f"cannot tell the month of {path}; pass --month")
+    return f"{match.group(1)}-{match.group(2)}"
+
+
+def _column(chunk, value):
+    for column in source_columns[value]:
+        if column in chunk.columns:
+            return chunk[column]
+    raise ValueError(f"no {' or '.join(source_columns[value])} column")
+
+
+def _stations(conn):
+    stations = pd.read_sql(
+        "SELECT station_id, name, latitude, longitude FROM stations", con=conn
+    )
+    return stations.drop_duplicates("name").set_index("name")
+
+
+def _locate(chunk, stations, role):
+    """Station ids (NA if unknown), latitudes and longitudes of a trip end."""
+    rows = stations.index.get_indexer(_column(chunk, f"{role}_station"))
+    known = rows >= 0
+    station_ids = pd.array(
+        np.where(known, stations["station_id"].to_numpy()[rows], 0), dtype="Int64"
+    )
+    station_ids[~known] = pd.NA
+    return (
+        station_ids,
+        np.where(known, stations["latitude"].to_numpy(dtype="float64")[rows], np.nan),
+        np.where(known, stations["longitude"].to_numpy(dtype="float64")[rows], np.nan),
+    )
+
+
+def _trips(chunk, stations, month):
+    """The trips of ``chunk`` starting in ``month``, as ``trips`` rows, and
+    the number of them whose stations are not in ``stations``."""
+    started_at = pd.to_datetime(_column(chunk, "started_at"))
+    ended_at = pd.to_datetime(_column(chunk, "ended_at"))
+    in_month = (started_at >= month.start_time) & (started_at < (month + 1).start_time)
+    chunk, started_at, ended_at = (
+        chunk[in_month],
+        started_at[in_month],
+        ended_at[in_month],
+    )
+    start_ids, start_lat, start_lon = _locate(chunk, stations, "start")
+    end_ids, end_lat, end_lon = _locate(chunk, stations, "end")
+
+    trips = pd.DataFrame(
+        {
+            "started_at": started_at.to_numpy(),
+            "ended_at": ended_at.to_numpy(),
+            "start_station_id": start_ids,
+            "end_station_id": end_ids,
+            "member_casual": _column(chunk, "member_casual")
+            .replace(user_types)
+            .to_numpy(),
+            "duration": (ended_at - started_at).dt.total_seconds().to_numpy() / 60,
+            "distance": haversine_miles(start_lat, start_lon, end_lat, end_lon),
+        },
+        columns=trip_columns,
+    )
+    unmatched = int((start_ids.isna() | end_ids.isna()).sum())
+    return trips, unmatched
+
+
+def _apply_delta(conn, table, query, keys):
+    key_list = ", ".join(keys)
+    conn.exec_driver_sql(
+        f"""
+        CREATE TEMP TABLE derived_delta ON COMMIT DROP AS
+        SELECT {key_list}, SUM(n_trips) AS n_trips
+        FROM (
+            SELECT {key_list}, n_trips FROM ({query.format(trips="trips_incoming")}) added
+            UNION ALL
+            SELECT {key_list}, -n_trips FROM ({query.format(trips="trips_removed")}) removed
+        ) d
+        GROUP BY {key_list}
+        HAVING SUM(n_trips) != 0
+        """
+    )
+    match = " AND ".join(f"d.{k} IS NOT DISTINCT FROM {table}.{k}" for k in keys)
+    conn.exec_driver_sql(
+        f"""
+        UPDATE {table} SET n_trips = {table}.n_trips + d.n_trips
+        FROM derived_delta d WHERE {match}
+        """
+    )
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {table} ({key_list}, n_trips)
+        SELECT {key_list}, n_trips FROM derived_delta d
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match})
+        """
+    )
+    conn.exec_driver_sql(f"DELETE FROM {table} WHERE n_trips <= 0")
+    conn.exec_driver_sql("DROP TABLE derived_delta")
+
+
+def _update_derived(conn, month):
+    month_sql = f"{month.start_time:%Y-%m-%d}"
+    next_month_sql = f"{(month + 1).start_time:%Y-%m-%d}"
+    month_trips = (
+        f"(SELECT * FROM trips WHERE started_at >= '{month_sql}'"
+        f" AND started_at < '{next_month_sql}')"
+    )
+    # Derived tables kept as materialized views are refreshed by
+    # bluebikes.refresh once the workers see the new trips.
+    views = {
+        name
+        for (name,) in conn.exec_driver_sql(
+            "SELECT relname FROM pg_class"
+            " WHERE relkind = 'm' AND relnamespace = current_schema()::regnamespace"
+        ).fetchall()
+    }
+    for table, query in columnar.derived_queries.items():
+        if table in views:
+            continue
+        if not inspect(conn).has_table(table):
+            conn.exec_driver_sql(
+                f"CREATE TABLE {table} AS {columnar.derived_views[table]}"
+            )
+        elif table in month_tables:
+            conn.exec_driver_sql(f"DELETE FROM {table} WHERE month = '{month_sql}'")
+            conn.exec_driver_sql(
+                f"INSERT INTO {table} {query.format(trips=month_trips)}"
+            )
+        else:
+            _apply_delta(conn, table, query, total_tables[table])
+            if table == "district_counts":
+                conn.exec_driver_sql(
+                    f"""
+                    UPDATE {table}
+                    SET n_trips_percent = n_trips::float / (SELECT SUM(n_trips) FROM {table})
+                    """
+                )
+
+
+def ingest(conn, path, month=None, chunk_size=chunk_size):
+    """Replace the trips of ``month`` (by default the file's) with the trips
+    in the file at ``path`` and update the derived tables. Run inside a
+    transaction; returns the row counts and timings."""
+    start = time.perf_counter()
+    month = pd.Period(month or file_month(path), "M")
+    # Readers carry on; another ingest waits for this one to commit.
+    conn.exec_driver_sql("LOCK TABLE trips IN SHARE ROW EXCLUSIVE MODE")
+    stations = _stations(conn)
+    conn.exec_driver_sql(staging_statement)
+
+    counts = {"rows": 0, "loaded": 0, "unmatched_stations": 0}
+    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str):
+        trips, unmatched = _trips(chunk, stations, month)
+        copy_frame(conn, "trips_incoming", trips)
+        counts["rows"] += len(chunk)
+        counts["loaded"] += len(trips)
+        counts["unmatched_stations"] += unmatched
+    load_seconds = time.perf_counter() - start
+
+    month_range = (
+        f"started_at >= '{month.start_time:%Y-%m-%d}'"
+        f" AND started_at < '{(month + 1).start_time:%Y-%m-%d}'"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TEMP TABLE trips_removed ON COMMIT DROP AS SELECT * FROM trips WHERE {month_range}"
+    )
+    counts["replaced"] = conn.exec_driver_sql(
+        f"DELETE FROM trips WHERE {month_range}"
+    ).rowcount
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO trips (trip_id, {', '.join(trip_columns)})
+        SELECT (SELECT COALESCE(MAX(trip_id), 0) FROM trips)
+        + row_number() OVER (ORDER BY started_at), {', '.join(trip_columns)}
+        FROM trips_incoming
+        """
+    )
+    _update_derived(conn, month)
+    conn.exec_driver_sql("DROP TABLE trips_incoming, trips_removed")
+
+    seconds = time.perf_counter() - start
+    counts.update(
+        month=str(month),
+        load_seconds=round(load_seconds, 3),
+        seconds=round(seconds, 3),
+        rows_per_second=round(counts["rows"] / seconds) if seconds else None,
+    )
+    logger.info(
+        "%s: %s of %s rows loaded for %s (%s replaced, %s with unknown stations)"
+        " in %.1fs, %s rows/s (%.0f rows/s reading and copying)",
+        path,
+        counts["loaded"],
+        counts["rows"],
+        month,
+        counts["replaced"],
+        counts["unmatched_stations"],
+        seconds,
+        counts["rows_per_second"],
+        counts["rows"] / load_seconds if load_seconds else 0,
+    )
+    return counts
+
+
+def record_loads(conn, months):
+    """Record ``months`` as loaded now, which changes the data version."""
+    conn.exec_driver_sql(
+        f"""
+        CREATE TABLE IF NOT EXISTS {cache.loads_table} (
+            month date PRIMARY KEY,
+            loaded_at timestamptz NOT NULL
+        )
+        """
+    )
+    for month in months:
+        conn.exec_driver_sql(
+            f"""
+            INSERT INTO {cache.loads_table} VALUES (%s, clock_timestamp())
+            ON CONFLICT (month) DO UPDATE SET loaded_at = EXCLUDED.loaded_at
+            """,
+            (f"{month}-01",),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="+", help="monthly trip CSV files, or zips")
+    parser.add_argument(
+        "--month", help="month of the trips (YYYY-MM), for a single file"
+    )
+    parser.add_argument("--chunk-size", type=int, default=chunk_size)
+    args = parser.parse_args()
+    if db.backend != "postgres":
+        parser.error(
+            "trips are loaded into Postgres; export them afterwards with"
+            " python -m bluebikes.columnar --since YYYY-MM"
+        )
+    if args.month and len(args.files) > 1:
+        parser.error("--month applies to a single file")
+    logging.basicConfig(level=logging.INFO)
+
+    months = []
+    for path in args.files:
+        month = pd.Period(args.month or file_month(path), "M")
+        # Creating a partition blocks the pages until its transaction ends, so
+        # it gets its own before the load.
+        with db.get_engine().begin() as conn:
+            if partitions.is_partitioned(conn):
+                partitions.ensure(conn, month.start_time)
+        with db.get_engine().begin() as conn:
+            months.append(ingest(conn, path, month, args.chunk_size)["month"])
+    since = f"{min(months)}-01"
+    with db.get_engine().begin() as conn:
+        if inspect(conn).has_table(rollup.state_table):
+            rollup.refresh(conn, since=since)
+    if cube.load() is not None:
+        with db.connect() as conn:
+            cube.build(conn, since=since)
+    # Last, so the pages do not cache results of the old rollups and cube
+    # under the new version.
+    with db.get_engine().begin() as conn:
+        record_loads(conn, months)
+
+
+if __name__ == "__main__":
+    main()
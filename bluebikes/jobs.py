@@ -0,0 +1,475 @@
+"""
+Background jobs for the station queries that take seconds over long ranges.
+
+A sync gunicorn worker serves one request at a time, so a full-history hourly
+chart would hold it for seconds while other visitors queue behind it. The
+station callbacks ``run`` such a query as a job instead and answer at once
+with a placeholder; the page then polls the job every second, showing its
+place in the queue or how long it has run, until ``poll`` hands back the
+result. Queries of fewer than ``JOB_MIN_DAYS`` days, and results the result
+cache or the shared cache already hold, are still computed in the callback.
+
+Jobs are rows of the SQLite file at ``JOBS_PATH``, so no broker is needed. A
+pool of ``JOB_WORKERS`` processes claims them oldest first, runs each query
+through the result cache, which leaves its result in the shared cache as
+well, and stores the pickled result. Identical queries for the same data
+version share one job. One web worker per host runs the pool while holding a
+lock file next to ``JOBS_PATH``; when it exits, another takes over. The pool
+can also run on its own, with ``JOB_WORKERS=0`` for the web workers::
+
+    python -m bluebikes.jobs                # JOB_WORKERS worker processes
+    python -m bluebikes.jobs --workers 4
+
+A job still running after ``JOB_TIMEOUT_SECONDS`` fails and its process is
+replaced; Postgres cancels the job's statements at the same timeout. A job no
+worker has taken by then fails too. Finished jobs are deleted after an hour.
+Counters are at ``/stats/jobs``. An empty ``JOBS_PATH`` computes every query
+in the callback again. Like the shared cache, the file holds pickles and is
+refused when it or its directory belongs to another user.
+"""
+
+import argparse
+import fcntl
+import importlib
+import logging
+import os
+import pickle
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from bluebikes import cache, shared
+
+logger = logging.getLogger(__name__)
+
+jobs_path = os.getenv("JOBS_PATH", os.path.join("data", "jobs.sqlite"))
+job_workers = int(os.getenv("JOB_WORKERS", "2"))
+job_timeout_seconds = float(os.getenv("JOB_TIMEOUT_SECONDS", "120"))
+job_min_days = int(os.getenv("JOB_MIN_DAYS", "365"))
+
+# How long finished jobs, and so their results, are kept.
+keep_seconds = 3600
+# How often idle workers look for a job and the pool checks its workers.
+poll_seconds = 0.2
+supervise_seconds = 1.0
+
+schema = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        key TEXT NOT NULL,
+        func TEXT NOT NULL,
+        args BLOB NOT NULL,
+        status TEXT NOT NULL,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        worker INTEGER,
+        result BLOB,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)",
+    "CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)",
+]
+
+
+def _name(func):
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def _resolve(name):
+    module, qualname = name.split(":")
+    if module.split(".")[0] != "bluebikes":
+        raise ValueError(f"not a bluebikes function: {name}")
+    func = importlib.import_module(module)
+    for attribute in qualname.split("."):
+        func = getattr(func, attribute)
+    return func
+
+
+def long_range(start_date, end_date):
+    """Whether a date range is long enough to query in a job."""
+    return (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days >= job_min_days
+
+
+class JobQueue:
+    def __init__(self, path=jobs_path, timeout=job_timeout_seconds):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.reused = 0
+        self.inline = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                shared.private_path(self.path), timeout=10, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in schema:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def submit(self, func, args, version):
+        """Queue ``func(*args)`` unless a job for it and ``version`` is queued,
+        running or done; returns the job id.
+
+        ``func`` is a memoized query, and jobs are told apart by its canonical
+        arguments, as cached results are."""
+        args = func.canonical_args(*args)
+        key = f"{version}|{_name(func)}{args!r}"
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status != 'failed'"
+                " ORDER BY id DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                self._count("reused")
+                return row[0]
+            job_id = conn.execute(
+                "INSERT INTO jobs (key, func, args, status, created)"
+                " VALUES (?, ?, ?, 'queued', ?)",
+                (
+                    key,
+                    _name(func),
+                    pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL),
+                    time.time(),
+                ),
+            ).lastrowid
+        self._count("submitted")
+        return job_id
+
+    def poll(self, job_id):
+        """Return ``(status, value)``: the result for a ``done`` job, the error
+        of a ``failed`` one, and a progress message while ``queued`` or
+        ``running``."""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT status, created, started, result, error FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return "failed", "The job is gone; change the selection to try again."
+        status, created, started, result, error = row
+        if status == "done":
+            return status, pickle.loads(result)
+        if status == "failed":
+            return status, error
+        if status == "queued":
+            if time.time() - created > self.timeout:
+                error = f"No worker took the job within {self.timeout:.0f}s"
+                self._fail(conn, job_id, error, "queued")
+                return "failed", error
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?",
+                (job_id,),
+            ).fetchone()[0]
+            return status, f"waiting for a worker, {ahead} queued ahead"
+        return (
+            status,
+            f"running for {time.time() - started:.0f}s of at most {self.timeout:.0f}s",
+        )
+
+    def claim(self):
+        """Mark the oldest queued job running in this process; returns its
+        ``(id, func, args)``, or None."""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, func, args FROM jobs WHERE status = 'queued'"
+                " ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, worker = ?"
+                    " WHERE id = ?",
+                    (time.time(), os.getpid(), row[0]),
+                )
+        return row
+
+    def finish(self, job_id, value):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, result = ?"
+                " WHERE id = ? AND status = 'running'",
+                (
+                    time.time(),
+                    pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                    job_id,
+                ),
+            )
+
+    def _fail(self, conn, job_id, error, status="running"):
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, error = ?"
+                " WHERE id = ? AND status = ?",
+                (time.time(), error, job_id, status),
+            )
+
+    def fail(self, job_id, error):
+        self._fail(self._connection(), job_id, error)
+
+    def expire(self):
+        """Fail the jobs running longer than the timeout; returns the process
+        ids of their workers."""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute(
+                "SELECT id, worker FROM jobs WHERE status = 'running' AND started < ?",
+                (time.time() - self.timeout,),
+            ).fetchall()
+            for job_id, _ in expired:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished = ?, error = ?"
+                    " WHERE id = ?",
+                    (time.time(), f"Timed out after {self.timeout:.0f}s", job_id),
+                )
+        return {worker for _, worker in expired}
+
+    def requeue(self):
+        """Queue again the jobs left running by the workers of a previous pool."""
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, worker = NULL"
+                " WHERE status = 'running'"
+            ).rowcount
+
+    def clean(self):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished < ?", (time.time() - keep_seconds,)
+            )
+
+    def stats(self):
+        stats = {
+            "path": self.path or None,
+            "timeout_seconds": self.timeout,
+            "min_days": job_min_days,
+            "submitted": self.submitted,
+            "reused": self.reused,
+            "inline": self.inline,
+            "errors": self.errors,
+        }
+        if self.enabled:
+            try:
+                stats["jobs"] = dict(
+                    self._connection()
+                    .execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+                    .fetchall()
+                )
+            except Exception:
+                self._count("errors")
+                logger.exception("job queue stats failed")
+        return stats
+
+
+queue = JobQueue()
+
+
+def run(func, *args, background=True):
+    """Return ``(None, value)`` with the memoized query ``func(*args)``
+    computed here, or ``(job_id, None)`` of the job computing it.
+
+    Only ``background`` queries not already cached are queued. Should the
+    queue fail, the query is computed here.
+    """
+    if not (background and queue.enabled):
+        return None, func(*args)
+    found, value = func.cached(*args)
+    if found:
+        return None, value
+    try:
+        return queue.submit(func, args, cache.results.data_version()), None
+    except Exception:
+        queue._count("errors")
+        logger.exception("queueing %s failed", _name(func))
+    queue._count("inline")
+    return None, func(*args)
+
+
+def poll(job_id):
+    """``(status, value)`` of a job; see ``JobQueue.poll``."""
+    try:
+        return queue.poll(job_id)
+    except Exception:
+        queue._count("errors")
+        logger.exception("polling job %s failed", job_id)
+        return "failed", "The job queue is unavailable; try again."
+
+
+def work(parent):
+    """Run queued jobs until the pool process ``parent`` that started this
+    one exits."""
+    # Postgres cancels the statements of a job at the same timeout.
+    os.environ["PGOPTIONS"] = (
+        f"{os.getenv('PGOPTIONS', '')}"
+        f" -c statement_timeout={int(queue.timeout * 1000)}".strip()
+    )
+    # The pool passes its own pid: had it exited before this process started,
+    # os.getppid() here would already name the process that adopted it.
+    while os.getppid() == parent:
+        job = queue.claim()
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+        job_id, name, args = job
+        start = time.perf_counter()
+        try:
+            value = _resolve(name)(*pickle.loads(args))
+        except Exception as error:
+            logger.exception("job %s %s failed", job_id, name)
+            queue.fail(job_id, f"{type(error).__name__}: {error}")
+            continue
+        queue.finish(job_id, value)
+        logger.info(
+            "job %s %s done in %.1fs", job_id, name, time.perf_counter() - start
+        )
+
+
+class Pool:
+    def __init__(self, workers=job_workers):
+        self.workers = workers
+        self._thread = None
+        self._lock = threading.Lock()
+        self._processes = []
+        self.active = False
+        self.started = 0
+        self.killed = 0
+        self.errors = 0
+        os.register_at_fork(after_in_child=self._forked)
+
+    def _spawn(self):
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "bluebikes.jobs",
+                "--worker",
+                "--parent",
+                str(os.getpid()),
+            ],
+            stdin=subprocess.DEVNULL,
+        )
+        self._processes.append(process)
+        self.started += 1
+
+    def _check(self):
+        self._processes = [p for p in self._processes if p.poll() is None]
+        expired = queue.expire()
+        for process in self._processes:
+            if process.pid in expired:
+                logger.warning("killing job worker %s after the timeout", process.pid)
+                process.kill()
+                process.wait()
+                self.killed += 1
+        self._processes = [p for p in self._processes if p.poll() is None]
+        while len(self._processes) < self.workers:
+            self._spawn()
+        queue.clean()
+
+    def supervise(self):
+        """Keep ``workers`` processes running the queue; blocks, and waits
+        first while another pool of the host holds the lock."""
+        with open(shared.private_path(queue.path + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.active = True
+            requeued = queue.requeue()
+            if requeued:
+                logger.info("queued %s interrupted jobs again", requeued)
+            while True:
+                try:
+                    self._check()
+                except Exception:
+                    self.errors += 1
+                    logger.exception("job pool check failed")
+                time.sleep(supervise_seconds)
+
+    def start(self):
+        """Start the pool thread of this worker, unless jobs are off."""
+        if not (queue.enabled and self.workers > 0):
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self.supervise, name="bluebikes-jobs", daemon=True
+            )
+            self._thread.start()
+
+    def _forked(self):
+        # A worker forked from a preloaded app has no thread of its own yet.
+        started = self._thread is not None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._processes = []
+        self.active = False
+        if started:
+            self.start()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "processes": [p.pid for p in self._processes if p.poll() is None],
+            "started": self.started,
+            "killed": self.killed,
+            "errors": self.errors,
+        }
+
+
+pool = Pool()
+start = pool.start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(job_workers, 1),
+        help="worker processes running jobs",
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--parent", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if not queue.enabled:
+        parser.error("JOBS_PATH is empty")
+    logging.basicConfig(level=logging.INFO)
+    if args.worker:
+        work(args.parent)
+        return
+    pool.workers = args.workers
+    logger.info("running %s job workers on %s", pool.workers, queue.path)
+    pool.supervise()
+
+
+if __name__ == "__main__":
+    main()
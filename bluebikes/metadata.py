@@ -0,0 +1,154 @@
+"""
+Dataset-wide values the pages need, such as the latest trip date.
+
+Nothing is read at import time: each value is loaded on first use, shared by
+every page in the worker and reloaded once it is older than
+``METADATA_MAX_AGE_SECONDS`` or when the result cache sees new trips. If a
+reload fails the previous value is kept and the load is retried on a later
+call. Values registered with ``shared=True`` are loaded once per host through
+``bluebikes.shared`` and read from there by the other workers.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from bluebikes import cache, db, rollup, shared
+
+logger = logging.getLogger(__name__)
+
+metadata_max_age_seconds = float(os.getenv("METADATA_MAX_AGE_SECONDS", "300"))
+
+
+class Metadata:
+    def __init__(self, max_age=metadata_max_age_seconds):
+        self.max_age = max_age
+        self._loaders = {}
+        self._shared = set()
+        self._load_locks = {}
+        self._values = {}
+        self._loads = {}
+
+    def _stale(self, entry):
+        return entry is None or time.monotonic() - entry[1] > self.max_age
+
+    def get(self, name):
+        entry = self._values.get(name)
+        if self._stale(entry):
+            # One thread loads while the others wait for its result.
+            with self._load_locks[name]:
+                entry = self._values.get(name)
+                if self._stale(entry):
+                    entry = self._load(name, entry)
+        return entry[0]
+
+    def _load(self, name, entry):
+        start = time.perf_counter()
+        try:
+            if name in self._shared:
+                value = shared.store.compute(
+                    f"{db.backend}:metadata.{name}",
+                    cache.results.data_version(),
+                    self._loaders[name],
+                    max_age=self.max_age,
+                )
+            else:
+                value = self._loaders[name]()
+        except Exception:
+            if entry is None:
+                raise
+            logger.exception("reloading %s failed, keeping the previous value", name)
+            return entry
+        seconds = time.perf_counter() - start
+        entry = (value, time.monotonic(), seconds)
+        self._values[name] = entry
+        self._loads[name] = self._loads.get(name, 0) + 1
+        logger.info("loaded %s in %.3fs", name, seconds)
+        return entry
+
+    def value(self, name, shared=False):
+        """Register the decorated loader under ``name`` and return a function
+        that gives its current value. ``shared`` values must pickle."""
+
+        def decorator(loader):
+            self._loaders[name] = loader
+            if shared:
+                self._shared.add(name)
+            self._load_locks[name] = threading.Lock()
+
+            @functools.wraps(loader)
+            def wrapper():
+                return self.get(name)
+
+            wrapper.load = loader
+            return wrapper
+
+        return decorator
+
+    def warm(self):
+        """Load every value that is not loaded or is stale."""
+        for name in list(self._loaders):
+            self.get(name)
+
+    def refresh(self, name=None):
+        """Forget one value, or all of them, so the next use reloads it."""
+        for key in [name] if name is not None else list(self._values):
+            self._values.pop(key, None)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "max_age_seconds": self.max_age,
+            "values": {
+                name: {
+                    "loaded": name in self._values,
+                    "age_seconds": now - self._values[name][1]
+                    if name in self._values
+                    else None,
+                    "load_seconds": self._values[name][2]
+                    if name in self._values
+                    else None,
+                    "loads": self._loads.get(name, 0),
+                }
+                for name in self._loaders
+            },
+        }
+
+
+service = Metadata()
+value = service.value
+cache.results.on_new_data(service.refresh)
+
+
+@value("max_ride_date")
+def max_ride_date():
+    """Day of the latest trip, the upper bound of the pages' date pickers."""
+    with db.connect() as conn:
+        latest = cache.latest_trip(conn)
+    return pd.Timestamp(latest).date()
+
+
+@value("station_names", shared=True)
+def station_names():
+    """Station names, busiest first, for the station dropdown.
+
+    Starts are counted from the daily rollup where it exists, which leaves out
+    the newest day, rather than by scanning every trip.
+    """
+    if rollup.coverage() is not None:
+        starts = f"(SELECT station_id, n_starts FROM {rollup.stations_table})"
+    else:
+        starts = "(SELECT start_station_id AS station_id, 1 AS n_starts FROM trips)"
+    stations_query = f"""
+                SELECT s.name
+                FROM stations s
+                LEFT JOIN {starts} t on s.station_id = t.station_id
+                GROUP BY s.name
+                ORDER BY COALESCE(SUM(t.n_starts), 0) desc
+                """
+    with db.connect() as conn:
+        return pd.read_sql(stations_query, con=conn)["name"]
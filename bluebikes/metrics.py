@@ -0,0 +1,236 @@
+"""
+Latency histograms of Dash callbacks and SQL statements, served at ``/metrics``.
+
+Every callback request records its wall time, the time spent in the database,
+in pandas post-processing and in building figures, and the size of the
+response. Every statement records its database time and the rows it returned,
+labelled with its ``bluebikes.statements`` name, or else the first table it
+reads. ``render()`` gives them in the Prometheus text format. Histograms are
+per worker, like the other ``/stats`` pages.
+
+Callbacks mark their phases with a stopwatch::
+
+    watch = metrics.stopwatch()
+    ...  # shape the query results
+    watch.lap("pandas")
+    ...  # build the figures
+    watch.lap("figure")
+
+Statements slower than ``SLOW_QUERY_SECONDS`` are logged with their bound
+parameters.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+slow_query_seconds = os.getenv("SLOW_QUERY_SECONDS")
+slow_query_seconds = float(slow_query_seconds) if slow_query_seconds else None
+
+second_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+byte_buckets = (1e3, 1e4, 1e5, 1e6, 1e7)
+row_buckets = (1, 10, 100, 1e3, 1e4, 1e5, 1e6)
+
+phases = ("db", "pandas", "figure")
+
+
+class Histogram:
+    def __init__(self, name, description, label, buckets):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {
+                k: (list(counts), total) for k, (counts, total) in self._series.items()
+            }
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:g}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+callback_seconds = Histogram(
+    "bluebikes_callback_seconds",
+    "Wall time of Dash callback requests.",
+    "callback",
+    second_buckets,
+)
+callback_phase_seconds = {
+    phase: Histogram(
+        f"bluebikes_callback_{phase}_seconds",
+        f"Time Dash callbacks spent in {phase} work.",
+        "callback",
+        second_buckets,
+    )
+    for phase in phases
+}
+callback_response_bytes = Histogram(
+    "bluebikes_callback_response_bytes",
+    "Size of serialized Dash callback responses.",
+    "callback",
+    byte_buckets,
+)
+query_seconds = Histogram(
+    "bluebikes_query_seconds",
+    "Database time of SQL statements.",
+    "statement",
+    second_buckets,
+)
+query_rows = Histogram(
+    "bluebikes_query_rows",
+    "Rows returned by SQL statements.",
+    "statement",
+    row_buckets,
+)
+histograms = [
+    callback_seconds,
+    *callback_phase_seconds.values(),
+    callback_response_bytes,
+    query_seconds,
+    query_rows,
+]
+
+# Phase totals of the callback request being served, shared with the
+# executor's threads through their copied context.
+_request_phases = contextvars.ContextVar("request_phases", default=None)
+statement_name = contextvars.ContextVar("statement_name", default=None)
+_phase_lock = threading.Lock()
+
+
+def _add_phase(phase, seconds):
+    totals = _request_phases.get()
+    if totals is not None:
+        with _phase_lock:
+            totals[phase] += seconds
+
+
+class Stopwatch:
+    def __init__(self):
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Count the time since the previous lap (or the start) toward ``phase``."""
+        now = time.perf_counter()
+        _add_phase(phase, now - self._last)
+        self._last = now
+
+
+def stopwatch():
+    return Stopwatch()
+
+
+_table = re.compile(r"\bfrom\s+([a-z_][\w.]*)", re.IGNORECASE)
+
+
+def _statement_label(statement):
+    name = statement_name.get()
+    if name is not None:
+        return name
+    match = _table.search(statement)
+    return match.group(1) if match else "other"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start goes on the statement's execution context, which is dropped
+    # with it, so statements that fail leave nothing behind on the connection.
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(context, "_query_start", None) is None:
+        return
+    seconds = time.perf_counter() - context._query_start
+    label = _statement_label(statement)
+    query_seconds.observe(label, seconds)
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        query_rows.observe(label, cursor.rowcount)
+    _add_phase("db", seconds)
+    if slow_query_seconds is not None and seconds > slow_query_seconds:
+        logger.warning(
+            "slow query %s took %.3fs: %s parameters=%r",
+            label,
+            seconds,
+            " ".join(statement.split()),
+            parameters,
+        )
+
+
+def instrument_engine(engine):
+    """Time every statement run on ``engine``."""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def instrument_app(app):
+    """Time every callback request the Dash ``app`` serves."""
+    dispatch_path = app.config.routes_pathname_prefix + "_dash-update-component"
+
+    def _callback_name():
+        body = flask.request.get_json(silent=True) or {}
+        callback = app.callback_map.get(body.get("output"), {}).get("callback")
+        return getattr(callback, "__name__", "unknown")
+
+    @app.server.before_request
+    def _start_callback():
+        if flask.request.path == dispatch_path:
+            flask.g.metrics_start = time.perf_counter()
+            flask.g.metrics_token = _request_phases.set(dict.fromkeys(phases, 0.0))
+
+    @app.server.after_request
+    def _record_callback(response):
+        start = flask.g.pop("metrics_start", None)
+        if start is not None:
+            name = _callback_name()
+            callback_seconds.observe(name, time.perf_counter() - start)
+            for phase, seconds in _request_phases.get().items():
+                callback_phase_seconds[phase].observe(name, seconds)
+            callback_response_bytes.observe(
+                name, response.calculate_content_length() or 0
+            )
+            _request_phases.reset(flask.g.pop("metrics_token"))
+        return response
+
+
+def render():
+    return "\n".join(h.render() for h in histograms) + "\n"
@@ -0,0 +1,384 @@
+"""
+Versioned schema migrations for the Postgres tables the pages read, and a
+check of the plans of the queries they run.
+
+    python -m bluebikes.migrations            # apply pending migrations
+    python -m bluebikes.migrations --status   # list applied and pending ones
+    python -m bluebikes.migrations --check    # EXPLAIN the page queries
+
+Applied versions are recorded in ``schema_migrations``; pending ones run in
+order in one transaction. The indexes follow the queries' predicates:
+
+* ``start_station_id = ? AND started_at BETWEEN ...`` and its ``end`` twin
+  use b-trees on the station and time that include every column the station
+  queries aggregate, so they are answered without visiting ``trips``;
+* range-only ``started_at`` predicates use a BRIN index, a few kilobytes for
+  trips loaded in time order, which replaces the ``started_at`` b-tree;
+  ``MAX(started_at)`` is read from the station index instead (see
+  ``bluebikes.cache``);
+* ``stations.name``, by which trips are matched to stations, is unique.
+
+Plain b-trees on the same columns are dropped as the new ones replace them.
+The fourth migration moves ``trips`` into monthly partitions, keeping these
+indexes on every partition (see ``bluebikes.partitions``). The fifth and the
+sixth roll up the station rollups again, the sixth to count every trip of a
+station again next to the trips whose other end is a known station.
+
+``--check`` verifies the indexes exist, then runs the station queries of both
+pages, their fallbacks to ``trips`` and the startup queries for the busiest
+station, EXPLAINs every statement they sent and exits with an error if any
+plan reads all of ``trips`` with sequential scans. Reading a partition whole
+is fine, since its month is within the queried range or small.
+"""
+
+import argparse
+import json
+import logging
+import re
+import sys
+
+import pandas as pd
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.pool import NullPool
+
+from bluebikes import db, metrics, partitions, rollup, trip_columns
+
+logger = logging.getLogger(__name__)
+
+migrations_table = "schema_migrations"
+
+# Columns the station queries read from the trips of one station and range.
+covered_columns = [
+    "duration",
+    "distance",
+    "speed",
+    "is_member",
+    "start_hour",
+    "start_isodow",
+    "start_day",
+]
+
+station_indexes = {
+    f"trips_{role}_station_time": f"""
+    CREATE INDEX IF NOT EXISTS trips_{role}_station_time
+    ON trips ({role}_station_id, started_at)
+    INCLUDE ({other}_station_id, {', '.join(covered_columns)})
+    """
+    for role, other in (("start", "end"), ("end", "start"))
+}
+time_indexes = {
+    "trips_started_at_brin": """
+    CREATE INDEX IF NOT EXISTS trips_started_at_brin
+    ON trips USING brin (started_at)
+    """,
+}
+station_name_indexes = {
+    "stations_name": "CREATE UNIQUE INDEX IF NOT EXISTS stations_name ON stations (name)",
+}
+
+# Plain b-trees the indexes above replace.
+replaced_indexes = [
+    ["start_station_id", "started_at"],
+    ["end_station_id", "started_at"],
+    ["started_at"],
+]
+
+plain_indexes_query = """
+    SELECT i.indexrelid::regclass::text
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_am am ON am.oid = c.relam
+    WHERE i.indrelid = %(table)s::regclass
+    AND am.amname = 'btree'
+    AND NOT i.indisunique
+    AND i.indpred IS NULL
+    AND i.indexprs IS NULL
+    AND i.indnatts = i.indnkeyatts
+    AND ARRAY(
+        SELECT a.attname::text
+        FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, n)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        ORDER BY k.n
+    ) = %(columns)s"""
+
+
+def _trip_indexes(conn):
+    for statement in [*station_indexes.values(), *time_indexes.values()]:
+        conn.exec_driver_sql(statement)
+    for columns in replaced_indexes:
+        for (name,) in conn.exec_driver_sql(
+            plain_indexes_query, {"table": "trips", "columns": columns}
+        ).fetchall():
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+            logger.info("dropped %s, replaced by the new trips indexes", name)
+
+
+# (version, description, statements or a function of the connection)
+migrations = [
+    (1, "derived trip columns", trip_columns.migrate),
+    (2, "station, time and BRIN indexes on trips", _trip_indexes),
+    (3, "unique station names", list(station_name_indexes.values())),
+    (4, "monthly partitions of trips", partitions.convert),
+    (5, "station rollups of trips between known stations", rollup.rebuild),
+    (6, "station rollup totals of every trip", rollup.rebuild),
+]
+
+expected_indexes = {
+    "trips": [*station_indexes, *time_indexes],
+    "stations": list(station_name_indexes),
+}
+
+
+def applied(conn):
+    """``{version: applied_at}`` of the migrations recorded as applied."""
+    if not inspect(conn).has_table(migrations_table):
+        return {}
+    return dict(
+        conn.exec_driver_sql(
+            f"SELECT version, applied_at FROM {migrations_table}"
+        ).fetchall()
+    )
+
+
+def apply(conn):
+    """Run the pending migrations in order; returns their versions."""
+    conn.exec_driver_sql(
+        f"""
+        CREATE TABLE IF NOT EXISTS {migrations_table} (
+            version integer PRIMARY KEY,
+            description text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
+    )
+    done = applied(conn)
+    ran = []
+    for version, description, steps in migrations:
+        if version in done:
+            continue
+        if callable(steps):
+            steps(conn)
+        else:
+            for statement in steps:
+                conn.exec_driver_sql(statement)
+        conn.exec_driver_sql(
+            f"INSERT INTO {migrations_table} (version, description) VALUES (%s, %s)",
+            (version, description),
+        )
+        logger.info("applied migration %s: %s", version, description)
+        ran.append(version)
+    return ran
+
+
+def vacuum(engine, tables=("trips", "stations")):
+    """VACUUM and ANALYZE ``tables``; index-only scans need the visibility map
+    VACUUM sets."""
+    with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        for table in tables:
+            conn.exec_driver_sql(f"VACUUM ANALYZE {table}")
+
+
+def verify(conn):
+    """Names of expected indexes that are missing or invalid."""
+    valid = {
+        name
+        for (name,) in conn.exec_driver_sql(
+            """
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indisvalid
+            """
+        ).fetchall()
+    }
+    return [
+        name
+        for names in expected_indexes.values()
+        for name in names
+        if name not in valid
+    ]
+
+
+class _Recorder:
+    """Statements sent on the pooled engine, with PREPAREd ones resolved to
+    their text and the values of their first EXECUTE."""
+
+    _prepare = re.compile(r"PREPARE (\w+) AS (.*)", re.DOTALL)
+    _execute = re.compile(r"EXECUTE (\w+)")
+
+    def __init__(self):
+        self.prepared = {}
+        self.statements = {}
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        prepare = self._prepare.match(statement)
+        if prepare is not None:
+            self.prepared[prepare.group(1)] = prepare.group(2)
+            return
+        execute = self._execute.match(statement)
+        if execute is not None:
+            statement = self.prepared.get(execute.group(1))
+            if statement is None:
+                return
+        label = metrics.statement_name.get() or " ".join(statement.split())[:60]
+        self.statements.setdefault(statement, (label, parameters, execute is not None))
+
+
+def _exercise(station_id, start_date, end_date):
+    from bluebikes import metadata, queries, sketches
+
+    exact_medians = sketches.exact_medians
+    try:
+        for exact in (False, True):
+            sketches.exact_medians = exact
+            for station_role in queries.station_columns:
+                queries.station_trip_counts.uncached(station_role, start_date, end_date)
+                queries.top_destinations.uncached(
+                    station_id, station_role, start_date, end_date
+                )
+                for date_type in queries.date_type_conversions:
+                    queries.time_buckets.uncached(
+                        station_id, station_role, date_type, start_date, end_date
+                    )
+    finally:
+        sketches.exact_medians = exact_medians
+    queries.station_basics.uncached(station_id, start_date, end_date)
+    queries.hourly_flow.uncached(station_id, start_date, end_date)
+    metadata.max_ride_date.load()
+    metadata.station_names.load()
+
+
+def _seq_scans(plan, tables=("trips",)):
+    """Names of ``tables`` the plan reads with a sequential scan."""
+    found = set()
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in tables:
+        found.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found |= _seq_scans(child, tables)
+    return found
+
+
+def _populated_partitions(conn):
+    # Empty partitions, such as those created ahead of the data, cost nothing
+    # to scan; a plan reading every other one still reads all trips.
+    names = {
+        name
+        for name in partitions.partitions(conn)
+        if conn.exec_driver_sql(f"SELECT EXISTS (SELECT FROM {name})").scalar()
+    }
+    return names or {"trips"}
+
+
+def _explain(conn, number, statement, parameters, prepared):
+    if prepared:
+        conn.exec_driver_sql(f"PREPARE plan_check_{number} AS {statement}")
+        placeholders = ", ".join(["%s"] * len(parameters))
+        explained = f"EXPLAIN (FORMAT JSON) EXECUTE plan_check_{number}"
+        if parameters:
+            explained += f"({placeholders})"
+    else:
+        explained = f"EXPLAIN (FORMAT JSON) {statement}"
+    result = conn.exec_driver_sql(explained, parameters or ())
+    plan = result.scalar()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+def check_plans(ranges=("day", "month", "year")):
+    """EXPLAIN every statement the station queries send for the busiest
+    station over ranges ending the day after the latest trip, which reach past
+    the rollups and the cube, so the queries they fall back to are checked
+    too. Returns ``(statements explained, [(label, statement)] reading every
+    partition of trips, or the unpartitioned table, sequentially)``."""
+    from bluebikes import dimension, metadata
+
+    offsets = {
+        "day": pd.DateOffset(days=1),
+        "month": pd.DateOffset(months=1),
+        "year": pd.DateOffset(years=1),
+    }
+    end = pd.Timestamp(metadata.max_ride_date.load()) + pd.DateOffset(days=1)
+    station_id = dimension.stations.load().station_id(
+        metadata.station_names.load().iloc[0]
+    )
+
+    recorder = _Recorder()
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", recorder)
+    try:
+        for name in ranges:
+            start = end - offsets[name]
+            _exercise(station_id, f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}")
+    finally:
+        event.remove(engine, "before_cursor_execute", recorder)
+
+    failures = []
+    check_engine = create_engine(db.database_url, poolclass=NullPool)
+    try:
+        with check_engine.begin() as conn:
+            tables = _populated_partitions(conn)
+            for number, (statement, (label, parameters, prepared)) in enumerate(
+                recorder.statements.items()
+            ):
+                plan = _explain(conn, number, statement, parameters, prepared)
+                if _seq_scans(plan, tables) == tables:
+                    failures.append((label, statement))
+            conn.exec_driver_sql("DEALLOCATE ALL")
+    finally:
+        check_engine.dispose()
+    return len(recorder.statements), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--status", action="store_true", help="list the migrations")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="verify the indexes and that no page query scans all of trips",
+    )
+    args = parser.parse_args()
+    if db.backend != "postgres":
+        parser.error("migrations apply to the Postgres database")
+    logging.basicConfig(level=logging.INFO)
+
+    engine = db.get_engine()
+    if args.status:
+        with engine.connect() as conn:
+            done = applied(conn)
+        for version, description, _ in migrations:
+            state = (
+                f"applied {done[version]:%Y-%m-%d %H:%M}"
+                if version in done
+                else "pending"
+            )
+            print(f"{version:>3}  {state:<22} {description}")
+        return
+    if args.check:
+        with engine.connect() as conn:
+            missing = verify(conn)
+        if missing:
+            logger.error("missing indexes: %s", ", ".join(missing))
+        explained, failures = check_plans()
+        for label, statement in failures:
+            logger.error(
+                "%s scans all of trips: %s", label, " ".join(statement.split())
+            )
+        logger.info(
+            "explained %s statements, %s reading all of trips sequentially",
+            explained,
+            len(failures),
+        )
+        if missing or failures:
+            sys.exit(1)
+        return
+
+    with engine.begin() as conn:
+        ran = apply(conn)
+    if ran:
+        vacuum(engine)
+    else:
+        logger.info("no pending migrations")
+
+
+if __name__ == "__main__":
+    main()
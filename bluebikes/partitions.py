@@ -0,0 +1,272 @@
+"""
+Monthly range partitions of ``trips``.
+
+Every page query filters ``started_at`` on the selected range, so with one
+partition per month (``trips_2023_06`` holds June 2023) Postgres reads only
+the months a range overlaps, at planning time for literal bounds and when a
+prepared statement starts for bound parameters. Autovacuum and ANALYZE work
+month by month, and finished months are never touched again.
+
+``convert`` moves an unpartitioned ``trips`` into partitions; it is the
+fourth of ``bluebikes.migrations``. Create the partitions of coming months
+ahead of the data, for example from cron, with::
+
+    python -m bluebikes.partitions              # through PARTITION_MONTHS_AHEAD months on
+    python -m bluebikes.partitions --ahead 6
+
+``bluebikes.ingest`` also creates the partition of the month it loads.
+"""
+
+import argparse
+import logging
+import os
+import re
+
+import pandas as pd
+
+from bluebikes import db
+
+logger = logging.getLogger(__name__)
+
+months_ahead = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+staging_table = "trips_partitioned"
+
+
+def partition_name(month):
+    return month.strftime("trips_%Y_%m")
+
+
+def _bounds(month):
+    return f"'{month.start_time:%Y-%m-%d}'", f"'{(month + 1).start_time:%Y-%m-%d}'"
+
+
+def is_partitioned(conn, table="trips"):
+    return bool(
+        conn.exec_driver_sql(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table,)
+        ).scalar()
+    )
+
+
+def partitions(conn, table="trips"):
+    """Names of the partitions of ``table``, oldest month first; just
+    ``table`` when it has none."""
+    return [
+        name
+        for (name,) in conn.exec_driver_sql(
+            "SELECT relid::regclass::text FROM pg_partition_tree(%s)"
+            " WHERE isleaf ORDER BY 1",
+            (table,),
+        ).fetchall()
+    ]
+
+
+def ensure(conn, first, last=None, table="trips"):
+    """Create the missing monthly partitions of ``table``, the partitioned
+    ``trips`` or the table that will replace it, from the month of
+    ``first`` to the month of ``last`` (or just ``first``); returns their names.
+
+    Creating a partition locks ``table`` against readers until the
+    transaction ends, so run this in a short transaction of its own.
+    """
+    first = pd.Timestamp(first).to_period("M")
+    last = first if last is None else pd.Timestamp(last).to_period("M")
+    existing = set(partitions(conn, table))
+    created = []
+    for month in pd.period_range(first, last, freq="M"):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        low, high = _bounds(month)
+        conn.exec_driver_sql(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({low}) TO ({high})"
+        )
+        created.append(name)
+    if created:
+        logger.info("created partitions %s", ", ".join(created))
+    return created
+
+
+def _copied_columns(conn):
+    # Generated columns are computed again as rows are inserted.
+    return [
+        name
+        for (name,) in conn.exec_driver_sql(
+            """
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'trips'
+            AND is_generated = 'NEVER'
+            ORDER BY ordinal_position
+            """
+        ).fetchall()
+    ]
+
+
+def _indexes(conn, table):
+    # Every index but the primary key, which the partitioned table replaces.
+    return conn.exec_driver_sql(
+        """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+        ORDER BY c.relname
+        """,
+        (table,),
+    ).fetchall()
+
+
+def _dependent_views(conn):
+    # Views and materialized views reading trips, directly or through one
+    # another, those read by others last.
+    return conn.exec_driver_sql(
+        """
+        WITH RECURSIVE dependents (oid, depth) AS (
+            SELECT r.ev_class, 1
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass
+            AND d.refobjid = 'trips'::regclass
+            AND r.ev_class <> 'trips'::regclass
+            UNION ALL
+            SELECT r.ev_class, dependents.depth + 1
+            FROM dependents
+            JOIN pg_depend d
+                ON d.refobjid = dependents.oid AND d.classid = 'pg_rewrite'::regclass
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE r.ev_class <> dependents.oid
+        )
+        SELECT c.relname,
+               c.relkind = 'm',
+               pg_get_viewdef(c.oid),
+               obj_description(c.oid, 'pg_class')
+        FROM dependents
+        JOIN pg_class c ON c.oid = dependents.oid
+        GROUP BY c.oid
+        ORDER BY MAX(dependents.depth), c.relname
+        """
+    ).fetchall()
+
+
+def convert(conn):
+    """Move an unpartitioned ``trips`` into monthly partitions, with the same
+    columns and indexes, in the caller's transaction. The views and
+    materialized views over ``trips`` are dropped and created again over the
+    partitions with their indexes and comments.
+
+    Writers wait for the whole move; the pages keep reading the old table
+    until the final swap, which holds an exclusive lock only for renames and
+    the views.
+    """
+    if is_partitioned(conn):
+        logger.info("trips is already partitioned")
+        return False
+    conn.exec_driver_sql("LOCK TABLE trips IN SHARE ROW EXCLUSIVE MODE")
+    indexes = _indexes(conn, "trips")
+    # A unique index of a partitioned table must hold the partition key.
+    unpartitionable = [
+        name
+        for name, definition in indexes
+        if definition.startswith("CREATE UNIQUE")
+        and not re.search(r"\bstarted_at\b", definition.split(" USING ", 1)[1])
+    ]
+    if unpartitionable:
+        raise ValueError(
+            "unique indexes without started_at cannot be kept on partitions: "
+            + ", ".join(unpartitionable)
+        )
+    views = _dependent_views(conn)
+    view_indexes = {name: _indexes(conn, name) for name, *_ in views}
+    conn.exec_driver_sql(
+        f"""
+        CREATE TABLE {staging_table}
+        (LIKE trips INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STATISTICS)
+        PARTITION BY RANGE (started_at)
+        """
+    )
+    # The primary key of a partitioned table must hold the partition key.
+    conn.exec_driver_sql(
+        f"ALTER TABLE {staging_table} ADD CONSTRAINT {staging_table}_pkey"
+        " PRIMARY KEY (trip_id, started_at)"
+    )
+    first, last = conn.exec_driver_sql(
+        "SELECT MIN(started_at), MAX(started_at) FROM trips"
+    ).one()
+    if first is not None:
+        ensure(conn, first, last, staging_table)
+        columns = ", ".join(_copied_columns(conn))
+        for month in pd.period_range(
+            pd.Timestamp(first).to_period("M"), pd.Timestamp(last).to_period("M")
+        ):
+            low, high = _bounds(month)
+            copied = conn.exec_driver_sql(
+                f"""
+                INSERT INTO {staging_table} ({columns})
+                SELECT {columns} FROM trips
+                WHERE started_at >= {low} AND started_at < {high}
+                """
+            ).rowcount
+            logger.info("moved %s trips of %s", copied, month)
+
+    # Indexes are built once the partitions hold their rows, under temporary
+    # names until the old table and its indexes are gone.
+    for name, definition in indexes:
+        definition = re.sub(
+            rf"INDEX {name} ON (\S+\.)?trips ",
+            f"INDEX {name}_new ON {staging_table} ",
+            definition,
+            count=1,
+        )
+        conn.exec_driver_sql(definition)
+
+    for name, materialized, _, _ in reversed(views):
+        kind = "MATERIALIZED VIEW" if materialized else "VIEW"
+        conn.exec_driver_sql(f"DROP {kind} {name}")
+    conn.exec_driver_sql("DROP TABLE trips")
+    conn.exec_driver_sql(f"ALTER TABLE {staging_table} RENAME TO trips")
+    conn.exec_driver_sql(
+        f"ALTER TABLE trips RENAME CONSTRAINT {staging_table}_pkey TO trips_pkey"
+    )
+    for name, _ in indexes:
+        conn.exec_driver_sql(f"ALTER INDEX {name}_new RENAME TO {name}")
+    conn.exec_driver_sql("ANALYZE trips")
+
+    for name, materialized, definition, comment in views:
+        kind = "MATERIALIZED VIEW" if materialized else "VIEW"
+        # Without parameters the driver still reads % as a placeholder.
+        conn.exec_driver_sql(f"CREATE {kind} {name} AS {definition}".replace("%", "%%"))
+        for _, index_definition in view_indexes[name]:
+            conn.exec_driver_sql(index_definition.replace("%", "%%"))
+        if comment is not None:
+            conn.exec_driver_sql(f"COMMENT ON {kind} {name} IS %s", (comment,))
+        logger.info("created %s again over the partitions", name)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--ahead",
+        type=int,
+        default=months_ahead,
+        help="months after the current one to create partitions for",
+    )
+    args = parser.parse_args()
+    if db.backend != "postgres":
+        parser.error("trips is only partitioned in Postgres")
+    logging.basicConfig(level=logging.INFO)
+    with db.get_engine().begin() as conn:
+        if not is_partitioned(conn):
+            parser.error("trips is not partitioned; run python -m bluebikes.migrations")
+        now = pd.Timestamp.now()
+        if not ensure(conn, now, now + pd.DateOffset(months=args.ahead)):
+            logger.info(
+                "partitions exist through %s",
+                (now + pd.DateOffset(months=args.ahead)).strftime("%Y-%m"),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Station-level queries shared by the Station Map and Station Analysis pages.
+
+Every function is memoized on canonical arguments (see ``bluebikes.cache``).
+The pages resolve station names to ids with ``bluebikes.dimension`` and then
+ask for results by id, role and day.
+"""
+
+import numpy as np
+import pandas as pd
+
+from bluebikes import (
+    cube,
+    db,
+    dimension,
+    executor,
+    flow,
+    rollup,
+    sketches,
+    statements,
+    trip_columns,
+)
+from bluebikes.cache import day, memoize, role, scalar
+
+# role -> (column holding the selected station, column holding the other end)
+station_columns = {
+    "start": ("start_station_id", "end_station_id"),
+    "end": ("end_station_id", "start_station_id"),
+}
+
+date_type_conversions = {
+    "Quarter": "quarter",
+    "Month": "month",
+    "Week": "week",
+    "Day of Week": "isodow",
+    "Hour": "hour",
+}
+
+# Clock fields stored as trip columns (see ``bluebikes.trip_columns``).
+date_columns = {"Day of Week": "start_isodow", "Hour": "start_hour"}
+
+
+def use_sketches():
+    """Whether medians may be read from the rollup's sketches instead of
+    sorting trips (see ``bluebikes.sketches``)."""
+    return not sketches.exact_medians and rollup.coverage() is not None
+
+
+@memoize(
+    lambda station_type, start_date, end_date: (
+        role(station_type),
+        day(start_date),
+        day(end_date),
+    )
+)
+def station_trip_counts(station_role, start_date, end_date):
+    params = statements.Params()
+    query = rollup.station_counts_query(params, station_role, start_date, end_date)
+    with db.connect() as conn:
+        counts = statements.read(conn, "station_trip_counts", query, params)
+    return dimension.stations().decorate(counts[["key", "n_trips"]])
+
+
+@memoize(
+    lambda station_id, station_type, start_date, end_date: (
+        scalar(station_id),
+        role(station_type),
+        day(start_date),
+        day(end_date),
+    )
+)
+def top_destinations(station_id, station_role, start_date, end_date):
+    """The 25 most common other ends of trips starting or ending at a station."""
+    station_id_type, reverse_station_id_type = station_columns[station_role]
+    params = statements.Params()
+    counts = rollup.pair_counts_query(
+        params, station_role, station_id, start_date, end_date
+    )
+    # Counts come from the rollup; only the medians still need the raw trips,
+    # and only those between the station and its top 25 destinations.
+    query = f"""
+            with top as (
+            SELECT s.station_id, s.name, s.longitude, s.latitude, c.n_trips, c.n_member
+            FROM ({counts}
+            ) c
+            INNER JOIN stations s on c.key = s.station_id
+            ORDER BY c.n_trips desc
+            LIMIT 25),
+
+            medians as (
+            SELECT t.{reverse_station_id_type} station_id,
+            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
+            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
+            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY {trip_columns.sql("speed")}) "Median Speed"
+            FROM trips t
+            WHERE t.{station_id_type} = {params(station_id)}
+            AND t.{reverse_station_id_type} IN (SELECT station_id FROM top)
+            AND t.started_at between {params(start_date)} and {params(end_date)}
+            GROUP BY 1)
+
+            SELECT top.name, top.longitude, top.latitude, top.n_trips "Number of Trips",
+            top.n_member::float / top.n_trips "Percent Member",
+            m."Median Duration", m."Median Distance", m."Median Speed"
+            FROM top
+            LEFT JOIN medians m USING (station_id)
+            ORDER BY 4 desc
+            """
+    with db.connect() as conn:
+        return statements.read(conn, "top_destinations", query, params)
+
+
+@memoize(
+    lambda station_id, start_date, end_date: (
+        scalar(station_id),
+        day(start_date),
+        day(end_date),
+    )
+)
+def station_basics(station_id, start_date, end_date):
+    start_rides, end_rides = executor.gather(
+        (_rides, "start", station_id, start_date, end_date),
+        (_rides, "end", station_id, start_date, end_date),
+    )
+    stations = dimension.stations()
+    info = {
+        column: [stations.attribute(station_id, column)]
+        for column in ("name", "district", "deployment_year", "total_docks")
+    }
+    return pd.DataFrame(dict(info, start_rides=[start_rides], end_rides=[end_rides]))
+
+
+def _rides(station_role, station_id, start_date, end_date):
+    params = statements.Params()
+    query = f"""
+    SELECT COALESCE(SUM(n_trips), 0)::bigint
+    FROM ({rollup.station_counts_query(params, station_role, start_date, end_date, station_id)}
+    ) c
+    """
+    with db.connect() as conn:
+        return statements.execute(conn, "station_rides", query, params).scalar()
+
+
+@memoize(
+    lambda station_id, station_type, date_type, start_date, end_date: (
+        scalar(station_id),
+        role(station_type),
+        date_type,
+        day(start_date),
+        day(end_date),
+    )
+)
+def time_buckets(station_id, station_role, date_type, start_date, end_date):
+    """Trip metrics for a station grouped by a calendar bucket or a clock field.
+
+    Except for hourly buckets, which daily rollups cannot answer, counts and
+    medians are merged from the daily station rollup's ``known`` counts and
+    its sketches, which leave out trips whose other end is not in ``stations``
+    as the exact query's join to ``stations`` does.
+    """
+    station_id_type, reverse_station_id_type = station_columns[station_role]
+    date_type_sql = date_type_conversions[date_type]
+    if date_type in ["Quarter", "Month", "Week"]:
+        date_expression = (
+            f"date_trunc('{date_type_sql}', {trip_columns.sql('start_day')}::timestamp)"
+        )
+        day_expression = f"date_trunc('{date_type_sql}', day::timestamp)"
+    else:
+        date_expression = trip_columns.sql(date_columns[date_type])
+        day_expression = f"extract('{date_type_sql}' from day)"
+
+    if date_type != "Hour" and use_sketches():
+        group_by = (day_expression, date_expression)
+        counts_params, sketch_params = statements.Params(), statements.Params()
+        counts_query = rollup.station_counts_query(
+            counts_params,
+            station_role,
+            start_date,
+            end_date,
+            station_id,
+            group_by,
+            known=True,
+        )
+        sketch_query = rollup.station_sketches_query(
+            sketch_params, station_role, start_date, end_date, station_id, group_by
+        )
+        with db.connect() as conn:
+            counts = statements.read(
+                conn, "time_bucket_counts", counts_query, counts_params, "key"
+            )
+            merged = statements.read(
+                conn, "time_bucket_sketches", sketch_query, sketch_params
+            )
+        data = pd.DataFrame(
+            {
+                "Number of Trips": counts["n_trips"],
+                "Percent Member": counts["n_member"] / counts["n_trips"],
+            }
+        ).join(sketches.medians(merged, discrete=["speed"]))
+        data.index.name = "Date"
+        return data.sort_index().reset_index()
+    params = statements.Params()
+    query = f"""
+                SELECT {date_expression} "Date",
+                COUNT(*) "Number of Trips",
+                AVG({trip_columns.sql("is_member")}) "Percent Member",
+                PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
+                PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
+                PERCENTILE_disc(0.5) WITHIN GROUP(ORDER BY {trip_columns.sql("speed")}) "Median Speed"
+                FROM trips t
+                INNER JOIN stations s on t.{reverse_station_id_type} = s.station_id
+                WHERE t.{station_id_type} = {params(station_id)} and started_at between {params(start_date)} and {params(end_date)}
+                GROUP BY 1
+                ORDER BY 1
+                """
+    with db.connect() as conn:
+        return statements.read(conn, "time_buckets", query, params)
+
+
+def in_flow_cube(start_date, end_date):
+    """Whether ``hourly_flow`` slices the range from the station-hour cube."""
+    flow_cube = cube.current()
+    return flow_cube is not None and flow_cube.covers(
+        flow.hour_number(start_date), flow.hour_number(end_date)
+    )
+
+
+@memoize(
+    lambda station_id, start_date, end_date: (
+        scalar(station_id),
+        day(start_date),
+        day(end_date),
+    )
+)
+def hourly_flow(station_id, start_date, end_date):
+    """``(hourly, by_hour)`` frames of a station's net flow, see
+    ``bluebikes.flow.hourly_flow``.
+
+    Ranges the station-hour cube covers are sliced from it without SQL. The
+    range ends at the instant ``end_date`` starts, so its last hour is empty
+    there; the query below would only add trips starting at that very second.
+    """
+    if in_flow_cube(start_date, end_date):
+        start_hour, end_hour = flow.hour_number(start_date), flow.hour_number(end_date)
+        starts, ends = cube.current().counts(station_id, start_hour, end_hour)
+        return flow.hourly_flow(
+            np.arange(start_hour, end_hour), starts, ends, start_date, end_date
+        )
+    params = statements.Params()
+    query = f"""
+    SELECT hour_number, SUM(is_start) starts, SUM(1 - is_start) ends
+    FROM (
+        SELECT {flow.hour_number_sql} hour_number, 1 is_start
+        FROM trips
+        WHERE start_station_id = {params(station_id)} and started_at between {params(start_date)} and {params(end_date)}
+        UNION ALL
+        SELECT {flow.hour_number_sql}, 0
+        FROM trips
+        WHERE end_station_id = {params(station_id)} and started_at between {params(start_date)} and {params(end_date)}
+    ) t
+    GROUP BY 1
+    """
+    with db.connect() as conn:
+        hours = statements.read(conn, "hourly_flow", query, params)
+    return flow.hourly_flow(
+        hours["hour_number"], hours["starts"], hours["ends"], start_date, end_date
+    )
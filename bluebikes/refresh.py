@@ -0,0 +1,235 @@
+"""
+Background refresh of what the pages derive from trips, so the first request
+after new trips arrive does not pay for it.
+
+A daemon thread in each worker watches the data version, the newest trip
+time and the last load of ``bluebikes.ingest``, every
+``DATA_VERSION_CHECK_SECONDS``. Once at start and whenever the
+version changes, the result cache and the metadata values having been
+dropped by then, it
+
+* refreshes the derived tables of ``columnar.derived_views`` that the
+  database keeps as materialized views, ``CONCURRENTLY`` where a view has a
+  unique index so readers keep the previous rows meanwhile. One worker of all
+  hosts refreshes, under an advisory lock, and records the version in the
+  view's comment; the others wait for it and find the views current. Derived
+  tables that are plain tables are kept current by ``bluebikes.ingest``;
+* reloads every metadata value: the latest trip date, the stations, the
+  Visualizations figures;
+* runs the queries of both pages' default view, and of the station page for
+  the ``WARM_STATIONS`` busiest stations, through the result cache. With the
+  shared cache on, one worker of the host computes them and the others read
+  them from there.
+
+Counters and timings are at ``/stats/refresh``. ``BACKGROUND_REFRESH=0``
+turns the thread off.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from bluebikes import cache, columnar, db, dimension, metadata, queries
+
+logger = logging.getLogger(__name__)
+
+background_refresh = os.getenv("BACKGROUND_REFRESH", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+warm_stations = int(os.getenv("WARM_STATIONS", "10"))
+
+# The default view of the pages (pages/stations.py, pages/station map.py).
+default_station = "MIT at Mass Ave / Amherst St"
+default_start_date = "2023-01-01"
+default_date_type = "Month"
+
+# Key of the advisory lock held while refreshing a view.
+advisory_lock_key = 0x626B7273
+
+views_query = """
+    SELECT c.relname,
+           EXISTS (
+               SELECT FROM pg_index i
+               WHERE i.indrelid = c.oid AND i.indisunique AND i.indpred IS NULL
+           ),
+           obj_description(c.oid, 'pg_class')
+    FROM pg_class c
+    WHERE c.relkind = 'm'
+    AND c.relnamespace = current_schema()::regnamespace
+    AND c.relname = ANY(%(names)s)
+    ORDER BY c.relname"""
+
+
+def _stale_views(conn, version):
+    return [
+        (name, unique)
+        for name, unique, comment in conn.exec_driver_sql(
+            views_query, {"names": list(columnar.derived_views)}
+        ).fetchall()
+        if comment != str(version)
+    ]
+
+
+def refresh_views(version):
+    """Refresh the derived materialized views last refreshed for another data
+    version, each in its own transaction; returns their names."""
+    if db.backend != "postgres":
+        return []
+    engine = db.get_engine()
+    with engine.connect() as conn:
+        stale = _stale_views(conn, version)
+    refreshed = []
+    for name, unique in stale:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "SELECT pg_advisory_xact_lock(%s)", (advisory_lock_key,)
+            )
+            if (name, unique) not in _stale_views(conn, version):
+                continue
+            start = time.perf_counter()
+            concurrently = " CONCURRENTLY" if unique else ""
+            conn.exec_driver_sql(f"REFRESH MATERIALIZED VIEW{concurrently} {name}")
+            conn.exec_driver_sql(
+                f"COMMENT ON MATERIALIZED VIEW {name} IS %s", (str(version),)
+            )
+        refreshed.append(name)
+        logger.info(
+            "refreshed %s%s in %.1fs",
+            name,
+            concurrently.lower(),
+            time.perf_counter() - start,
+        )
+    return refreshed
+
+
+def _default_view_calls(station_id, end_date):
+    dates = (default_start_date, end_date)
+    return [
+        (queries.top_destinations, station_id, "Start", *dates),
+        (queries.station_basics, station_id, *dates),
+        (queries.time_buckets, station_id, "Start", default_date_type, *dates),
+        (queries.hourly_flow, station_id, *dates),
+    ]
+
+
+def warm():
+    """Load the metadata values and run the default view queries; returns the
+    number of queries run."""
+    metadata.service.warm()
+    end_date = metadata.max_ride_date().strftime("%Y-%m-%d")
+    stations = dimension.stations()
+    names = [default_station]
+    for name in metadata.station_names()[:warm_stations]:
+        if name not in names:
+            names.append(name)
+    calls = []
+    for name in names:
+        try:
+            station_id = stations.station_id(name)
+        except KeyError:
+            continue
+        calls.extend(_default_view_calls(station_id, end_date))
+        if name == default_station:
+            # The station map opens on the end stations of the default station.
+            calls.append(
+                (
+                    queries.top_destinations,
+                    station_id,
+                    "End Station",
+                    default_start_date,
+                    end_date,
+                )
+            )
+    # The station map's overview of every station.
+    for station_type in ("Start Station", "End Station"):
+        calls.append(
+            (queries.station_trip_counts, station_type, default_start_date, end_date)
+        )
+    for func, *args in calls:
+        func(*args)
+    return len(calls)
+
+
+class Refresher:
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._version = None
+        self.checks = 0
+        self.refreshes = 0
+        self.views_refreshed = 0
+        self.queries_warmed = 0
+        self.errors = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = None
+        os.register_at_fork(after_in_child=self._forked)
+
+    def run_once(self):
+        """Check the data version; refresh and warm when it changed."""
+        self.checks += 1
+        version = cache.results.data_version()
+        if version is None or version == self._version:
+            return False
+        start = time.perf_counter()
+        self.views_refreshed += len(refresh_views(version))
+        self.queries_warmed += warm()
+        self._version = version
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        self.last_refresh_seconds = time.perf_counter() - start
+        logger.info(
+            "refreshed for data version %s in %.1fs",
+            version,
+            self.last_refresh_seconds,
+        )
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("background refresh failed")
+            time.sleep(cache.data_version_check_seconds)
+
+    def start(self):
+        """Start the refresh thread of this worker, unless it is turned off."""
+        if not background_refresh:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="bluebikes-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def _forked(self):
+        # A worker forked from a preloaded app has no thread of its own yet.
+        started = self._thread is not None
+        self._thread = None
+        self._lock = threading.Lock()
+        if started:
+            self.start()
+
+    def stats(self):
+        return {
+            "enabled": background_refresh,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "data_version": str(self._version) if self._version else None,
+            "checks": self.checks,
+            "refreshes": self.refreshes,
+            "views_refreshed": self.views_refreshed,
+            "queries_warmed": self.queries_warmed,
+            "errors": self.errors,
+            "last_refresh": self.last_refresh,
+            "last_refresh_seconds": self.last_refresh_seconds,
+        }
+
+
+service = Refresher()
+start = service.start
@@ -0,0 +1,474 @@
+"""
+Daily trip rollups and the query router that reads them.
+
+``trip_daily_pairs`` holds trip and member counts per (day, start station, end
+station) and ``trip_daily_stations`` folds that into starts and ends per
+(day, station), with duration, distance and speed sketches of the trips
+starting and ending there (see ``bluebikes.sketches``). The starts and ends
+count every trip of the station, as the ride counts and the station map do;
+the ``known`` counts and the sketches keep only trips whose other end is in
+``stations``, as the time bucket query's join to ``stations`` does. The
+router answers a
+date range from the smallest rollup that has the needed grain for every whole
+day it covers, and only reads raw ``trips`` for the partial days at the edges
+of the range and for days the rollup has not been refreshed for yet.
+
+Rebuild or extend the rollups with::
+
+    python -m bluebikes.rollup            # full rebuild
+    python -m bluebikes.rollup --since 2023-06-01
+"""
+
+import argparse
+import logging
+
+import pandas as pd
+from sqlalchemy import inspect
+
+from bluebikes import db, sketches, trip_columns
+from bluebikes.cache import memoize
+
+logger = logging.getLogger(__name__)
+
+pairs_table = "trip_daily_pairs"
+stations_table = "trip_daily_stations"
+state_table = "rollup_state"
+
+other_role = {"start": "end", "end": "start"}
+
+# (role, metric) of every sketch kept on trip_daily_stations
+station_sketches = [(r, name) for r in ("start", "end") for name in sketches.metrics]
+
+create_statements = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {pairs_table} AS
+    SELECT started_at::date AS day, start_station_id, end_station_id,
+    COUNT(*)::integer AS n_trips,
+    SUM({trip_columns.sql("is_member", stored=False)})::integer AS n_member
+    FROM trips
+    GROUP BY 1, 2, 3
+    WITH NO DATA
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {pairs_table}_start_day
+    ON {pairs_table} (start_station_id, day) INCLUDE (end_station_id, n_trips, n_member)
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {pairs_table}_end_day
+    ON {pairs_table} (end_station_id, day) INCLUDE (start_station_id, n_trips, n_member)
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {stations_table} AS
+    SELECT day, start_station_id AS station_id,
+    n_trips AS n_starts, n_trips AS n_ends,
+    n_member AS n_member_starts, n_member AS n_member_ends
+    FROM {pairs_table}
+    WITH NO DATA
+    """,
+    f"""
+    ALTER TABLE {stations_table}
+    ADD COLUMN IF NOT EXISTS n_known_starts bigint,
+    ADD COLUMN IF NOT EXISTS n_known_ends bigint,
+    ADD COLUMN IF NOT EXISTS n_member_known_starts bigint,
+    ADD COLUMN IF NOT EXISTS n_member_known_ends bigint
+    """,
+    *(
+        f"""
+    ALTER TABLE {stations_table}
+    ADD COLUMN IF NOT EXISTS {r}_{name}_bins smallint[],
+    ADD COLUMN IF NOT EXISTS {r}_{name}_counts integer[]
+    """
+        for r, name in station_sketches
+    ),
+    f"""
+    CREATE INDEX IF NOT EXISTS {stations_table}_day
+    ON {stations_table} (day) INCLUDE (station_id, n_starts, n_ends, n_member_starts, n_member_ends)
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {stations_table}_station_day
+    ON {stations_table} (station_id, day)
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {state_table} (
+        name text PRIMARY KEY,
+        covered_from date,
+        covered_until date,
+        refreshed_at timestamptz NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+
+def refresh(conn, since=None):
+    """Recompute the rollups for every day from ``since`` on (all days if None).
+
+    Only days before the day of the newest trip are rolled up, since that last
+    day may still be receiving trips; the router reads it from ``trips``.
+    Run inside a transaction so readers keep seeing the old rows until commit.
+    """
+    for statement in create_statements:
+        conn.exec_driver_sql(statement)
+
+    first_trip, last_trip = conn.exec_driver_sql(
+        "SELECT MIN(started_at), MAX(started_at) FROM trips"
+    ).one()
+    if last_trip is None:
+        return None
+    until = pd.Timestamp(last_trip).normalize()
+
+    covered = conn.exec_driver_sql(
+        f"SELECT covered_from, covered_until FROM {state_table} WHERE name = '{pairs_table}'"
+    ).first()
+    # Days rolled up before the sketch or known columns existed need a full
+    # rebuild.
+    missing_sketches = conn.exec_driver_sql(
+        f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {stations_table}
+            WHERE start_duration_counts IS NULL OR n_known_starts IS NULL
+        )"""
+    ).scalar()
+    if since is None or covered is None or covered[0] is None or missing_sketches:
+        since = pd.Timestamp(first_trip).normalize()
+        covered_from = since
+    else:
+        # Never leave a gap between what is already rolled up and the new days.
+        since = min(pd.Timestamp(since).normalize(), pd.Timestamp(covered[1]))
+        covered_from = min(pd.Timestamp(covered[0]), since)
+
+    since_sql, until_sql = since.strftime("%Y-%m-%d"), until.strftime("%Y-%m-%d")
+    stored = trip_columns.stored_columns and trip_columns.has_columns(conn)
+    conn.exec_driver_sql(f"DELETE FROM {pairs_table} WHERE day >= '{since_sql}'")
+    conn.exec_driver_sql(f"DELETE FROM {stations_table} WHERE day >= '{since_sql}'")
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {pairs_table}
+        SELECT {trip_columns.sql("start_day", stored)}, start_station_id, end_station_id,
+        COUNT(*), SUM({trip_columns.sql("is_member", stored)})
+        FROM trips
+        WHERE started_at >= '{since_sql}' AND started_at < '{until_sql}'
+        GROUP BY 1, 2, 3
+        """
+    )
+    conn.exec_driver_sql(_insert_stations_statement(since_sql, until_sql, stored))
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {state_table} (name, covered_from, covered_until)
+        VALUES ('{pairs_table}', '{covered_from:%Y-%m-%d}', '{until_sql}')
+        ON CONFLICT (name) DO UPDATE
+        SET covered_from = EXCLUDED.covered_from,
+        covered_until = EXCLUDED.covered_until,
+        refreshed_at = now()
+        """
+    )
+    logger.info("rolled up trips from %s to %s", since_sql, until_sql)
+    return covered_from, until
+
+
+def _metric_sql(name, expression, stored=None):
+    # Sketched metrics stored as trip columns are read from them.
+    if name in trip_columns.columns:
+        return trip_columns.sql(name, stored)
+    return expression
+
+
+def _insert_stations_statement(since_sql, until_sql, stored=None):
+    binned = ",\n            ".join(
+        f"{sketches.bin_sql(_metric_sql(name, expression, stored))} AS {name}_bin"
+        for name, (expression, _) in sketches.metrics.items()
+    )
+    sketch_ctes = "".join(
+        f""",
+
+        {r}_{name} AS (
+            SELECT day, station_id,
+            array_agg(bin ORDER BY bin) AS bins,
+            array_agg(n ORDER BY bin) AS counts
+            FROM (
+                SELECT day, {r}_station_id AS station_id, {name}_bin AS bin, COUNT(*)::integer AS n
+                FROM binned
+                WHERE {r}_station_id IS NOT NULL AND {other_role[r]}_known
+                AND {name}_bin IS NOT NULL
+                GROUP BY 1, 2, 3
+            ) b
+            GROUP BY 1, 2
+        )"""
+        for r, name in station_sketches
+    )
+    sketch_columns = ", ".join(
+        f"{r}_{name}_bins, {r}_{name}_counts" for r, name in station_sketches
+    )
+    sketch_values = ",\n        ".join(
+        f"COALESCE({r}_{name}.bins, '{{}}'), COALESCE({r}_{name}.counts, '{{}}')"
+        for r, name in station_sketches
+    )
+    sketch_joins = "".join(
+        f"\n        LEFT JOIN {r}_{name} USING (day, station_id)"
+        for r, name in station_sketches
+    )
+    return f"""
+        INSERT INTO {stations_table}
+        (day, station_id, n_starts, n_ends, n_member_starts, n_member_ends,
+        n_known_starts, n_known_ends, n_member_known_starts, n_member_known_ends,
+        {sketch_columns})
+        WITH pairs AS (
+            SELECT p.*,
+            s.station_id IS NOT NULL AS start_known, e.station_id IS NOT NULL AS end_known
+            FROM {pairs_table} p
+            LEFT JOIN stations s ON s.station_id = p.start_station_id
+            LEFT JOIN stations e ON e.station_id = p.end_station_id
+            WHERE p.day >= '{since_sql}'
+        ),
+
+        counts AS (
+            SELECT day, station_id, SUM(n_starts) AS n_starts, SUM(n_ends) AS n_ends,
+            SUM(n_member_starts) AS n_member_starts, SUM(n_member_ends) AS n_member_ends,
+            SUM(n_starts) FILTER (WHERE known) AS n_known_starts,
+            SUM(n_ends) FILTER (WHERE known) AS n_known_ends,
+            SUM(n_member_starts) FILTER (WHERE known) AS n_member_known_starts,
+            SUM(n_member_ends) FILTER (WHERE known) AS n_member_known_ends
+            FROM (
+                SELECT day, start_station_id AS station_id, n_trips AS n_starts, 0 AS n_ends,
+                n_member AS n_member_starts, 0 AS n_member_ends, end_known AS known
+                FROM pairs
+                WHERE start_station_id IS NOT NULL
+                UNION ALL
+                SELECT day, end_station_id, 0, n_trips, 0, n_member, start_known
+                FROM pairs
+                WHERE end_station_id IS NOT NULL
+            ) u
+            GROUP BY 1, 2
+        ),
+
+        binned AS (
+            SELECT {trip_columns.sql("start_day", stored)} AS day, start_station_id, end_station_id,
+            s.station_id IS NOT NULL AS start_known, e.station_id IS NOT NULL AS end_known,
+            {binned}
+            FROM trips
+            LEFT JOIN stations s ON s.station_id = trips.start_station_id
+            LEFT JOIN stations e ON e.station_id = trips.end_station_id
+            WHERE started_at >= '{since_sql}' AND started_at < '{until_sql}'
+        ){sketch_ctes}
+
+        SELECT counts.day, counts.station_id, counts.n_starts, counts.n_ends,
+        counts.n_member_starts, counts.n_member_ends,
+        COALESCE(counts.n_known_starts, 0), COALESCE(counts.n_known_ends, 0),
+        COALESCE(counts.n_member_known_starts, 0), COALESCE(counts.n_member_known_ends, 0),
+        {sketch_values}
+        FROM counts{sketch_joins}
+        """
+
+
+def rebuild(conn):
+    """Roll up every day again where the rollups exist."""
+    if inspect(conn).has_table(state_table):
+        refresh(conn)
+
+
+@memoize(lambda: ())
+def coverage():
+    """``(first_day, end_day)`` of whole days held by the rollups, or None.
+
+    The columnar backend keeps no rollups; it scans trips directly.
+    """
+    if db.backend != "postgres":
+        return None
+    with db.connect() as conn:
+        if not inspect(conn).has_table(state_table):
+            return None
+        row = conn.exec_driver_sql(
+            f"SELECT covered_from, covered_until FROM {state_table} WHERE name = '{pairs_table}'"
+        ).first()
+    if row is None or row[0] is None:
+        return None
+    return pd.Timestamp(row[0]), pd.Timestamp(row[1])
+
+
+def split_range(start_date, end_date):
+    """Split the inclusive range ``[start_date, end_date]`` for the router.
+
+    Returns ``(full_days, edges)``: ``full_days`` is a ``(first, end)`` pair of
+    days answerable from the rollups (or None), and ``edges`` lists the
+    ``(low, high, high_inclusive)`` pieces that must be read from ``trips``.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    covered = coverage()
+    first, last = start.ceil("D"), end.floor("D")
+    if covered is not None:
+        first, last = max(first, covered[0]), min(last, covered[1])
+    if covered is None or first >= last:
+        return None, [(start, end, True)]
+    edges = []
+    if start < first:
+        edges.append((start, first, False))
+    edges.append((last, end, True))
+    return (first, last), edges
+
+
+def _time_filter(params, column, low, high, high_inclusive):
+    operator = "<=" if high_inclusive else "<"
+    return (
+        f"{column} >= {params(f'{low:%Y-%m-%d %H:%M:%S}')}"
+        f" AND {column} {operator} {params(f'{high:%Y-%m-%d %H:%M:%S}')}"
+    )
+
+
+def _station_parts(
+    params, station_role, start_date, end_date, station_id, group_by, known
+):
+    column = f"{station_role}_station_id"
+    if group_by is None:
+        group_by = ("station_id", column)
+    full_days, edges = split_range(start_date, end_date)
+    rollup_filter = None
+    if full_days is not None:
+        rollup_filter = _time_filter(params, "day", *full_days, False)
+        if station_id is not None:
+            rollup_filter += f" AND station_id = {params(station_id)}"
+    trips_filters = []
+    for edge in edges:
+        trips_filter = (
+            f"{_time_filter(params, 'started_at', *edge)} AND {column} IS NOT NULL"
+        )
+        if known:
+            trips_filter += (
+                f" AND {other_role[station_role]}_station_id"
+                " IN (SELECT station_id FROM stations)"
+            )
+        if station_id is not None:
+            trips_filter += f" AND {column} = {params(station_id)}"
+        trips_filters.append(trips_filter)
+    return group_by, rollup_filter, trips_filters
+
+
+def station_counts_query(
+    params,
+    station_role,
+    start_date,
+    end_date,
+    station_id=None,
+    group_by=None,
+    known=False,
+):
+    """SQL for ``key, n_trips, n_member`` of trips starting (or ending) at each
+    station within the range, optionally for a single station, and with
+    ``known`` only those whose other end is in ``stations``.
+
+    ``key`` is the station id unless ``group_by`` gives a ``(rollup expression,
+    trips expression)`` pair to group on instead, such as a ``date_trunc`` of
+    ``day`` and of ``started_at``. Keys without trips are left out, as a
+    ``GROUP BY`` over ``trips`` would. Values are added to ``params`` (see
+    ``bluebikes.statements``).
+    """
+    group_by, rollup_filter, trips_filters = _station_parts(
+        params, station_role, start_date, end_date, station_id, group_by, known
+    )
+    counted = f"known_{station_role}s" if known else f"{station_role}s"
+    parts = []
+    if rollup_filter is not None:
+        parts.append(
+            f"""
+            SELECT {group_by[0]} AS key, n_{counted} AS n_trips, n_member_{counted} AS n_member
+            FROM {stations_table}
+            WHERE {rollup_filter}"""
+        )
+    for trips_filter in trips_filters:
+        parts.append(
+            f"""
+            SELECT {group_by[1]} AS key, COUNT(*) AS n_trips, SUM({trip_columns.sql("is_member")}) AS n_member
+            FROM trips
+            WHERE {trips_filter}
+            GROUP BY 1"""
+        )
+    union = "\n            UNION ALL".join(parts)
+    return f"""
+        SELECT key, SUM(n_trips)::bigint AS n_trips, SUM(n_member)::bigint AS n_member
+        FROM ({union}
+        ) routed
+        GROUP BY key
+        HAVING SUM(n_trips) > 0"""
+
+
+def station_sketches_query(
+    params, station_role, start_date, end_date, station_id=None, group_by=None
+):
+    """SQL for the merged ``key, metric, bin, n`` sketch rows of the trips
+    ``station_counts_query`` counts with ``known``; ``bluebikes.sketches.medians``
+    reads them."""
+    group_by, rollup_filter, trips_filters = _station_parts(
+        params, station_role, start_date, end_date, station_id, group_by, True
+    )
+    parts = []
+    for name, (expression, _) in sketches.metrics.items():
+        if rollup_filter is not None:
+            parts.append(
+                f"""
+            SELECT {group_by[0]} AS key, '{name}' AS metric, u.bin, u.n
+            FROM {stations_table},
+            unnest({station_role}_{name}_bins, {station_role}_{name}_counts) AS u(bin, n)
+            WHERE {rollup_filter}"""
+            )
+        expression = _metric_sql(name, expression)
+        for trips_filter in trips_filters:
+            parts.append(
+                f"""
+            SELECT {group_by[1]} AS key, '{name}' AS metric, {sketches.bin_sql(expression)} AS bin, COUNT(*) AS n
+            FROM trips
+            WHERE {trips_filter} AND ({expression}) IS NOT NULL
+            GROUP BY 1, 2, 3"""
+            )
+    union = "\n            UNION ALL".join(parts)
+    return f"""
+        SELECT key, metric, bin, SUM(n)::bigint AS n
+        FROM ({union}
+        ) routed
+        GROUP BY 1, 2, 3"""
+
+
+def pair_counts_query(params, station_role, station_id, start_date, end_date):
+    """SQL for ``key, n_trips, n_member``, keyed by the station at the other end,
+    of every trip starting (or ending) at ``station_id`` within the range."""
+    column = f"{station_role}_station_id"
+    other_column = f"{other_role[station_role]}_station_id"
+    full_days, edges = split_range(start_date, end_date)
+
+    parts = []
+    if full_days is not None:
+        parts.append(
+            f"""
+            SELECT {other_column} AS key, n_trips, n_member
+            FROM {pairs_table}
+            WHERE {column} = {params(station_id)} AND {_time_filter(params, "day", *full_days, False)}"""
+        )
+    for edge in edges:
+        parts.append(
+            f"""
+            SELECT {other_column} AS key, COUNT(*) AS n_trips, SUM({trip_columns.sql("is_member")}) AS n_member
+            FROM trips
+            WHERE {column} = {params(station_id)} AND {_time_filter(params, "started_at", *edge)}
+            GROUP BY 1"""
+        )
+    union = "\n            UNION ALL".join(parts)
+    return f"""
+        SELECT key, SUM(n_trips)::bigint AS n_trips, SUM(n_member)::bigint AS n_member
+        FROM ({union}
+        ) routed
+        GROUP BY key"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--since",
+        help="only recompute days on or after this date (YYYY-MM-DD); default is a full rebuild",
+    )
+    args = parser.parse_args()
+    if db.backend != "postgres":
+        parser.error("rollups are only kept in Postgres")
+    logging.basicConfig(level=logging.INFO)
+    with db.get_engine().begin() as conn:
+        refresh(conn, since=args.since)
+
+
+if __name__ == "__main__":
+    main()
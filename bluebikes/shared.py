@@ -0,0 +1,267 @@
+"""
+Cache shared by every worker on a host, in an SQLite file.
+
+Gunicorn workers are separate processes, so the result cache and the
+metadata values are otherwise computed and held once per worker. This tier
+sits behind both: what one worker computes is pickled into
+``SHARED_CACHE_PATH``, where the other workers, and the workers that replace
+them after a restart, read it instead of querying again. ``compute`` holds a
+lock file of the key while it computes, so concurrent misses in several
+workers run the query once; ``coalesced`` counts the misses answered by
+another worker's computation they waited for. Memoized queries call one
+another, so each key has a lock of its own: locks shared between keys would
+let a nested call wait for a lock its caller holds. The lock file is deleted
+when the computation ends, so the files do not pile up with the keys.
+
+Entries carry the data version they were computed for and are only read back
+for that version. Versions are ordered by when the file first saw them, so a
+worker that has not noticed new data yet does not delete entries of the newer
+version; entries of versions older than the writer's, and the oldest entries
+beyond ``SHARED_CACHE_MAX_MB``, are deleted as new ones are written. Any error
+of the file is logged and treated as a miss, so the pages keep working
+without it.
+An empty ``SHARED_CACHE_PATH`` turns the tier off.
+
+Loading a pickle runs code, so the file must be one only this user can
+write: its directory is created for this user alone, and a directory or file
+of another user fails like any other error of the file.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+shared_cache_path = os.getenv("SHARED_CACHE_PATH", os.path.join("data", "cache.sqlite"))
+shared_cache_max_bytes = int(
+    float(os.getenv("SHARED_CACHE_MAX_MB", "512")) * 1024 * 1024
+)
+
+# Versions remembered in order of first sight.
+keep_versions = 100
+
+schema = [
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        created REAL NOT NULL,
+        size INTEGER NOT NULL,
+        value BLOB NOT NULL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS versions (
+        version TEXT PRIMARY KEY,
+        seen REAL NOT NULL
+    )""",
+]
+
+
+def private_path(path):
+    """Create the directory of ``path`` for this user alone if missing and
+    return ``path``; raises ``PermissionError`` when the directory or the file
+    belongs to another user."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    for name in (directory, path):
+        try:
+            owner = os.stat(name).st_uid
+        except FileNotFoundError:
+            continue
+        if owner != os.getuid():
+            raise PermissionError(f"{name} belongs to user {owner}")
+    return path
+
+
+class SharedCache:
+    def __init__(self, path=shared_cache_path, max_bytes=shared_cache_max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                private_path(self.path), timeout=10, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in schema:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _failed(self, action, key):
+        self._count("errors")
+        logger.exception("shared cache %s of %s failed", action, key)
+
+    def get(self, key, version, max_age=None):
+        """Return ``(True, value)`` for an entry of ``version`` no older than
+        ``max_age`` seconds, else ``(False, None)``."""
+        if not self.enabled:
+            return False, None
+        try:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT created, value FROM entries WHERE key = ? AND version = ?",
+                    (key, str(version)),
+                )
+                .fetchone()
+            )
+            if row is not None and (max_age is None or time.time() - row[0] <= max_age):
+                value = pickle.loads(row[1])
+                self._count("hits")
+                return True, value
+        except Exception:
+            self._failed("read", key)
+        self._count("misses")
+        return False, None
+
+    def set(self, key, version, value):
+        if not self.enabled:
+            return
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(blob) > self.max_bytes:
+                return
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                self._evict_versions(conn, str(version))
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, str(version), time.time(), len(blob), blob),
+                )
+                self._evict(conn)
+            self._count("writes")
+        except Exception:
+            self._failed("write", key)
+
+    def _evict_versions(self, conn, version):
+        conn.execute(
+            "INSERT OR IGNORE INTO versions VALUES (?, ?)", (version, time.time())
+        )
+        conn.execute(
+            """
+            DELETE FROM entries WHERE version IN (
+                SELECT version FROM versions
+                WHERE seen < (SELECT seen FROM versions WHERE version = ?)
+            )""",
+            (version,),
+        )
+        conn.execute(
+            """
+            DELETE FROM versions WHERE version NOT IN (
+                SELECT version FROM versions ORDER BY seen DESC LIMIT ?
+            )""",
+            (keep_versions,),
+        )
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY created"
+        ).fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _key_lock(self, key):
+        """The locked lock file of ``key``. A waiter may get the lock of a file
+        its holder has deleted meanwhile; it then opens the new one."""
+        path = os.path.join(
+            self.path + ".locks", hashlib.sha1(key.encode()).hexdigest()
+        )
+        while True:
+            lock_file = open(private_path(path), "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                return lock_file
+            lock_file.close()
+
+    def _unlock(self, lock_file):
+        # Deleted while still locked, so no one locks the file it replaces.
+        try:
+            os.unlink(lock_file.name)
+        except OSError:
+            pass
+        lock_file.close()
+
+    def compute(self, key, version, func, max_age=None):
+        """The shared value of ``key`` for ``version``, computed by ``func()``
+        in one worker of the host while the others wait for it."""
+        found, value = self.get(key, version, max_age)
+        if found:
+            return value
+        if not self.enabled:
+            return func()
+        try:
+            lock_file = self._key_lock(key)
+        except OSError:
+            self._failed("lock", key)
+            return func()
+        try:
+            found, value = self.get(key, version, max_age)
+            if found:
+                self._count("coalesced")
+                return value
+            value = func()
+            self.set(key, version, value)
+            return value
+        finally:
+            self._unlock(lock_file)
+
+    def stats(self):
+        stats = {
+            "path": self.path or None,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+        if self.enabled:
+            try:
+                entries, size = (
+                    self._connection()
+                    .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+                    .fetchone()
+                )
+                stats.update(entries=entries, bytes=size)
+            except Exception:
+                self._failed("stats", "entries")
+        return stats
+
+
+store = SharedCache()
@@ -0,0 +1,64 @@
+"""
+Single-flight execution of identical concurrent calls.
+
+Clicking a station on the map fires ``plot_station`` and, through the
+dropdown it rewrites, the station callbacks again with the same arguments,
+and users opening the default page at once all ask for the same queries. A
+``Group`` runs one call per key at a time: the first caller executes it and
+callers arriving while it runs wait for it and get the same result, or the
+same exception. Across the workers of a host, ``bluebikes.shared`` does the
+same with a lock file per key.
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Return ``(value, shared)``: ``func()`` run by this thread, or the
+        result of the call already running for ``key``, with ``shared`` True.
+        Callers getting a shared result must not modify it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
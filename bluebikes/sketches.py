@@ -0,0 +1,133 @@
+"""
+Mergeable log-histogram sketches for median duration, distance and speed.
+
+Each value ``x`` is counted in bin ``ceil(log(x) / log(gamma))`` with
+``gamma = (1 + a) / (1 - a)``, the scheme used by DDSketch. Bins of different
+days or stations merge by adding their counts, and the quantile read back from
+a merged sketch is within a relative error of ``a`` (``SKETCH_RELATIVE_ACCURACY``,
+1% by default) of a trip value at the requested rank. Values at or below
+``min_value`` (zero-distance round trips, for example) share one bin that
+reads back as 0, so for them the error is absolute and at most ``min_value``.
+
+The rollup stores one sketch per role and metric as parallel
+``*_bins``/``*_counts`` arrays on every ``trip_daily_stations`` row. Set ``EXACT_MEDIANS=1`` to ignore
+them and compute medians with ``PERCENTILE_CONT`` over ``trips`` instead.
+"""
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+relative_accuracy = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+exact_medians = os.getenv("EXACT_MEDIANS", "").lower() in ("1", "true", "yes")
+
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = math.log(gamma)
+min_value = 1e-3
+zero_bin = -32768
+max_bin = 32767
+
+# sketch name -> (SQL expression over trips, label used by the pages)
+metrics = {
+    "duration": ("duration", "Median Duration"),
+    "distance": ("distance", "Median Distance"),
+    "speed": ("60*distance/NULLIF(duration, 0)", "Median Speed"),
+}
+
+
+def bin_sql(expression):
+    """SQL computing the bin index of ``expression`` (NULL stays NULL)."""
+    return (
+        f"CASE WHEN ({expression}) IS NULL THEN NULL "
+        f"WHEN ({expression}) > {min_value} "
+        f"THEN LEAST(CEIL(LN({expression}) / {log_gamma!r}), {max_bin})::smallint "
+        f"ELSE ({zero_bin})::smallint END"
+    )
+
+
+def bin_values(values):
+    """NumPy counterpart of ``bin_sql``; drop missing values before calling."""
+    values = np.asarray(values, dtype="float64")
+    bins = np.full(values.shape, zero_bin, dtype="int16")
+    positive = values > min_value
+    bins[positive] = np.minimum(np.ceil(np.log(values[positive]) / log_gamma), max_bin)
+    return bins
+
+
+def bin_value(bins):
+    """Value a bin reads back as: the point within ``relative_accuracy`` of
+    every value the bin can hold."""
+    bins = np.asarray(bins, dtype="float64")
+    return np.where(bins == zero_bin, 0.0, 2 * gamma**bins / (gamma + 1))
+
+
+def _value_at_rank(sorted_bins, cumulative, rank):
+    return bin_value(sorted_bins[np.searchsorted(cumulative, rank, side="right")])
+
+
+def quantile(bins, counts, q=0.5, discrete=False):
+    """Quantile of the merged sketch given by bin indexes and their counts.
+
+    Like ``PERCENTILE_CONT`` this interpolates between the two values around
+    the requested position, or like ``PERCENTILE_DISC`` with ``discrete``.
+    """
+    bins = np.asarray(bins)
+    counts = np.asarray(counts, dtype="int64")
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    order = np.argsort(bins, kind="stable")
+    sorted_bins, cumulative = bins[order], np.cumsum(counts[order])
+    if discrete:
+        return float(_value_at_rank(sorted_bins, cumulative, math.ceil(q * total) - 1))
+    position = q * (total - 1)
+    low, high = math.floor(position), math.ceil(position)
+    low_value = _value_at_rank(sorted_bins, cumulative, low)
+    high_value = _value_at_rank(sorted_bins, cumulative, high)
+    return float(low_value + (position - low) * (high_value - low_value))
+
+
+def medians(merged, discrete=()):
+    """Turn ``key, metric, bin, n`` rows into one row per key with the pages'
+    "Median ..." columns; metrics named in ``discrete`` read like
+    ``PERCENTILE_DISC``.
+
+    This is ``quantile(q=0.5)`` for every ``(key, metric)`` group at once.
+    """
+    columns = [label for _, label in metrics.values()]
+    if merged.empty:
+        return pd.DataFrame(columns=columns)
+    keys = ["key", "metric"]
+    merged = merged.sort_values(keys + ["bin"], kind="stable").reset_index(drop=True)
+    counts = merged.groupby(keys, sort=False)["n"]
+    cumulative = counts.cumsum()
+    before = cumulative - merged["n"]
+    total = counts.transform("sum")
+    position = np.where(
+        merged["metric"].isin(list(discrete)),
+        np.ceil(0.5 * total) - 1,
+        0.5 * (total - 1),
+    )
+    low_rank, high_rank = np.floor(position), np.ceil(position)
+    value = bin_value(merged["bin"])
+    # Exactly one row of each group holds a given rank.
+    merged["low"] = np.where(
+        (before <= low_rank) & (low_rank < cumulative), value, np.nan
+    )
+    merged["high"] = np.where(
+        (before <= high_rank) & (high_rank < cumulative), value, np.nan
+    )
+    merged["fraction"] = position - low_rank
+    picked = merged.groupby(keys).agg(
+        low=("low", "max"), high=("high", "max"), fraction=("fraction", "first")
+    )
+    result = (
+        picked["low"] + picked["fraction"] * (picked["high"] - picked["low"])
+    ).unstack("metric")
+    result = result.reindex(columns=list(metrics)).rename(
+        columns={name: label for name, (_, label) in metrics.items()}
+    )
+    result.columns.name = None
+    return result
@@ -0,0 +1,119 @@
+"""
+Named, parameterized SQL for the station queries.
+
+Query builders never format station ids or dates into SQL text. They take a
+``Params`` collector, which records each value and returns its ``$n``
+placeholder, so a value cannot change the statement or break its quoting.
+Identifiers such as ``start_station_id`` come only from the fixed role and
+date bucket tables of the builders. A statement name therefore has a small,
+fixed set of variants, one per distinct text.
+
+On Postgres each variant is ``PREPARE``d once per pooled connection and run
+with ``EXECUTE`` afterwards, so repeated clicks reuse the parsed statement and
+Postgres can settle on a cached plan. DuckDB cannot ``EXECUTE`` with bound
+parameters, so on the columnar backend the text and values go to its own
+per-call prepare. Per-name counts are at ``/stats/statements``.
+"""
+
+import re
+import threading
+import time
+
+import pandas as pd
+
+from bluebikes import db, metrics
+from bluebikes.cache import scalar
+
+_lock = threading.Lock()
+_variants = {}
+_stats = {}
+
+
+class Params:
+    """Collects the values of a statement in placeholder order."""
+
+    def __init__(self):
+        self.values = []
+
+    def __call__(self, value):
+        self.values.append(scalar(value))
+        return f"${len(self.values)}"
+
+
+def _prepared_name(name, sql):
+    with _lock:
+        variants = _variants.setdefault(name, {})
+        if sql not in variants:
+            base = re.sub(r"\W", "_", name)[:50]
+            variants[sql] = f"{base}_{len(variants) + 1}"
+        return variants[sql]
+
+
+def _record(name, seconds, prepared):
+    with _lock:
+        stats = _stats.setdefault(
+            name,
+            {"executions": 0, "prepares": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+        )
+        stats["executions"] += 1
+        stats["prepares"] += prepared
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+def execute(conn, name, sql, params=None):
+    """Run ``sql`` as the statement ``name`` with the values in ``params``."""
+    values = tuple(params.values) if params is not None else ()
+    prepared_name = _prepared_name(name, sql)
+    start = time.perf_counter()
+    token = metrics.statement_name.set(name)
+    try:
+        result, prepared = _execute(conn, prepared_name, sql, values)
+    finally:
+        metrics.statement_name.reset(token)
+    _record(name, time.perf_counter() - start, prepared)
+    return result
+
+
+def _execute(conn, prepared_name, sql, values):
+    if db.backend != "postgres":
+        return conn.exec_driver_sql(sql, values), False
+    # conn.info lives as long as the pooled DBAPI connection, as do its
+    # prepared statements; it is emptied when the connection is replaced.
+    known = conn.info.setdefault("prepared_statements", set())
+    prepared = prepared_name not in known
+    if prepared:
+        conn.exec_driver_sql(f"PREPARE {prepared_name} AS {sql}")
+        known.add(prepared_name)
+    if values:
+        placeholders = ", ".join(["%s"] * len(values))
+        result = conn.exec_driver_sql(
+            f"EXECUTE {prepared_name}({placeholders})", values
+        )
+    else:
+        result = conn.exec_driver_sql(f"EXECUTE {prepared_name}")
+    return result, prepared
+
+
+def read(conn, name, sql, params=None, index_col=None):
+    """``execute`` into a DataFrame, as ``pd.read_sql`` would build it."""
+    result = execute(conn, name, sql, params)
+    frame = pd.DataFrame.from_records(
+        result.fetchall(), columns=list(result.keys()), coerce_float=True
+    )
+    if index_col is not None:
+        frame = frame.set_index(index_col)
+    return frame
+
+
+def stats():
+    """Executions, prepares, variants and timings per statement name."""
+    with _lock:
+        return {
+            name: dict(
+                s,
+                variants=len(_variants.get(name, ())),
+                mean_seconds=s["total_seconds"] / s["executions"],
+            )
+            for name, s in _stats.items()
+        }
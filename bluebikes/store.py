@@ -0,0 +1,117 @@
+"""
+Server-side store for frames that one callback computes and another plots.
+
+Instead of sending a result to the browser as JSON in a ``dcc.Store`` and
+parsing it again on every redraw, the producing callback puts the frame here
+and the browser holds only its key. Frames are kept as one NumPy array per
+column in a size-bounded LRU with a TTL, so reading one back rebuilds a
+DataFrame without parsing.
+
+A key names a registered loader and the arguments it was called with. A
+worker that has never seen the key, or has evicted it, runs the loader again
+(usually a hit in the result cache) instead of failing. The store is dropped
+along with the result cache when the data version changes.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from bluebikes import cache
+
+store_max_bytes = int(float(os.getenv("RESULT_STORE_MAX_MB", "64")) * 1024 * 1024)
+store_ttl_seconds = float(os.getenv("RESULT_STORE_TTL_SECONDS", "3600"))
+
+
+def _columns(frame):
+    return [(name, frame[name].to_numpy(copy=True)) for name in frame.columns]
+
+
+def _nbytes(columns):
+    size = 0
+    for _, values in columns:
+        size += values.nbytes
+        if values.dtype == object:
+            size += sum(len(str(v)) for v in values)
+    return size
+
+
+class FrameStore:
+    def __init__(self, max_bytes=store_max_bytes, ttl=store_ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._loaders = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def loader(self, name, func):
+        """Register ``func`` as the loader of the frames stored under ``name``."""
+        self._loaders[name] = func
+
+    def put(self, name, args, frame):
+        """Store ``frame``, the result of the ``name`` loader for ``args``,
+        which must be JSON serializable; returns its key."""
+        key = json.dumps([name, *map(cache.scalar, args)], separators=(",", ":"))
+        columns = _columns(frame)
+        size = _nbytes(columns)
+        if size > self.max_bytes:
+            return key
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (columns, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return key
+
+    def get(self, key):
+        """The frame stored under ``key``, reloaded if this worker lacks it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # Columns are copied, so callbacks may modify what they get.
+                return pd.DataFrame({name: values.copy() for name, values in entry[0]})
+            self.misses += 1
+        name, *args = json.loads(key)
+        if name not in self._loaders:
+            raise KeyError(f"no frame loader {name!r}")
+        frame = self._loaders[name](*args)
+        self.put(name, args, frame)
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+frames = FrameStore()
+cache.results.on_new_data(frames.clear)
@@ -0,0 +1,115 @@
+"""
+Derived trip values stored as columns of ``trips``.
+
+The station queries used to compute speed, the member flag and calendar keys
+from the raw columns for every row they read. The migration below stores them
+as generated columns, which Postgres computes once when a trip is written:
+
+* ``speed`` (``real``, miles per hour; NULL for zero durations),
+* ``is_member`` (``smallint``, 1 for members and 0 for casual riders),
+* ``start_hour`` and ``start_isodow`` (``smallint``), and ``start_day``
+  (``date``) of ``started_at``.
+
+They are the first of ``bluebikes.migrations``; adding them rewrites ``trips``
+once under an exclusive lock. To add them alone::
+
+    python -m bluebikes.trip_columns
+
+Trips loaded later, by ``bluebikes.ingest`` or ``benchmarks.synthetic``, get
+them without any change to the loaders, and ``bluebikes.columnar`` exports
+them with the other columns. ``sql(name)`` gives the stored column where
+``trips`` has it and the expression otherwise, so queries run before the
+migration too. Set ``STORED_TRIP_COLUMNS=0`` to always use the expressions.
+"""
+
+import argparse
+import logging
+import os
+
+from bluebikes import db
+from bluebikes.cache import memoize
+
+logger = logging.getLogger(__name__)
+
+stored_columns = os.getenv("STORED_TRIP_COLUMNS", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+
+# name -> (type, expression over the raw trip columns)
+columns = {
+    "speed": ("real", "60 * distance / NULLIF(duration, 0)"),
+    "is_member": (
+        "smallint",
+        "CASE WHEN member_casual = 'member' THEN 1 ELSE 0 END",
+    ),
+    "start_hour": ("smallint", "extract('hour' from started_at)"),
+    "start_isodow": ("smallint", "extract('isodow' from started_at)"),
+    "start_day": ("date", "started_at::date"),
+}
+
+
+def has_columns(conn):
+    """Whether ``trips`` on ``conn`` holds every derived column."""
+    names = conn.exec_driver_sql("SELECT * FROM trips WHERE false").keys()
+    return set(columns) <= set(names)
+
+
+@memoize(lambda: ())
+def available():
+    with db.connect() as conn:
+        return has_columns(conn)
+
+
+def sql(name, stored=None):
+    """SQL for the derived value ``name``: its column when ``stored`` (by
+    default, when ``trips`` has the columns), else its expression."""
+    if stored is None:
+        stored = stored_columns and available()
+    if stored:
+        return name
+    column_type, expression = columns[name]
+    if column_type == "smallint":
+        return f"({expression})::smallint"
+    return f"({expression})"
+
+
+def migrate(conn):
+    """Add the missing derived columns to ``trips``, filling them for every
+    row, and refresh the planner statistics."""
+    existing = set(conn.exec_driver_sql("SELECT * FROM trips WHERE false").keys())
+    missing = [name for name in columns if name not in existing]
+    if not missing:
+        logger.info("trips already has the derived columns")
+        return []
+    additions = ",\n".join(
+        f"ADD COLUMN {name} {columns[name][0]} "
+        f"GENERATED ALWAYS AS (({columns[name][1]})::{columns[name][0]}) STORED"
+        for name in missing
+    )
+    conn.exec_driver_sql(f"ALTER TABLE trips\n{additions}")
+    conn.exec_driver_sql("ANALYZE trips")
+    logger.info(
+        "added %s to trips, now %s",
+        ", ".join(missing),
+        conn.exec_driver_sql(
+            "SELECT pg_size_pretty(SUM(pg_table_size(relid)))"
+            " FROM pg_partition_tree('trips')"
+        ).scalar(),
+    )
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.parse_args()
+    if db.backend != "postgres":
+        parser.error("the derived columns are added in Postgres and exported")
+    logging.basicConfig(level=logging.INFO)
+    with db.get_engine().begin() as conn:
+        migrate(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 from dash import Dash, dash_table, Input, Output, dcc, html, ctx
 import dash_bootstrap_components as dbc
 import pandas as pd
-from sqlalchemy import create_engine
 import dash
 import plotly.express as px
 import os
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-database_url = os.getenv("database_url_bbb")
+from bluebikes import db, executor, figures, metadata
+
 mapboxtoken = os.getenv("mapboxtoken")
 
 dash.register_page(
@@ -58,6 +58,7 @@ district_string = (
 
 
 def serve_layout_visualizations():
+    figs = visualization_figures()
     return dbc.Container(
         [
             html.H1("Boston Blue Bike Visualizations"),
@@ -66,7 +67,8 @@ def serve_layout_visualizations():
             dbc.Row(
                 [
                     dbc.Col(
-                        dcc.Graph(id="n-trips-graph", figure=fig_n_trips), width=10
+                        dcc.Graph(id="n-trips-graph", figure=figs["n_trips"]),
+                        width=10,
                     ),
                     dbc.Col(html.P(n_trips_string)),
                 ]
@@ -76,7 +78,8 @@ def serve_layout_visualizations():
                 [
                     dbc.Col(
                         dcc.Graph(
-                            id="n-trips-graph-subscribers", figure=fig_n_trips_subs
+                            id="n-trips-graph-subscribers",
+                            figure=figs["n_trips_subs"],
                         ),
                         width=10,
                     ),
@@ -91,18 +94,23 @@ def serve_layout_visualizations():
                             dbc.Row(
                                 [
                                     dbc.Col(
-                                        dcc.Graph(id="start-hour", figure=fig_hours),
+                                        dcc.Graph(
+                                            id="start-hour", figure=figs["hours"]
+                                        ),
                                         width=5,
                                     ),
                                     dbc.Col(
-                                        dcc.Graph(id="days", figure=fig_days), width=5
+                                        dcc.Graph(id="days", figure=figs["days"]),
+                                        width=5,
                                     ),
                                 ]
                             ),
                             dbc.Row(
                                 [
                                     dbc.Col(
-                                        dcc.Graph(id="day-trips", figure=fig_time_days),
+                                        dcc.Graph(
+                                            id="day-trips", figure=figs["time_days"]
+                                        ),
                                         width=10,
                                     )
                                 ]
@@ -117,7 +125,8 @@ def serve_layout_visualizations():
             dbc.Row(
                 [
                     dbc.Col(
-                        dcc.Graph(id="district-trips", figure=fig_districts), width=10
+                        dcc.Graph(id="district-trips", figure=figs["districts"]),
+                        width=10,
                     ),
                     dbc.Col(html.P(district_string)),
                 ]
@@ -125,7 +134,7 @@ def serve_layout_visualizations():
             dbc.Row(
                 [
                     dbc.Col(
-                        dcc.Graph(id="district-trips", figure=fig_boston_cambridge),
+                        dcc.Graph(id="district-trips", figure=figs["boston_cambridge"]),
                         width=10,
                     )
                 ]
@@ -137,118 +146,159 @@ def serve_layout_visualizations():
 
 layout = serve_layout_visualizations
 
-db = create_engine(database_url)
-conn = db.connect()
 
 query_get_n_trips = f"""
             SELECT month as "Date", n_trips as "Number of Trips" FROM monthly_trips
             """
-dff_n_trips = pd.read_sql(query_get_n_trips, con=conn)
-fig_n_trips = px.line(dff_n_trips, x="Date", y="Number of Trips")
-fig_n_trips.update_layout(
-    title={"text": "Number of Trips by Month", "font": {"size": 30}}
-)
-
 
 query_subscriber_trips = f"""
         SELECT month as "Date", member_casual as "Membership Status", s.n_trips as "Number of Trips", s.n_trips::float/mt.n_trips "Percent of Trips"
         FROM subscriber_monthly_trips s
         LEFT JOIN monthly_trips mt using (month)
         """
-dff_n_trips_subs = pd.read_sql(query_subscriber_trips, con=conn)
-dff_n_trips_subs = (
-    dff_n_trips_subs.set_index(["Date", "Membership Status"])
-    .stack(level=[0])
-    .reset_index()
-)
-dff_n_trips_subs.columns = ["Date", "Membership Status", "Metric", "Value"]
-
-fig_n_trips_subs = px.line(
-    dff_n_trips_subs, x="Date", color="Membership Status", y="Value", facet_col="Metric"
-)
-fig_n_trips_subs.update_yaxes(matches=None)
-fig_n_trips_subs.update_layout(
-    title={
-        "text": "Number of Trips and Percent of Trips by Member Status",
-        "font": {"size": 30},
-    }
-)
-
 
 query_hours = f"""
         SELECT hour as "Hour", n_trips as "Number of Trips" from hour_start_view
         """
-dff_hours = pd.read_sql(query_hours, con=conn)
-fig_hours = px.line(dff_hours, x="Hour", y="Number of Trips")
-fig_hours.update_layout(
-    title={"text": "Number of Trips Started by Hour", "font": {"size": 30}}
-)
-
 
 query_dow = f"""
         SELECT day as "Day", n_trips as "Number of Trips" from day_of_week_trips
         """
-dff_dow = pd.read_sql(query_dow, con=conn)
-dff_dow["Day"] = dff_dow["Day"].replace(dow_dict)
-fig_days = px.bar(dff_dow, x="Day", y="Number of Trips")
-fig_days.update_layout(
-    title={"text": "Number of Trips Started by Day", "font": {"size": 30}}
-)
-
 
 query_hour_days = """
 SELECT hour as "Hour", day as "Day", n_trips as "Number of Trips" FROM hour_day_started_at
 """
-dff_hour_days = pd.read_sql(query_hour_days, con=conn)
-dff_hour_days["Day"] = dff_hour_days["Day"].replace(dow_dict)
-fig_time_days = px.line(
-    dff_hour_days, x="Hour", y="Number of Trips", facet_col="Day", facet_col_wrap=5
-)
-fig_time_days.update_layout(
-    title={"text": "Number of Trips started by Day, Hour", "font": {"size": 30}}
-)
-
 
 query_district = """
 SELECT district as "District", n_trips as "Number of Trips", n_trips_percent "Percent of Trips" FROM district_counts
 """
-dff_districts = pd.read_sql(query_district, con=conn)
-fig_districts = px.bar(
-    dff_districts,
-    x="District",
-    y="Number of Trips",
-    hover_data=["Percent of Trips"],
-    title="Number of trips started by district",
-)
-fig_districts.update_layout(
-    title={"text": "Number of Trips Started by District", "font": {"size": 30}}
-)
-
 
 query_boston_cambridge = """
 SELECT month as "Date", district as "District", n_trips as "Number of Trips", percent_subscriber as "Percent Subscriber" FROM boston_cambridge
 """
-df_boston_cambridge = pd.read_sql(query_boston_cambridge, con=conn)
-df_boston_cambridge = (
-    df_boston_cambridge.set_index(["Date", "District"]).stack(level=[0]).reset_index()
-)
-df_boston_cambridge.columns = ["Date", "District", "Metric", "Value"]
-fig_boston_cambridge = px.line(
-    df_boston_cambridge,
-    x="Date",
-    y="Value",
-    color="District",
-    facet_col="Metric",
-    facet_col_wrap=2,
-)
-fig_boston_cambridge.update_yaxes(matches=None)
-fig_boston_cambridge.update_layout(
-    title={
-        "text": "Number of Trips and Percent Subscriber for Boston, Cambridge",
-        "font": {"size": 30},
-    }
+
+
+overview_queries = (
+    query_get_n_trips,
+    query_subscriber_trips,
+    query_hours,
+    query_dow,
+    query_hour_days,
+    query_district,
+    query_boston_cambridge,
 )
 
 
-db.dispose()
-conn.close()
+def read(query):
+    with db.connect() as conn:
+        return pd.read_sql(query, con=conn)
+
+
+@metadata.value("visualization_figures", shared=True)
+def visualization_figures():
+    """Build the page's figures, which only change when trips are added."""
+    (
+        dff_n_trips,
+        dff_n_trips_subs,
+        dff_hours,
+        dff_dow,
+        dff_hour_days,
+        dff_districts,
+        df_boston_cambridge,
+    ) = executor.gather(*((read, query) for query in overview_queries))
+
+    fig_n_trips = px.line(dff_n_trips, x="Date", y="Number of Trips")
+    fig_n_trips.update_layout(
+        title={"text": "Number of Trips by Month", "font": {"size": 30}}
+    )
+
+    dff_n_trips_subs = (
+        dff_n_trips_subs.set_index(["Date", "Membership Status"])
+        .stack(level=[0])
+        .reset_index()
+    )
+    dff_n_trips_subs.columns = ["Date", "Membership Status", "Metric", "Value"]
+
+    fig_n_trips_subs = px.line(
+        dff_n_trips_subs,
+        x="Date",
+        color="Membership Status",
+        y="Value",
+        facet_col="Metric",
+    )
+    fig_n_trips_subs.update_yaxes(matches=None)
+    fig_n_trips_subs.update_layout(
+        title={
+            "text": "Number of Trips and Percent of Trips by Member Status",
+            "font": {"size": 30},
+        }
+    )
+
+    fig_hours = px.line(dff_hours, x="Hour", y="Number of Trips")
+    fig_hours.update_layout(
+        title={"text": "Number of Trips Started by Hour", "font": {"size": 30}}
+    )
+
+    dff_dow["Day"] = dff_dow["Day"].replace(dow_dict)
+    fig_days = px.bar(dff_dow, x="Day", y="Number of Trips")
+    fig_days.update_layout(
+        title={"text": "Number of Trips Started by Day", "font": {"size": 30}}
+    )
+
+    dff_hour_days["Day"] = dff_hour_days["Day"].replace(dow_dict)
+    fig_time_days = px.line(
+        dff_hour_days,
+        x="Hour",
+        y="Number of Trips",
+        facet_col="Day",
+        facet_col_wrap=5,
+    )
+    fig_time_days.update_layout(
+        title={"text": "Number of Trips started by Day, Hour", "font": {"size": 30}}
+    )
+
+    fig_districts = px.bar(
+        dff_districts,
+        x="District",
+        y="Number of Trips",
+        hover_data=["Percent of Trips"],
+        title="Number of trips started by district",
+    )
+    fig_districts.update_layout(
+        title={"text": "Number of Trips Started by District", "font": {"size": 30}}
+    )
+
+    df_boston_cambridge = (
+        df_boston_cambridge.set_index(["Date", "District"])
+        .stack(level=[0])
+        .reset_index()
+    )
+    df_boston_cambridge.columns = ["Date", "District", "Metric", "Value"]
+    fig_boston_cambridge = px.line(
+        df_boston_cambridge,
+        x="Date",
+        y="Value",
+        color="District",
+        facet_col="Metric",
+        facet_col_wrap=2,
+    )
+    fig_boston_cambridge.update_yaxes(matches=None)
+    fig_boston_cambridge.update_layout(
+        title={
+            "text": "Number of Trips and Percent Subscriber for Boston, Cambridge",
+            "font": {"size": 30},
+        }
+    )
+
+    return {
+        key: figures.compact(fig, "visualizations")
+        for key, fig in {
+            "n_trips": fig_n_trips,
+            "n_trips_subs": fig_n_trips_subs,
+            "hours": fig_hours,
+            "days": fig_days,
+            "time_days": fig_time_days,
+            "districts": fig_districts,
+            "boston_cambridge": fig_boston_cambridge,
+        }.items()
+    }
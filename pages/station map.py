@@ -1,15 +1,12 @@
-from dash import Dash, dash_table, Input, Output, dcc, html, ctx
+from dash import dash_table, Input, Output, State, ClientsideFunction, dcc, html, ctx
 import dash_bootstrap_components as dbc
-import pandas as pd
-import numpy as np
-import plotly.graph_objects as go
-from sqlalchemy import create_engine
 from datetime import date
 import dash
 import re
 import os
 
-database_url = os.getenv("database_url_bbb")
+from bluebikes import dimension, figures, metadata, metrics, queries
+
 mapboxtoken = os.getenv("mapboxtoken")
 
 
@@ -28,17 +25,10 @@ dash.register_page(
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
 )
 
-engine = create_engine(database_url)
-
-max_ride_query = f"""SELECT MAX(started_at) FROM trips
-                            """
-max_ride_date = pd.read_sql(max_ride_query, con=engine).squeeze().date()
-engine.dispose()
-
-max_ride_date_string = max_ride_date.strftime("%Y-%m-%d")
-
 
 def serve_layout_station_comparison():
+    max_ride_date = metadata.max_ride_date()
+    stations = dimension.stations()
     return dbc.Container(
         [
             html.H1("Boston Bluebikes Station Map"),
@@ -73,6 +63,11 @@ def serve_layout_station_comparison():
             html.Hr(),
             html.Div(id="table"),
             html.Br(),
+            dcc.Store(id="graph-all-data"),
+            dcc.Store(id="graph-specific-data"),
+            dcc.Store(id="station-base", storage_type="local"),
+            dcc.Store(id="station-base-version", data=stations.version),
+            dcc.Store(id="map-style", data=figures.map_style(mapboxtoken)),
         ],
         fluid=True,
     )
@@ -81,8 +76,11 @@ def serve_layout_station_comparison():
 layout = serve_layout_station_comparison
 
 
+dimension.register_base_store("station-base", "station-base-version")
+
+
 @dash.callback(
-    Output(component_id="graph-specific", component_property="figure"),
+    Output(component_id="graph-specific-data", component_property="data"),
     Output(component_id="table", component_property="children"),
     Input(component_id="station-type", component_property="value"),
     Input(component_id="date-range", component_property="start_date"),
@@ -91,18 +89,6 @@ layout = serve_layout_station_comparison
     Input(component_id="graph-specific", component_property="clickData"),
 )
 def gather_data(station_type, start_date, end_date, clickdata, clickdata2):
-    station_options = {
-        "End Station": "end_station_id",
-        "Start Station": "start_station_id",
-    }
-    station_id_type = station_options[station_type]
-
-    station_options_reversed = {
-        "End Station": "start_station_id",
-        "Start Station": "end_station_id",
-    }
-    reverse_station_id_type = station_options_reversed[station_type]
-
     most_recent = ctx.triggered_id
 
     if most_recent == "graph-all":
@@ -112,35 +98,14 @@ def gather_data(station_type, start_date, end_date, clickdata, clickdata2):
     else:
         clickdata_name = "MIT at Mass Ave / Amherst St"
 
-    db = create_engine(database_url)
-    conn = db.connect()
-    query_location = f"""
-    SELECT longitude, latitude
-    from stations
-    where name = '{clickdata_name}'"""
-
-    coords = pd.read_sql(query_location, con=conn).values
-    station_long, station_lat = coords[0][0], coords[0][1]
-
-    get_end_stations_query = f"""
-            SELECT s.name, s.longitude, s.latitude, COUNT(trip_id) "Number of Trips", 
-            AVG(CASE WHEN  member_casual = 'member' THEN 1 ELSE 0 END) "Percent Member",
-            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
-            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
-            PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY (60*t.distance/t.duration)) "Median Speed"
-            FROM trips t
-            INNER JOIN stations s on t.{reverse_station_id_type} = s.station_id
-			INNER JOIN stations s2  on s2.station_id = t.{station_id_type}
-            WHERE s2.name = '{clickdata_name}'
-            AND t.started_at between '{start_date}' and '{end_date}'
-            group by s.name, s.longitude, s.latitude
-            ORDER BY 4 desc
-            LIMIT 25
-                """
-
-    end_stations_df = pd.read_sql(get_end_stations_query, con=conn)
-    conn.close()
-    db.dispose()
+    stations = dimension.stations()
+    if clickdata_name not in stations:
+        return dash.no_update, dash.no_update
+    station_id = stations.station_id(clickdata_name)
+    end_stations_df = queries.top_destinations(
+        station_id, station_type, start_date, end_date
+    )
+    watch = metrics.stopwatch()
 
     explanation_string = f"""
     The following table summarizes the end stations of trips beginning at the station located at {clickdata_name}.
@@ -150,71 +115,21 @@ def gather_data(station_type, start_date, end_date, clickdata, clickdata2):
     """
 
     if end_stations_df.empty:
-        return None
-    end_stations_df["size"] = (
-        10
-        * (
-            end_stations_df["Number of Trips"]
-            - end_stations_df["Number of Trips"].min()
-        )
-        / (
-            end_stations_df["Number of Trips"].max()
-            - end_stations_df["Number of Trips"].min()
-        )
-    ) + 10
-
-    end_stations_df["name_trips"] = (
-        end_stations_df["name"]
-        + " ("
-        + end_stations_df["Number of Trips"].astype(str)
-        + " trips)"
-    )
-
-    fig = go.Figure(layout={"height": fig_height})
-    fig.add_trace(
-        go.Scattermapbox(
-            mode="markers",
-            lon=end_stations_df["longitude"],
-            lat=end_stations_df["latitude"],
-            text=end_stations_df["name_trips"],
-            hoverinfo="text",
-            marker=go.scattermapbox.Marker(
-                colorscale="blues",
-                size=end_stations_df["size"],
-                allowoverlap=False,
-                color=end_stations_df["Number of Trips"],
-                showscale=True,
-            ),
-        )
-    )
-
-    fig.add_trace(
-        go.Scattermapbox(
-            name=clickdata_name,
-            mode="markers",
-            lon=[station_long, station_long],
-            lat=[station_lat, station_lat],
-            text=clickdata_name,
-            hoverinfo="text",
-            marker=dict(symbol="marker", size=20),
-        )
-    )
-
-    fig.update_layout(
-        title=f"Top 25 {station_type}s from {clickdata_name} <br><sup>From {start_date} to {end_date}</sup>",
-        showlegend=False,
-        font={"size": 16},
-        mapbox=dict(
-            accesstoken=mapboxtoken,
-            style="dark",
-            center=go.layout.mapbox.Center(lat=station_lat, lon=station_long),
-            zoom=12.5,
-        ),
-    )
+        return dash.no_update, dash.no_update
+    # Only rows and counts; assets/maps.js draws them with the station base.
+    rows = stations.name_rows(end_stations_df["name"])
+    known = rows >= 0
+    map_data = {
+        "version": stations.version,
+        "title": f"Top 25 {station_type}s from {clickdata_name} <br><sup>From {start_date} to {end_date}</sup>",
+        "height": fig_height,
+        "zoom": 12.5,
+        "station": stations.row(clickdata_name),
+        "rows": rows[known].tolist(),
+        "n_trips": end_stations_df["Number of Trips"].to_numpy()[known].tolist(),
+    }
 
-    end_stations_df = end_stations_df.drop(
-        ["latitude", "longitude", "size", "name_trips"], axis=1
-    ).round(2)
+    end_stations_df = end_stations_df.drop(["latitude", "longitude"], axis=1).round(2)
 
     table = dash_table.DataTable(
         data=end_stations_df.to_dict("records"),
@@ -223,7 +138,8 @@ def gather_data(station_type, start_date, end_date, clickdata, clickdata2):
         style_cell={"textAlign": "left"},
         page_size=10,
     )
-    return fig, dbc.Row(
+    watch.lap("pandas")
+    return map_data, dbc.Row(
         [
             dbc.Row(
                 html.H4(
@@ -237,82 +153,46 @@ def gather_data(station_type, start_date, end_date, clickdata, clickdata2):
     )
 
 
+dash.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="top_stations"),
+    Output(component_id="graph-specific", component_property="figure"),
+    Input(component_id="graph-specific-data", component_property="data"),
+    Input(component_id="station-base", component_property="data"),
+    State(component_id="map-style", component_property="data"),
+)
+
+
 @dash.callback(
-    Output(component_id="graph-all", component_property="figure"),
+    Output(component_id="graph-all-data", component_property="data"),
     Input(component_id="station-type", component_property="value"),
     Input(component_id="date-range", component_property="start_date"),
     Input(component_id="date-range", component_property="end_date"),
 )
 def main_graph(station_type, start_date, end_date):
-    station_options = {
-        "End Station": "end_station_id",
-        "Start Station": "start_station_id",
-    }
-    station_id_type = station_options[station_type]
-
-    db = create_engine(database_url)
-    conn = db.connect()
-
-    if start_date == "2023-01-01" and end_date == max_ride_date_string:
-        if station_id_type == "end_station_id":
-            query = """
-                    SELECT * FROM station_map_end_id
-                    """
-        else:
-            query = """
-                    SELECT * FROM station_map_start_id
-                    """
-    else:
-        query = f"""
-        select s.name, s.latitude, s.longitude, n_trips 
-            from
-            stations s
-            INNER join
-            (
-            select {station_id_type}, count({station_id_type}) as n_trips
-            from
-            trips
-            where started_at between '{start_date}' and '{end_date}'
-            group by {station_id_type}
-            ) trip_count_subquery
-            on s.station_id=trip_count_subquery.{station_id_type}
-        """
-    data = pd.read_sql(query, con=conn)
+    data = queries.station_trip_counts(station_type, start_date, end_date)
+    watch = metrics.stopwatch()
     data["n_trips"] = data["n_trips"].fillna(0)
-    conn.close()
-    db.dispose()
 
-    data["size"] = np.log(data["n_trips"])
-    data["name_trips"] = data["name"] + " (" + data["n_trips"].astype(str) + " trips)"
-
-    start_long = data[data["n_trips"] == data["n_trips"].max()]["longitude"].values[0]
-    start_lat = data[data["n_trips"] == data["n_trips"].max()]["latitude"].values[0]
+    stations = dimension.stations()
+    rows = stations.name_rows(data["name"])
+    known = rows >= 0
+    # Only rows and counts; assets/maps.js draws them with the station base.
+    map_data = {
+        "version": stations.version,
+        "title": f"Top {station_type}s in Boston <br><sup>From {start_date} to {end_date}</sup>",
+        "height": fig_height,
+        "zoom": 11,
+        "rows": rows[known].tolist(),
+        "n_trips": data["n_trips"].to_numpy()[known].tolist(),
+    }
+    watch.lap("pandas")
+    return map_data
 
-    fig = go.Figure(
-        go.Scattermapbox(
-            text=data["name_trips"],
-            lat=data["latitude"],
-            lon=data["longitude"],
-            mode="markers",
-            hoverinfo="text",
-            marker=go.scattermapbox.Marker(
-                colorscale="blues",
-                size=data["size"],
-                color=data["n_trips"],
-                showscale=True,
-            ),
-        ),
-        layout={"height": fig_height},
-    )
 
-    fig.update_layout(
-        title=f"Top {station_type}s in Boston <br><sup>From {start_date} to {end_date}</sup>",
-        font={"size": 16},
-        mapbox=dict(
-            accesstoken=mapboxtoken,
-            style="dark",
-            center=go.layout.mapbox.Center(lat=start_lat, lon=start_long),
-            zoom=11,
-        ),
-    )
-    return fig
+dash.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="all_stations"),
+    Output(component_id="graph-all", component_property="figure"),
+    Input(component_id="graph-all-data", component_property="data"),
+    Input(component_id="station-base", component_property="data"),
+    State(component_id="map-style", component_property="data"),
+)
@@ -1,17 +1,31 @@
-from dash import dash_table, Input, Output, dcc, html, ctx
+from dash import dash_table, Input, Output, State, ClientsideFunction, dcc, html, ctx
 import dash_bootstrap_components as dbc
-import pandas as pd
-import numpy as np
 import plotly.graph_objects as go
-from sqlalchemy import create_engine
 from datetime import date
-import configparser as c
 import dash
 import plotly.express as px
+import plotly.io as pio
 import os
 
-database_url = os.getenv("database_url_bbb")
+from bluebikes import (
+    dimension,
+    executor,
+    figures,
+    jobs,
+    metadata,
+    metrics,
+    queries,
+    store,
+)
+
 mapboxtoken = os.getenv("mapboxtoken")
+# Whether the browser gets every metric series and switches metrics itself,
+# or only the key of the frame in ``bluebikes.store`` and a figure per metric.
+metrics_in_browser = os.getenv("STATION_METRICS_IN_BROWSER", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+)
 
 explanation_string_1 = "This dashboard allows users to select a station and see basic information about the station as well as visualizations of key metrics"
 explanation_string_2 = "Users can select a station by scrolling through the dropdown or by clicking on any of the station in the map below"
@@ -30,6 +44,14 @@ flow_graph_string = (
     "This graph allows us to tell if a station is more popularly used as an end or as a start. The limitation of this graph is that stations often are full or empty, which means that many times the flow in or out is constrained."
 )
 
+metric_options = [
+    "Percent Member",
+    "Number of Trips",
+    "Median Duration",
+    "Median Distance",
+    "Median Speed",
+]
+
 flow_graph_string_2 = "This graph aggregates the flow of the station by each hour, allowing us to see more clearly which hours are more common to use the station as a start vs as an end"
 
 dash.register_page(
@@ -40,36 +62,10 @@ dash.register_page(
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
 )
 
-engine = create_engine(database_url)
-
-max_ride_query = f"""SELECT MAX(started_at) FROM trips
-                            """
-max_ride_date = pd.read_sql(max_ride_query, con=engine).squeeze().date()
-engine.dispose()
-
-max_ride_date_string = max_ride_date.strftime("%Y-%m-%d")
-
-
-def get_stations():
-    db = create_engine(database_url)
-    conn = db.connect()
-    stations_query = f"""
-                SELECT s.name
-                FROM stations s
-                LEFT JOIN trips t on s.station_id = t.start_station_id
-                GROUP BY s.name
-                ORDER BY COUNT(t.trip_id) desc
-                """
-    stations_list = pd.read_sql(stations_query, con=conn).squeeze()
-    conn.close()
-    db.dispose()
-    return stations_list
-
-
-stations = get_stations()
-
 
 def serve_layout_stations():
+    max_ride_date = metadata.max_ride_date()
+    stations = dimension.stations()
     return dbc.Container(
         [
             html.H1("Station Analysis"),
@@ -99,7 +95,7 @@ def serve_layout_stations():
                                 dcc.Dropdown(
                                     id="station-select-stations",
                                     value="MIT at Mass Ave / Amherst St",
-                                    options=stations,
+                                    options=metadata.station_names(),
                                     clearable=False,
                                 ),
                                 width=9,
@@ -163,13 +159,7 @@ def serve_layout_stations():
                             dcc.Dropdown(
                                 id="metric-select-stations",
                                 value="Number of Trips",
-                                options=[
-                                    "Percent Member",
-                                    "Number of Trips",
-                                    "Median Duration",
-                                    "Median Distance",
-                                    "Median Speed",
-                                ],
+                                options=metric_options,
                                 clearable=False,
                             ),
                         ],
@@ -178,9 +168,10 @@ def serve_layout_stations():
                 ]
             ),
             html.Br(style={"marginBottom": "6.5em"}),
+            html.P(id="graph-job-status-stations", style={"fontSize": 16}),
             dbc.Row(
                 [
-                    dbc.Col(id="main-graph-stations", width=10),
+                    dbc.Col(dcc.Graph(id="main-graph-stations"), width=10),
                     dbc.Col(
                         html.P(interactive_graph_string, style={"fontSize": 16}),
                         width=2,
@@ -188,6 +179,7 @@ def serve_layout_stations():
                 ]
             ),
             html.Hr(),
+            html.P(id="flow-job-status-stations", style={"fontSize": 16}),
             dbc.Row(
                 [
                     dbc.Col(dcc.Graph(id="flow-graph-stations"), width=10),
@@ -202,6 +194,20 @@ def serve_layout_stations():
                 ]
             ),
             dcc.Store(id="graph-data-stations"),
+            # Background jobs of long ranges (see bluebikes.jobs), polled
+            # every second while they run.
+            dcc.Store(id="graph-job-stations"),
+            dcc.Interval(id="graph-job-poll-stations", interval=1000, disabled=True),
+            dcc.Store(id="flow-job-stations"),
+            dcc.Interval(id="flow-job-poll-stations", interval=1000, disabled=True),
+            dcc.Store(
+                id="figure-template-stations",
+                data=pio.templates[pio.templates.default].to_plotly_json(),
+            ),
+            dcc.Store(id="station-location-map-data"),
+            dcc.Store(id="station-base-stations", storage_type="local"),
+            dcc.Store(id="station-base-version-stations", data=stations.version),
+            dcc.Store(id="map-style-stations", data=figures.map_style(mapboxtoken)),
         ],
         fluid=True,
     )
@@ -210,8 +216,11 @@ def serve_layout_stations():
 layout = serve_layout_stations
 
 
+dimension.register_base_store("station-base-stations", "station-base-version-stations")
+
+
 @dash.callback(
-    Output(component_id="station-location-map", component_property="figure"),
+    Output(component_id="station-location-map-data", component_property="data"),
     Output(component_id="station-info-indicator", component_property="figure"),
     Output(component_id="table-stations", component_property="children"),
     Input(component_id="date-range-stations", component_property="start_date"),
@@ -221,18 +230,6 @@ layout = serve_layout_stations
     Input(component_id="station-type-select-stations", component_property="value"),
 )
 def plot_station(start_date, end_date, clickdata, start_station, station_type):
-    station_options = {"End": "end_station_id", "Start": "start_station_id"}
-    station_id_type = station_options[station_type]
-
-    station_options_reversed = {
-        "End": "start_station_id",
-        "Start": "end_station_id",
-    }
-    reverse_station_id_type = station_options_reversed[station_type]
-
-    db = create_engine(database_url)
-    conn = db.connect()
-
     if station_type == "Start":
         reverse_type = "End"
     else:
@@ -249,98 +246,34 @@ def plot_station(start_date, end_date, clickdata, start_station, station_type):
     else:
         station_name = start_station
 
-    query_location = f"""
-        SELECT longitude, latitude
-        from stations
-        where name = '{station_name}'"""
-
-    coords = pd.read_sql(query_location, con=conn).values
-    station_long, station_lat = coords[0][0], coords[0][1]
-
-    get_end_stations_query = f"""
-                SELECT s.name, s.longitude, s.latitude, COUNT(*) "Number of Trips",  
-                AVG(CASE WHEN  member_casual = 'member' THEN 1 ELSE 0 END) "Percent Member",
-                PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
-                PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
-                PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY (60*t.distance/t.duration)) "Median Speed"
-                FROM trips t
-                INNER JOIN stations s on t.{reverse_station_id_type} = s.station_id
-                WHERE t.{station_id_type}  = (SELECT station_id from stations where name = '{station_name}')
-                AND t.started_at between '{start_date}' and '{end_date}'
-                group by s.name, s.longitude, s.latitude
-                ORDER BY 4 desc
-                LIMIT 25
-                """
-
-    end_stations_df = pd.read_sql(get_end_stations_query, con=conn)
-
-    if end_stations_df.empty:
-        return None
-
-    end_stations_df["size"] = (
-        10
-        * (
-            end_stations_df["Number of Trips"]
-            - end_stations_df["Number of Trips"].min()
-        )
-        / (
-            end_stations_df["Number of Trips"].max()
-            - end_stations_df["Number of Trips"].min()
-        )
-    ) + 10
-
-    end_stations_df["name_trips"] = (
-        end_stations_df["name"]
-        + " ("
-        + end_stations_df["Number of Trips"].astype(str)
-        + " trips)"
-    )
-
-    fig = go.Figure(layout={"height": 550})
-    fig.add_trace(
-        go.Scattermapbox(
-            mode="markers",
-            lon=end_stations_df["longitude"],
-            lat=end_stations_df["latitude"],
-            text=end_stations_df["name_trips"],
-            hoverinfo="text",
-            marker=go.scattermapbox.Marker(
-                colorscale="blues",
-                size=end_stations_df["size"],
-                allowoverlap=False,
-                color=end_stations_df["Number of Trips"],
-                showscale=True,
-            ),
-        )
+    stations = dimension.stations()
+    if station_name not in stations:
+        return dash.no_update, dash.no_update, dash.no_update
+    station_id = stations.station_id(station_name)
+    end_stations_df, station_info = executor.gather(
+        (queries.top_destinations, station_id, station_type, start_date, end_date),
+        (queries.station_basics, station_id, start_date, end_date),
     )
+    watch = metrics.stopwatch()
 
-    fig.add_trace(
-        go.Scattermapbox(
-            name=station_name,
-            mode="markers",
-            lon=[station_long, station_long],
-            lat=[station_lat, station_lat],
-            text=station_name,
-            hoverinfo="text",
-            marker=dict(symbol="marker", size=20),
-        )
-    )
+    if end_stations_df.empty:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    # Only rows and counts; assets/maps.js draws them with the station base.
+    rows = stations.name_rows(end_stations_df["name"])
+    known = rows >= 0
+    map_data = {
+        "version": stations.version,
+        "title": f"Top 25 {reverse_type} Stations {preposition} {station_name} <br><sup>From {start_date} to {end_date}</sup>",
+        "height": 550,
+        "zoom": 12.25,
+        "station": stations.row(station_name),
+        "rows": rows[known].tolist(),
+        "n_trips": end_stations_df["Number of Trips"].to_numpy()[known].tolist(),
+    }
+    watch.lap("pandas")
 
-    fig.update_layout(
-        title=f"Top 25 {reverse_type} Stations {preposition} {station_name} <br><sup>From {start_date} to {end_date}</sup>",
-        font={"size": 16},
-        showlegend=False,
-        legend={"title": {"text": "Number of Trips"}},
-        mapbox=dict(
-            accesstoken=mapboxtoken,
-            style="dark",
-            center=go.layout.mapbox.Center(lat=station_lat, lon=station_long),
-            zoom=12.25,
-        ),
-    )
-    end_stations_df = end_stations_df.drop(
-        ["latitude", "longitude", "size", "name_trips"], axis=1
-    ).round(2)
+    end_stations_df = end_stations_df.drop(["latitude", "longitude"], axis=1).round(2)
 
     table = dash_table.DataTable(
         data=end_stations_df.to_dict("records"),
@@ -365,26 +298,6 @@ def plot_station(start_date, end_date, clickdata, start_station, station_type):
         # ],
     )
 
-    query_station_basics = f"""
-    with info as (SELECT name, district,  deployment_year, total_docks
-    FROM stations
-    WHERE name = '{station_name}'),
-
-    start_rides as (SELECT COUNT(start_station_id) start_rides
-    from trips t
-    LEFT JOIN stations s on s.station_id= t.start_station_id
-    where s.name = '{station_name}' and started_at between '{start_date}' and '{end_date}'),
-
-    end_rides as (SELECT COUNT(end_station_id) end_rides
-    from trips t
-    LEFT JOIN stations s on s.station_id= t.end_station_id
-    where s.name = '{station_name}' and started_at between '{start_date}' and '{end_date}')
-
-    SELECT * FROM info, start_rides, end_rides
-    """
-
-    station_info = pd.read_sql(query_station_basics, con=conn)
-
     indicator = go.Figure()
 
     indicator.add_trace(
@@ -421,12 +334,11 @@ def plot_station(start_date, end_date, clickdata, start_station, station_type):
         height=300,
         font={"size": 24},
     )
-    conn.close()
-    db.dispose()
+    watch.lap("figure")
 
     return (
-        fig,
-        indicator,
+        map_data,
+        figures.compact(indicator, "plot_station"),
         [
             html.Br(style={"marginBottom": "1.5em"}),
             html.H4(f"Top 25 {reverse_type} Stations {preposition} {station_name}"),
@@ -435,6 +347,15 @@ def plot_station(start_date, end_date, clickdata, start_station, station_type):
     )
 
 
+dash.clientside_callback(
+    ClientsideFunction(namespace="maps", function_name="top_stations"),
+    Output(component_id="station-location-map", component_property="figure"),
+    Input(component_id="station-location-map-data", component_property="data"),
+    Input(component_id="station-base-stations", component_property="data"),
+    State(component_id="map-style-stations", component_property="data"),
+)
+
+
 @dash.callback(
     Output(component_id="station-select-stations", component_property="value"),
     Input(component_id="station-select-stations", component_property="value"),
@@ -447,90 +368,118 @@ def update_dropdown_value(station_start, clickdata):
     else:
         station_name = station_start
 
+    if station_name not in dimension.stations():
+        return dash.no_update
     return station_name
 
 
+def _run_or_poll(poll_id, job, func, *args, background):
+    """``(job, status, value)`` of a station query: the job polled when the
+    ``poll_id`` interval fired, else the query run, long ones as a job."""
+    if ctx.triggered_id == poll_id and job is not None:
+        return (job, *jobs.poll(job))
+    job, value = jobs.run(func, *args, background=background)
+    if job is None:
+        return None, "done", value
+    return (job, *jobs.poll(job))
+
+
 @dash.callback(
     Output(component_id="graph-data-stations", component_property="data"),
+    Output(component_id="graph-job-stations", component_property="data"),
+    Output(component_id="graph-job-poll-stations", component_property="disabled"),
+    Output(component_id="graph-job-status-stations", component_property="children"),
     Input(component_id="station-select-stations", component_property="value"),
     Input(component_id="date-type-stations", component_property="value"),
     Input(component_id="date-range-stations", component_property="start_date"),
     Input(component_id="date-range-stations", component_property="end_date"),
     Input(component_id="station-type-select-stations", component_property="value"),
+    Input(component_id="graph-job-poll-stations", component_property="n_intervals"),
+    State(component_id="graph-job-stations", component_property="data"),
 )
 def get_station_graphs_data(
-    station_name, date_type, start_date, end_date, station_type
+    station_name,
+    date_type,
+    start_date,
+    end_date,
+    station_type,
+    n_intervals=None,
+    job=None,
 ):
-    station_options = {"End": "end_station_id", "Start": "start_station_id"}
-    station_id_type = station_options[station_type]
-
-    station_options_reversed = {
-        "End": "start_station_id",
-        "Start": "end_station_id",
-    }
-    reverse_station_id_type = station_options_reversed[station_type]
-
-    db = create_engine(database_url)
-    conn = db.connect()
-    date_type_conversions = {
-        "Quarter": "quarter",
-        "Month": "month",
-        "Week": "week",
-        "Day of Week": "isodow",
-        "Hour": "hour",
-    }
-    date_type_sql = date_type_conversions[date_type]
+    if station_type == "Start":
+        preposition = "from"
+    else:
+        preposition = "to"
+    stations = dimension.stations()
+    if station_name not in stations:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    station_id = stations.station_id(station_name)
+    label = f"{preposition} {station_name}"
+    # Hourly buckets are counted from trips; the others come from the rollups.
+    job, status, data = _run_or_poll(
+        "graph-job-poll-stations",
+        job,
+        queries.time_buckets,
+        station_id,
+        station_type,
+        date_type,
+        start_date,
+        end_date,
+        background=date_type == "Hour" and jobs.long_range(start_date, end_date),
+    )
+    if status in ("queued", "running"):
+        progress = f"Computing the chart: {data}"
+        if ctx.triggered_id == "graph-job-poll-stations":
+            return dash.no_update, dash.no_update, False, progress
+        pending = {"date_type": date_type, "label": label, "pending": "Computing..."}
+        return pending, job, False, progress
+    if status == "failed":
+        failed = {"date_type": date_type, "label": label, "pending": "Not available"}
+        return failed, None, True, f"The chart could not be computed: {data}"
+    watch = metrics.stopwatch()
+    if not metrics_in_browser:
+        key = store.frames.put(
+            "time_buckets",
+            (station_id, station_type, date_type, start_date, end_date),
+            data,
+        )
+        watch.lap("pandas")
+        return {"date_type": date_type, "label": label, "key": key}, None, True, None
     if date_type in ["Quarter", "Month", "Week"]:
-        data_query = f"""
-                    SELECT date_trunc('{date_type_sql}', started_at) "Date",
-                    COUNT(trip_id) "Number of Trips",
-                    AVG(CASE WHEN  member_casual = 'member' THEN 1 ELSE 0 END) "Percent Member",
-                    PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
-                    PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
-                    PERCENTILE_disc(0.5) WITHIN GROUP(ORDER BY (60*t.distance/t.duration)) "Median Speed"
-
-                    FROM trips t
-                    INNER JOIN stations s on t.{reverse_station_id_type} = s.station_id
-                    WHERE t.{station_id_type}  = (SELECT station_id from stations where name = '{station_name}') and started_at between '{start_date}' and '{end_date}'
-                    GROUP BY 1
-                    ORDER BY 1
-                    """
+        x = data["Date"].dt.strftime("%Y-%m-%d")
     else:
-        data_query = f"""
-                    SELECT extract('{date_type_sql}' from started_at) "Date",
-                    COUNT(trip_id) "Number of Trips",
-                    AVG(CASE WHEN  member_casual = 'member' THEN 1 ELSE 0 END) "Percent Member",
-                    PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.duration) "Median Duration",
-                    PERCENTILE_CONT(0.5) WITHIN GROUP(ORDER BY t.distance) "Median Distance",
-                    PERCENTILE_disc(0.5) WITHIN GROUP(ORDER BY (60*t.distance/t.duration)) "Median Speed"
-                    FROM trips t
-                    INNER JOIN stations s on t.{reverse_station_id_type} = s.station_id
-                    WHERE t.{station_id_type}  = (SELECT station_id from stations where name = '{station_name}') and started_at between '{start_date}' and '{end_date}'
-                    GROUP BY 1
-                    ORDER BY 1
-                        """
-
-    data = pd.read_sql(data_query, con=conn)
-    conn.close()
-    db.dispose()
-    return data.to_json(date_format="iso", orient="split")
+        x = data["Date"].astype(int)
+    # Every metric is sent, so switching metrics is redrawn in the browser.
+    series = {
+        "date_type": date_type,
+        "label": label,
+        "x": x.tolist(),
+        "metrics": {
+            metric: data[metric].round(figures.float_decimals).tolist()
+            for metric in metric_options
+        },
+    }
+    watch.lap("pandas")
+    return series, None, True, None
 
 
-@dash.callback(
-    Output(component_id="main-graph-stations", component_property="children"),
-    Input(component_id="graph-data-stations", component_property="data"),
-    Input(component_id="metric-select-stations", component_property="value"),
-    Input(component_id="station-select-stations", component_property="value"),
-    Input(component_id="date-type-stations", component_property="value"),
-    Input(component_id="station-type-select-stations", component_property="value"),
-)
-def plot_data(jsonified_data, metric, station, date_type, station_type):
-    if station_type == "Start":
-        preposition = "from"
+store.frames.loader("time_buckets", queries.time_buckets)
+
+
+def plot_metric(data, metric):
+    """The chart of one metric from the frame stored under ``data["key"]``,
+    drawn as ``assets/stations.js`` draws it in the browser."""
+    if not data:
+        return dash.no_update
+    if data["date_type"] == "Day of Week":
+        title = f"{metric} {data['label']} by Day of Week"
     else:
-        preposition = "to"
-    dff = pd.read_json(jsonified_data, orient="split")
-    if date_type == "Day of Week":
+        title = f"{data['date_type']}ly {metric} {data['label']}"
+    if "pending" in data:
+        return figures.placeholder(title, data["pending"])
+    dff = store.frames.get(data["key"])
+    watch = metrics.stopwatch()
+    if data["date_type"] == "Day of Week":
         dff["Date"] = dff["Date"].replace(
             {
                 1: "Monday",
@@ -542,92 +491,93 @@ def plot_data(jsonified_data, metric, station, date_type, station_type):
                 7: "Sunday",
             }
         )
-        fig = px.line(
-            dff, x="Date", y=metric, hover_data=["Number of Trips"], markers=True
-        )
-        fig.update_layout(
-            title=f"{metric} {preposition} {station} by Day of Week",
-            font={"size": 24}  # ,
-            #  height=800,
-        )
-    else:
-        fig = px.line(
-            dff, x="Date", y=metric, hover_data=["Number of Trips"], markers=True
-        )
-        fig.update_layout(
-            title=f"{date_type}ly {metric} {preposition} {station}",
-            font={"size": 24}  # ,
-            # height=800,
-        )
-    return dcc.Graph(figure=fig)
+    hover_data = [] if metric == "Number of Trips" else ["Number of Trips"]
+    fig = px.line(dff, x="Date", y=metric, hover_data=hover_data, markers=True)
+    fig.update_layout(title=title, font={"size": 24})
+    watch.lap("figure")
+    return figures.compact(fig, "plot_metric")
+
+
+if metrics_in_browser:
+    # Draws the series for the selected metric; see assets/stations.js.
+    dash.clientside_callback(
+        ClientsideFunction(namespace="stations", function_name="plot_metric"),
+        Output(component_id="main-graph-stations", component_property="figure"),
+        Input(component_id="graph-data-stations", component_property="data"),
+        Input(component_id="metric-select-stations", component_property="value"),
+        State(component_id="figure-template-stations", component_property="data"),
+    )
+else:
+    dash.callback(
+        Output(component_id="main-graph-stations", component_property="figure"),
+        Input(component_id="graph-data-stations", component_property="data"),
+        Input(component_id="metric-select-stations", component_property="value"),
+    )(plot_metric)
 
 
 @dash.callback(
     Output(component_id="flow-graph-stations", component_property="figure"),
     Output(component_id="flow-graph-stations-2", component_property="figure"),
+    Output(component_id="flow-job-stations", component_property="data"),
+    Output(component_id="flow-job-poll-stations", component_property="disabled"),
+    Output(component_id="flow-job-status-stations", component_property="children"),
     Input(component_id="station-select-stations", component_property="value"),
     Input(component_id="date-range-stations", component_property="start_date"),
     Input(component_id="date-range-stations", component_property="end_date"),
+    Input(component_id="flow-job-poll-stations", component_property="n_intervals"),
+    State(component_id="flow-job-stations", component_property="data"),
 )
-def flow_graph(station, start_date, end_date):
-    db = create_engine(database_url)
-    conn = db.connect()
-
-    find_station_id = f"""
-    SELECT station_id
-    FROM stations where name = '{station}'
-    """
-    station_id = pd.read_sql_query(find_station_id, con=conn).squeeze()
-
-    query = f"""
-    with starts as (SELECT * FROM
-    (
-       SELECT day
-       FROM   generate_series(timestamp '{start_date}'
-                            , timestamp '{end_date}'
-                            , interval  '1 hour') day
-       ) d
-       LEFT JOIN (SELECT DATE_TRUNC('hour', started_at) as Day, COALESCE(COUNT(trip_id), 0) start_trips
-    FROM trips t
-    WHERE t.start_station_id = '{station_id}' and started_at between '{start_date}' and '{end_date}'
-    GROUP BY 1
-    ORDER BY 1) s USING(day)),
-
-    ends as (SELECT * FROM
-    (
-       SELECT day
-       FROM   generate_series(timestamp '{start_date}'
-                            , timestamp '{end_date}'
-                            , interval  '1 hour') day
-       ) d
-       LEFT JOIN (SELECT DATE_TRUNC('hour', started_at) as Day, COALESCE(COUNT(trip_id), 0) end_trips
-    FROM trips t
-    WHERE t.end_station_id = '{station_id}' and started_at between '{start_date}' and '{end_date}'
-    GROUP BY 1
-    ORDER BY 1) s USING(day))
-
-    SELECT s.*,
-    e.end_trips,
-    COALESCE(e.end_trips, 0) - COALESCE(s.start_trips, 0)  flow,
-    SUM(COALESCE(e.end_trips, 0) -COALESCE(s.start_trips, 0)) over (order by s.Day asc rows between unbounded preceding and current row) cumulative_flow
-    FROM starts s LEFT JOIN ends e USING (Day)
-    """
-
-    df_flow = pd.read_sql_query(query, con=conn)
-    conn.close()
-    db.dispose()
-
-    fig = px.line(df_flow, x="day", y="cumulative_flow")
-    fig.update_layout(
-        title=f"Hourly Flow for {station}", font={"size": 24}  # height=800,
+def flow_graph(station, start_date, end_date, n_intervals=None, job=None):
+    stations = dimension.stations()
+    if station not in stations:
+        return (dash.no_update,) * 5
+    station_id = stations.station_id(station)
+    title = f"Hourly Flow for {station}"
+    title2 = f"Average Hourly Flow for {station}"
+    # Ranges the flow cube covers are sliced from it without SQL.
+    job, status, value = _run_or_poll(
+        "flow-job-poll-stations",
+        job,
+        queries.hourly_flow,
+        station_id,
+        start_date,
+        end_date,
+        background=not queries.in_flow_cube(start_date, end_date)
+        and jobs.long_range(start_date, end_date),
     )
+    if status in ("queued", "running"):
+        progress = f"Computing the flow charts: {value}"
+        if ctx.triggered_id == "flow-job-poll-stations":
+            return dash.no_update, dash.no_update, dash.no_update, False, progress
+        return (
+            figures.placeholder(title, "Computing..."),
+            figures.placeholder(title2, "Computing..."),
+            job,
+            False,
+            progress,
+        )
+    if status == "failed":
+        return (
+            figures.placeholder(title, "Not available"),
+            figures.placeholder(title2, "Not available"),
+            None,
+            True,
+            f"The flow charts could not be computed: {value}",
+        )
+    df_flow, df_flow2 = value
+    watch = metrics.stopwatch()
 
-    df_flow["hour"] = df_flow["day"].dt.hour
-    df_flow2 = df_flow.groupby("hour")["flow"].agg([np.mean, np.sum]).reset_index()
+    fig = px.line(df_flow, x="day", y="cumulative_flow")
+    fig.update_layout(title=title, font={"size": 24})  # height=800,
 
     fig2 = px.bar(df_flow2, x="hour", y="mean")
-    fig2.update_layout(
-        title=f"Average Hourly Flow for {station}", font={"size": 24}  # height=800,
-    )
+    fig2.update_layout(title=title2, font={"size": 24})  # height=800,
+    watch.lap("figure")
 
-    return fig, fig2
+    return (
+        figures.compact(fig, "flow_graph"),
+        figures.compact(fig2, "flow_graph"),
+        None,
+        True,
+        None,
+    )
@@ -0,0 +1,29 @@
+"""
+Run with ``python -m pytest`` from the repository root.
+
+Tests taking the ``database`` fixture read the trips of the configured backend
+(``database_url_bbb`` by default) and are skipped without one; they change
+nothing in it. The host-wide shared cache and job queue are off, so tests
+never touch the files under ``data``; their own tests use temporary files.
+"""
+
+import os
+
+os.environ["SHARED_CACHE_PATH"] = ""
+os.environ["JOBS_PATH"] = ""
+
+import pytest
+
+from bluebikes import db
+
+
+@pytest.fixture(scope="session")
+def database():
+    if db.backend == "postgres" and not db.database_url:
+        pytest.skip("database_url_bbb is not set")
+    try:
+        with db.connect() as conn:
+            conn.exec_driver_sql("SELECT 1 FROM trips LIMIT 1")
+    except Exception as error:
+        pytest.skip(f"no trips to read: {error}")
+    return db
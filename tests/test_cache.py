@@ -0,0 +1,82 @@
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bluebikes import cache
+
+
+@pytest.fixture
+def version(monkeypatch):
+    """The data version the cache sees, as a one-item list to change."""
+    current = ["v1"]
+    monkeypatch.setattr(cache.db, "connect", contextlib.nullcontext)
+    monkeypatch.setattr(cache, "current_version", lambda conn: current[0])
+    monkeypatch.setattr(cache, "data_version_check_seconds", 0)
+    return current
+
+
+@pytest.fixture
+def results(version):
+    return cache.ResultCache()
+
+
+def _counted(results, calls):
+    @results.memoize(
+        lambda station_id, station_type, start_date: (
+            cache.scalar(station_id),
+            cache.role(station_type),
+            cache.day(start_date),
+        )
+    )
+    def query(station_id, station_role, start_date):
+        calls.append((station_id, station_role, start_date))
+        return pd.DataFrame({"n": [len(calls)]})
+
+    return query
+
+
+def test_equivalent_arguments_share_a_key(results):
+    calls = []
+    query = _counted(results, calls)
+    first = query(np.int64(3), "Start Station", "2023-01-01 10:00")
+    again = query(3, "start", pd.Timestamp("2023-01-01"))
+    assert calls == [(3, "start", "2023-01-01")]
+    pd.testing.assert_frame_equal(first, again)
+    assert query.canonical_args(np.int64(3), "End", "2023-01-01 23:59") == (
+        3,
+        "end",
+        "2023-01-01",
+    )
+    query(3, "end", "2023-01-01")
+    assert len(calls) == 2
+
+
+def test_cached_values_are_copies(results):
+    query = _counted(results, [])
+    query(3, "start", "2023-01-01")["n"] = 100
+    assert query(3, "start", "2023-01-01")["n"].tolist() == [1]
+
+
+def test_cached_only_reports_held_results(results):
+    query = _counted(results, [])
+    assert query.cached(3, "start", "2023-01-01") == (False, None)
+    query(3, "start", "2023-01-01")
+    found, value = query.cached(np.int64(3), "Start", "2023-01-01")
+    assert found and value["n"].tolist() == [1]
+
+
+def test_new_data_version_drops_results(results, version):
+    calls, cleared = [], []
+    results.on_new_data(lambda: cleared.append(True))
+    query = _counted(results, calls)
+    query(3, "start", "2023-01-01")
+    query(3, "start", "2023-01-01")
+    assert results.data_version() == "v1"
+    version[0] = "v2"
+    query(3, "start", "2023-01-01")
+    assert len(calls) == 2
+    assert cleared == [True]
+    assert results.data_version() == "v2"
+    assert results.stats()["invalidations"] == 1
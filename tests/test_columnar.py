@@ -0,0 +1,73 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from bluebikes import columnar
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter per backend, since the backend is chosen at import.
+script = """
+import pickle, sys
+from bluebikes import queries
+station_id, start, end, out = sys.argv[1:]
+station_id = int(station_id)
+results = {"station_basics": queries.station_basics.uncached(station_id, start, end)}
+for role in ("start", "end"):
+    results[f"top_destinations {role}"] = queries.top_destinations.uncached(
+        station_id, role, start, end
+    )
+with open(out, "wb") as f:
+    pickle.dump(results, f)
+"""
+
+
+def _run(backend, tmp_path, *args):
+    out = tmp_path / f"{backend}.pickle"
+    env = dict(os.environ, BLUEBIKES_BACKEND=backend, PARQUET_PATH=str(tmp_path))
+    subprocess.run(
+        [sys.executable, "-c", script, *map(str, args), str(out)],
+        cwd=root,
+        env=env,
+        check=True,
+    )
+    with open(out, "rb") as f:
+        return pickle.load(f)
+
+
+def _top(frame):
+    # Destinations tied with the 25th may be cut differently by each backend.
+    frame = frame[frame["Number of Trips"] > frame["Number of Trips"].min()]
+    return frame.sort_values(["Number of Trips", "name"]).reset_index(drop=True)
+
+
+def test_backends_agree(database, tmp_path):
+    if database.backend != "postgres":
+        pytest.skip("the Parquet files are exported from Postgres")
+    with database.connect() as conn:
+        last, station_id = conn.exec_driver_sql(
+            "SELECT MAX(MAX(started_at)) OVER (), start_station_id FROM trips"
+            " GROUP BY 2 ORDER BY COUNT(*) DESC LIMIT 1"
+        ).first()
+        since = (pd.Timestamp(last) - pd.DateOffset(months=3)).strftime("%Y-%m")
+        columnar.export(conn, str(tmp_path), since=since)
+    start = pd.Timestamp(since) + pd.Timedelta(days=3, hours=10)
+    end = pd.Timestamp(last).floor("D") - pd.Timedelta(hours=6)
+
+    postgres = _run("postgres", tmp_path, station_id, start, end)
+    duckdb = _run("columnar", tmp_path, station_id, start, end)
+
+    pd.testing.assert_frame_equal(
+        postgres["station_basics"], duckdb["station_basics"], check_dtype=False
+    )
+    assert postgres["station_basics"]["start_rides"][0] > 0
+    for role in ("start", "end"):
+        name = f"top_destinations {role}"
+        assert len(postgres[name]) == len(duckdb[name]) == 25
+        pd.testing.assert_frame_equal(
+            _top(postgres[name]), _top(duckdb[name]), check_dtype=False
+        )
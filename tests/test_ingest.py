@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from bluebikes import cache, ingest
+
+month = pd.Period("2022-03", "M")
+
+
+def _month_file(conn, path):
+    """The month's trips in the current file layout."""
+    trips = pd.read_sql(
+        f"""
+        SELECT t.started_at, t.ended_at, s.name AS start_station_name,
+        e.name AS end_station_name, t.member_casual
+        FROM trips t
+        INNER JOIN stations s ON t.start_station_id = s.station_id
+        INNER JOIN stations e ON t.end_station_id = e.station_id
+        WHERE t.started_at >= '{month.start_time:%Y-%m-%d}'
+        AND t.started_at < '{(month + 1).start_time:%Y-%m-%d}'
+        """,
+        con=conn,
+    )
+    trips.to_csv(path, index=False)
+    return len(trips)
+
+
+def _month_trips(conn):
+    return conn.exec_driver_sql(
+        "SELECT COUNT(*) FROM trips WHERE date_trunc('month', started_at) = %s",
+        (f"{month}-01",),
+    ).scalar()
+
+
+def test_reingested_month_changes_data_version(database, tmp_path):
+    if database.backend != "postgres":
+        pytest.skip("trips are ingested into Postgres")
+    path = tmp_path / f"{month.strftime('%Y%m')}-bluebikes-tripdata.csv"
+    with database.get_engine().connect() as conn:
+        transaction = conn.begin()
+        try:
+            n_trips = _month_file(conn, path)
+            if n_trips == 0 or n_trips != _month_trips(conn):
+                pytest.skip(f"{month} has no trips, or trips of unknown stations")
+            before = cache.current_version(conn)
+            counts = ingest.ingest(conn, str(path))
+            ingest.record_loads(conn, [counts["month"]])
+            after = cache.current_version(conn)
+
+            assert counts["replaced"] == counts["loaded"] == n_trips
+            assert _month_trips(conn) == n_trips
+            # The newest trip is unchanged, the load time is not.
+            assert after != before
+            assert after.startswith(f"{cache.latest_trip(conn)}, loaded ")
+        finally:
+            transaction.rollback()
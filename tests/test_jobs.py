@@ -0,0 +1,122 @@
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from bluebikes import jobs, queries
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+args = (3, "2023-01-01", "2023-03-01")
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(path=str(tmp_path / "jobs" / "jobs.sqlite"), timeout=60)
+
+
+def test_submit_dedupes_equivalent_queries(queue):
+    job_id = queue.submit(queries.station_basics, args, "v1")
+    same = (np.int64(3), "2023-01-01 08:00", "2023-03-01 23:00")
+    assert queue.submit(queries.station_basics, same, "v1") == job_id
+    assert queue.submit(queries.station_basics, args, "v2") != job_id
+    assert queue.submit(queries.station_basics, (4,) + args[1:], "v1") != job_id
+    assert (queue.submitted, queue.reused) == (3, 1)
+
+
+def test_poll_follows_the_job(queue):
+    first = queue.submit(queries.station_basics, args, "v1")
+    second = queue.submit(queries.station_basics, (4,) + args[1:], "v1")
+    assert queue.poll(second) == ("queued", "waiting for a worker, 1 queued ahead")
+
+    job_id, name, _ = queue.claim()
+    assert job_id == first
+    assert jobs._resolve(name) is queries.station_basics
+    status, message = queue.poll(first)
+    assert status == "running" and message.startswith("running for")
+
+    queue.finish(first, {"value": 1})
+    assert queue.poll(first) == ("done", {"value": 1})
+    assert queue.submit(queries.station_basics, args, "v1") == first
+
+
+def test_failed_job_is_submitted_again(queue):
+    job_id = queue.submit(queries.station_basics, args, "v1")
+    queue.claim()
+    queue.fail(job_id, "ValueError: boom")
+    assert queue.poll(job_id) == ("failed", "ValueError: boom")
+    assert queue.submit(queries.station_basics, args, "v1") != job_id
+
+
+def test_job_no_worker_takes_fails(queue):
+    job_id = queue.submit(queries.station_basics, args, "v1")
+    queue.timeout = 0
+    status, message = queue.poll(job_id)
+    assert status == "failed" and message.startswith("No worker took the job")
+    assert queue.claim() is None
+
+
+def test_job_of_crashed_worker(queue):
+    job_id = queue.submit(queries.station_basics, args, "v1")
+    crash = (
+        "import os, sys\n"
+        "from bluebikes import jobs\n"
+        "queue = jobs.JobQueue(path=sys.argv[1])\n"
+        "print(queue.claim()[0], flush=True)\n"
+        "os._exit(1)\n"
+    )
+    worker = subprocess.run(
+        [sys.executable, "-c", crash, queue.path],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    assert int(worker.stdout) == job_id
+    assert queue.poll(job_id)[0] == "running"
+
+    # A pool starting after the crash queues the job again...
+    assert queue.requeue() == 1
+    assert queue.poll(job_id)[0] == "queued"
+    assert queue.claim()[0] == job_id
+    # ...and one still running it past the timeout fails it.
+    queue.timeout = 0
+    assert queue.expire() == {os.getpid()}
+    status, message = queue.poll(job_id)
+    assert status == "failed" and message.startswith("Timed out")
+
+
+def test_worker_runs_job(database, queue):
+    with database.connect() as conn:
+        station_id, last = conn.exec_driver_sql(
+            "SELECT start_station_id, MAX(MAX(started_at)) OVER () FROM trips"
+            " GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1"
+        ).first()
+    query_args = (station_id, "2023-01-01", str(last))
+    job_id = queue.submit(queries.station_basics, query_args, "v1")
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "bluebikes.jobs",
+            "--worker",
+            "--parent",
+            str(os.getpid()),
+        ],
+        cwd=root,
+        env=dict(os.environ, JOBS_PATH=queue.path),
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while queue.poll(job_id)[0] in ("queued", "running"):
+            assert time.monotonic() < deadline, "the job did not finish"
+            time.sleep(0.1)
+    finally:
+        worker.kill()
+        worker.wait()
+    status, value = queue.poll(job_id)
+    assert status == "done"
+    canonical = queries.station_basics.canonical_args(*query_args)
+    assert value.equals(queries.station_basics.uncached(*canonical))
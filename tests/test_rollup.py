@@ -0,0 +1,137 @@
+import pandas as pd
+import pytest
+
+from bluebikes import db, rollup, statements
+
+covered = (pd.Timestamp("2022-01-01"), pd.Timestamp("2022-12-31"))
+
+
+@pytest.fixture
+def coverage(monkeypatch):
+    monkeypatch.setattr(rollup, "coverage", lambda: covered)
+
+
+def _ts(value):
+    return pd.Timestamp(value)
+
+
+def test_split_without_rollups(monkeypatch):
+    monkeypatch.setattr(rollup, "coverage", lambda: None)
+    assert rollup.split_range("2022-03-04", "2022-05-10") == (
+        None,
+        [(_ts("2022-03-04"), _ts("2022-05-10"), True)],
+    )
+
+
+def test_split_whole_days(coverage):
+    # Only the trips at midnight of the last day are read from trips.
+    assert rollup.split_range("2022-03-04", "2022-05-10") == (
+        (_ts("2022-03-04"), _ts("2022-05-10")),
+        [(_ts("2022-05-10"), _ts("2022-05-10"), True)],
+    )
+
+
+def test_split_partial_days(coverage):
+    start, end = _ts("2022-03-04 13:30"), _ts("2022-05-10 08:15")
+    assert rollup.split_range(start, end) == (
+        (_ts("2022-03-05"), _ts("2022-05-10")),
+        [(start, _ts("2022-03-05"), False), (_ts("2022-05-10"), end, True)],
+    )
+
+
+def test_split_beyond_coverage(coverage):
+    start, end = _ts("2021-12-20 06:00"), _ts("2023-01-15")
+    assert rollup.split_range(start, end) == (
+        covered,
+        [(start, covered[0], False), (covered[1], end, True)],
+    )
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        ("2022-06-01 08:00", "2022-06-01 20:00"),
+        ("2022-06-01 08:00", "2022-06-02 07:00"),
+        ("2023-02-01", "2023-03-01"),
+    ],
+)
+def test_split_without_full_days(coverage, start, end):
+    assert rollup.split_range(start, end) == (None, [(_ts(start), _ts(end), True)])
+
+
+def test_router_reads_rollup_only_when_covered(database, monkeypatch, coverage):
+    query = rollup.station_counts_query(
+        statements.Params(), "start", "2022-03-04", "2022-05-10"
+    )
+    assert rollup.stations_table in query
+    monkeypatch.setattr(rollup, "coverage", lambda: None)
+    query = rollup.station_counts_query(
+        statements.Params(), "start", "2022-03-04", "2022-05-10"
+    )
+    assert rollup.stations_table not in query
+
+
+def _read(query_func, *args):
+    params = statements.Params()
+    query = query_func(params, *args)
+    with db.connect() as conn:
+        counts = statements.read(conn, "test_counts", query, params, "key")
+    return counts.sort_index()
+
+
+def _raw_counts(column, start, end, where=""):
+    with db.connect() as conn:
+        counts = pd.read_sql(
+            f"""
+            SELECT {column} AS key, COUNT(*) AS n_trips
+            FROM trips
+            WHERE started_at BETWEEN %(start)s AND %(end)s
+            AND {column} IS NOT NULL {where}
+            GROUP BY 1""",
+            con=conn,
+            params={"start": str(start), "end": str(end)},
+            index_col="key",
+        )
+    return counts["n_trips"].sort_index()
+
+
+def _trip_range(days):
+    with db.connect() as conn:
+        last = pd.Timestamp(
+            conn.exec_driver_sql("SELECT MAX(started_at) FROM trips").scalar()
+        )
+    return last - pd.Timedelta(days=days, hours=5), last - pd.Timedelta(hours=7)
+
+
+@pytest.mark.parametrize("station_role", ["start", "end"])
+def test_routed_counts_match_trips(database, monkeypatch, station_role):
+    if rollup.coverage() is None:
+        pytest.skip("no rollups")
+    start, end = _trip_range(40)
+    column = f"{station_role}_station_id"
+    raw = _raw_counts(column, start, end)
+    routed = _read(rollup.station_counts_query, station_role, start, end)
+    pd.testing.assert_series_equal(
+        routed["n_trips"], raw, check_dtype=False, check_names=False
+    )
+    monkeypatch.setattr(rollup, "coverage", lambda: None)
+    direct = _read(rollup.station_counts_query, station_role, start, end)
+    pd.testing.assert_frame_equal(routed, direct, check_dtype=False)
+
+
+def test_routed_pair_counts_match_trips(database):
+    if rollup.coverage() is None:
+        pytest.skip("no rollups")
+    start, end = _trip_range(40)
+    with db.connect() as conn:
+        station_id = conn.exec_driver_sql(
+            "SELECT start_station_id FROM trips"
+            " GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1"
+        ).scalar()
+    raw = _raw_counts(
+        "end_station_id", start, end, f"AND start_station_id = {int(station_id)}"
+    )
+    routed = _read(rollup.pair_counts_query, "start", station_id, start, end)
+    pd.testing.assert_series_equal(
+        routed["n_trips"], raw, check_dtype=False, check_names=False
+    )
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+
+import pytest
+
+from bluebikes import shared
+
+
+@pytest.fixture
+def store(tmp_path):
+    return shared.SharedCache(path=str(tmp_path / "cache" / "cache.sqlite"))
+
+
+def _in_thread(func, timeout=10):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "compute did not return"
+    return result[0]
+
+
+def test_compute_stores_value(store):
+    calls = []
+    assert store.compute("a", "v1", lambda: calls.append(1) or 41) == 41
+    assert store.compute("a", "v1", lambda: calls.append(1) or 42) == 41
+    assert store.compute("a", "v2", lambda: calls.append(1) or 43) == 43
+    assert len(calls) == 2
+
+
+def test_nested_compute_does_not_deadlock(store):
+    # Memoized queries call one another, each holding its key's lock while
+    # the next one takes its own.
+    def nested(depth):
+        if depth == 0:
+            return 0
+        return store.compute(f"key {depth}", "v1", lambda: nested(depth - 1) + 1)
+
+    assert _in_thread(lambda: nested(300)) == 300
+    assert os.listdir(store.path + ".locks") == []
+
+
+def test_concurrent_misses_compute_once(store):
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "value"
+
+    threads = [
+        threading.Thread(target=store.compute, args=("key", "v1", slow))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    assert store.coalesced == 3
+
+
+def test_disabled_computes_every_time():
+    store = shared.SharedCache(path="")
+    calls = []
+    assert store.compute("a", "v1", lambda: calls.append(1) or 1) == 1
+    assert store.compute("a", "v1", lambda: calls.append(1) or 1) == 1
+    assert len(calls) == 2
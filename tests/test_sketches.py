@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bluebikes import queries, rollup, sketches
+
+
+def _within_error(estimate, exact):
+    estimate, exact = np.asarray(estimate), np.asarray(exact)
+    error = sketches.relative_accuracy * np.abs(exact) + sketches.min_value
+    return np.all(np.abs(estimate - exact) <= error + 1e-9)
+
+
+def _sketch(values):
+    bins, counts = np.unique(sketches.bin_values(values), return_counts=True)
+    return bins, counts
+
+
+samples = {
+    "lognormal": lambda rng, n: rng.lognormal(2.5, 0.8, n),
+    "uniform": lambda rng, n: rng.uniform(0.5, 40, n),
+    "with zeros": lambda rng, n: np.where(
+        rng.random(n) < 0.2, 0, rng.exponential(2, n)
+    ),
+}
+
+
+@pytest.mark.parametrize("name", samples)
+@pytest.mark.parametrize("n", [1, 2, 101, 10_000])
+def test_quantile_within_relative_accuracy(name, n):
+    values = samples[name](np.random.default_rng(n), n)
+    bins, counts = _sketch(values)
+    assert _within_error(sketches.quantile(bins, counts), np.median(values))
+    exact_disc = np.sort(values)[int(np.ceil(0.5 * n)) - 1]
+    assert _within_error(sketches.quantile(bins, counts, discrete=True), exact_disc)
+
+
+def test_merged_sketches_read_like_one():
+    rng = np.random.default_rng(0)
+    days = [rng.lognormal(2.5, 0.8, rng.integers(1, 500)) for _ in range(30)]
+    merged = pd.concat(
+        pd.DataFrame(dict(zip(("bin", "n"), _sketch(values)))) for values in days
+    )
+    merged = merged.groupby("bin", as_index=False)["n"].sum()
+    values = np.concatenate(days)
+    assert merged["n"].sum() == len(values)
+    assert _within_error(
+        sketches.quantile(merged["bin"], merged["n"]), np.median(values)
+    )
+
+
+def test_medians_match_quantile():
+    rng = np.random.default_rng(1)
+    rows, expected = [], {}
+    for key in range(5):
+        for metric in sketches.metrics:
+            values = rng.lognormal(1 + key, 0.5, 50 + key)
+            bins, counts = _sketch(values)
+            rows.append(
+                pd.DataFrame({"key": key, "metric": metric, "bin": bins, "n": counts})
+            )
+            expected[key, metric] = sketches.quantile(
+                bins, counts, discrete=metric == "speed"
+            )
+    medians = sketches.medians(pd.concat(rows), discrete=["speed"])
+    for (key, metric), value in expected.items():
+        assert medians.loc[key, sketches.metrics[metric][1]] == pytest.approx(value)
+
+
+@pytest.mark.parametrize("date_type", ["Month", "Week", "Day of Week"])
+def test_time_bucket_medians_match_exact(database, monkeypatch, date_type):
+    if sketches.exact_medians or rollup.coverage() is None:
+        pytest.skip("no rollup sketches")
+    with database.connect() as conn:
+        station_id, last = conn.exec_driver_sql(
+            "SELECT start_station_id, MAX(MAX(started_at)) OVER () FROM trips"
+            " GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1"
+        ).first()
+    start = pd.Timestamp(last) - pd.Timedelta(days=120)
+    args = (station_id, "start", date_type, start, last)
+    from_sketches = queries.time_buckets.uncached(*args)
+    monkeypatch.setattr(sketches, "exact_medians", True)
+    exact = queries.time_buckets.uncached(*args)
+
+    assert from_sketches["Date"].tolist() == exact["Date"].tolist()
+    assert (
+        from_sketches["Number of Trips"].tolist() == exact["Number of Trips"].tolist()
+    )
+    for _, label in sketches.metrics.values():
+        assert _within_error(from_sketches[label], exact[label]), label